@@ -0,0 +1,48 @@
+"""
+Compare the latency of one `adb shell` process per command, as previously used by
+AndroidDevice, with the persistent shell session of android.shell, on a connected device.
+
+Usage: python benchmarks/adb_shell_benchmark.py [--count N] [--serial SERIAL] [--command CMD]
+"""
+import argparse
+import statistics
+import subprocess
+import time
+
+from pirogue_evidence_collector.android.shell import AdbShellSession
+
+
+def subprocess_shell(serial: str, command: str) -> str:
+    adb = f'adb -s {serial}' if serial else 'adb'
+    return subprocess.check_output(f'{adb} shell {command}', shell=True, stderr=subprocess.PIPE).decode('utf-8')
+
+
+def measure(label: str, func, count: int):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f'  {label:<24} median {statistics.median(latencies):8.2f} ms  '
+          f'max {max(latencies):8.2f} ms  total {sum(latencies) / 1000:6.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='adb shell latency benchmark')
+    parser.add_argument('--count', type=int, default=50, help='Number of commands run by each method')
+    parser.add_argument('--serial', default=None, help='Serial number of the device')
+    parser.add_argument('--command', default='getprop ro.build.version.sdk', help='Command to run')
+    args = parser.parse_args()
+
+    print(f'{args.count} x {args.command}')
+    measure('adb shell per command', lambda: subprocess_shell(args.serial, args.command), args.count)
+    session = AdbShellSession(serial=args.serial)
+    start = time.perf_counter()
+    session.start()
+    print(f'  session start            {(time.perf_counter() - start) * 1000:8.2f} ms')
+    measure('persistent session', lambda: session.run(args.command), args.count)
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
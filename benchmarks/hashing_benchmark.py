@@ -0,0 +1,60 @@
+"""
+Compare the serial 4 KiB-chunk hashing previously used by MetadataExporter with the
+multi-digest engine of utils.hashing, on a single large file and on a folder of files.
+
+Usage: python benchmarks/hashing_benchmark.py [--size-mib N] [--files N] [--dir DIR]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from pirogue_evidence_collector.utils.hashing import DEFAULT_ALGORITHMS, hash_file, hash_files
+
+
+def serial_hash(path: Path) -> dict:
+    hashes = [hashlib.new(algorithm) for algorithm in DEFAULT_ALGORITHMS]
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(4096), b''):
+            for h in hashes:
+                h.update(chunk)
+    return {algorithm: h.hexdigest() for algorithm, h in zip(DEFAULT_ALGORITHMS, hashes)}
+
+
+def measure(label: str, func, size: int):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f'  {label:<32} {elapsed:8.3f} s  {size / elapsed / 1024 / 1024:8.1f} MiB/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='File hashing benchmark')
+    parser.add_argument('--size-mib', type=int, default=256, help='Size of each generated file')
+    parser.add_argument('--files', type=int, default=4, help='Number of generated files')
+    parser.add_argument('--dir', type=Path, default=None, help='Where to generate the files')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        paths = []
+        for i in range(args.files):
+            path = Path(tmp_dir) / f'file-{i}.bin'
+            with path.open('wb') as f:
+                for _ in range(args.size_mib):
+                    f.write(os.urandom(1024 * 1024))
+            paths.append(path)
+        size = args.size_mib * 1024 * 1024
+        print(f'Single file: {args.size_mib} MiB, {", ".join(DEFAULT_ALGORITHMS)}')
+        expected = measure('serial, 4 KiB chunks', lambda: serial_hash(paths[0]), size)
+        result = measure('hash_file', lambda: hash_file(paths[0]), size)
+        assert result == expected
+        print(f'{args.files} files')
+        measure('serial, 4 KiB chunks', lambda: [serial_hash(path) for path in paths], size * len(paths))
+        measure('hash_files', lambda: hash_files(paths), size * len(paths))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare the JSON throughput of the standard json module with the serializer backend on
+synthetic tshark EK packets and socket traces shaped like real captures.
+
+Usage: python benchmarks/serializer_benchmark.py [--records N]
+"""
+import argparse
+import json
+import random
+import time
+
+from pirogue_evidence_collector.utils import serializer
+
+
+def make_ek_packet(i: int) -> dict:
+    body = bytes(random.getrandbits(8) for _ in range(random.randint(64, 2048))).hex()
+    return {
+        'timestamp': str(1700000000000 + i),
+        'layers': {
+            'frame': {
+                'frame_frame_time_epoch': f'{1700000000 + i}.123456',
+                'frame_frame_len': str(len(body) // 2 + 66),
+                'frame_frame_protocols': 'eth:ethertype:ip:tcp:tls:http2',
+            },
+            'communityid_communityid': '1:AIrXguRV7sifOffwEmvTSWUaUak=',
+            'eth': {'eth_eth_src': '00:11:22:33:44:55', 'eth_eth_dst': '66:77:88:99:aa:bb'},
+            'ip': {
+                'ip_ip_src': '10.8.0.2', 'ip_ip_src_host': '10.8.0.2',
+                'ip_ip_dst': '142.250.74.110', 'ip_ip_dst_host': 'www.google.com',
+                'ip_ip_ttl': '64', 'ip_ip_proto': '6',
+            },
+            'tcp': {'tcp_tcp_srcport': '40000', 'tcp_tcp_dstport': '443', 'tcp_tcp_seq': str(i * 1460)},
+            'http2': {
+                'http2_http2_headers': '',
+                'http2_http2_header_name': [':method', ':path', ':authority', 'user-agent', 'accept'],
+                'http2_http2_header_value': ['POST', f'/api/v1/items/{i}', 'www.google.com', 'okhttp/4.9.0', '*/*'],
+                'http2_http2_body_reassembled_data': ':'.join(body[j:j + 2] for j in range(0, len(body), 2)),
+            },
+        },
+    }
+
+
+def make_socket_trace(i: int) -> dict:
+    return {
+        'type': 'socket_traces',
+        'dump': 'socket_trace.json',
+        'pid': 4242,
+        'process': 'com.example.app',
+        'data_type': 'json',
+        'timestamp': 1700000000000 + i,
+        'data': {
+            'socket_fd': 42,
+            'socket_type': 'tcp6',
+            'pid': 4242,
+            'thread_id': 4300 + i % 8,
+            'socket_event_type': random.choice(['write', 'read', 'sendto', 'recvfrom']),
+            'dest_ip': '::ffff:142.250.74.110',
+            'dest_port': 443,
+            'local_ip': '::ffff:10.8.0.2',
+            'local_port': 40000 + i % 50,
+            'stack': [
+                {
+                    'class': f'com.example.network.Layer{depth}',
+                    'file': f'Layer{depth}.java',
+                    'line': 100 + depth,
+                    'method': 'execute',
+                    'is_native': False,
+                    'str': f'com.example.network.Layer{depth}.execute(Layer{depth}.java:{100 + depth})',
+                }
+                for depth in range(30)
+            ],
+        },
+    }
+
+
+def measure(label: str, func, payload_size: int):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'  {label:<32} {elapsed:8.3f} s  {payload_size / elapsed / 1024 / 1024:8.1f} MiB/s')
+
+
+def run(name: str, records: list):
+    lines = [json.dumps(r) for r in records]
+    size = sum(len(line) for line in lines)
+    print(f'{name}: {len(records)} records, {size / 1024 / 1024:.1f} MiB')
+    measure('parse, json', lambda: [json.loads(line) for line in lines], size)
+    measure(f'parse, {serializer.BACKEND}', lambda: [serializer.loads(line) for line in lines], size)
+    measure('dump indented, json', lambda: json.dumps(records, indent=2), size)
+    measure(f'dump indented, {serializer.BACKEND}', lambda: serializer.dumps(records, pretty=True), size)
+    measure(f'dump compact, {serializer.BACKEND}', lambda: serializer.dumps(records, pretty=False), size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON serializer benchmark')
+    parser.add_argument('--records', type=int, default=20000)
+    args = parser.parse_args()
+    random.seed(0)
+    run('tshark EK packets', [make_ek_packet(i) for i in range(args.records)])
+    run('socket traces', [make_socket_trace(i) for i in range(args.records)])
+
+
+if __name__ == '__main__':
+    main()
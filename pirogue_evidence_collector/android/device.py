@@ -1,23 +1,85 @@
+import ipaddress
 import logging
+import shlex
+import signal
 import subprocess
-import time
-from subprocess import CalledProcessError
-from tempfile import NamedTemporaryFile
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import List, Optional
 
-from pirogue_evidence_collector.frida.server import FridaServer
+from pirogue_evidence_collector.android.properties import device_properties_cache, parse_getprop
+from pirogue_evidence_collector.android.shell import AdbShellSession, AdbShellSessionError
+from pirogue_evidence_collector.frida.server import FridaServer, FridaServerCache
 from pirogue_evidence_collector.system.apt import get_install_packages
+from pirogue_evidence_collector.utils.startup import wait_until
 
 log = logging.getLogger(__name__)
 
+DEVICE_READY_TIMEOUT = 10
+FRIDA_SERVER_READY_TIMEOUT = 5
+
+
+def list_devices() -> List[str]:
+    # Serial numbers of the devices connected and authorized
+    output = subprocess.check_output('adb devices', shell=True, stderr=subprocess.PIPE).decode('utf-8')
+    serials = []
+    for line in output.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1] == 'device':
+            serials.append(fields[0])
+    return serials
+
+
+def parse_ip_addresses(output: str) -> List[str]:
+    # Addresses listed by ip -o addr show reachable from the network, excluding loopback and
+    # link-local ones
+    addresses = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or fields[2] not in ('inet', 'inet6'):
+            continue
+        try:
+            address = ipaddress.ip_interface(fields[3]).ip
+        except ValueError:
+            continue
+        if address.is_loopback or address.is_link_local:
+            continue
+        if str(address) not in addresses:
+            addresses.append(str(address))
+    return addresses
+
+
+def parse_mac_addresses(output: str) -> List[str]:
+    # MAC addresses of the Ethernet-like interfaces listed as up by ip -o link show, e.g. wlan0
+    addresses = []
+    for line in output.splitlines():
+        fields = line.split()
+        if 'link/ether' not in fields or len(fields) <= fields.index('link/ether') + 1:
+            continue
+        flags = line[line.find('<') + 1:line.find('>')].split(',')
+        address = fields[fields.index('link/ether') + 1].lower()
+        # Android hides the real address of the interfaces behind 02:00:00:00:00:00 for some users
+        if 'UP' not in flags or address in ('00:00:00:00:00:00', '02:00:00:00:00:00'):
+            continue
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
 
 class AndroidDevice:
 
-    def __init__(self):
+    def __init__(self, serial: Optional[str] = None, persistent_shell: bool = True, frida_server_mirror=None):
         self.frida_server_name = 'frydaxx-server'
         self.frida_server_install_dir = f'/data/local/tmp/{self.frida_server_name}'
+        self.frida_server_cache = FridaServerCache(mirror_dir=frida_server_mirror)
         self.has_adb_root = False
         self.requires_su = False
         self.rooted = False
+        # Serial number of the device, the only connected one if not set
+        self.serial = serial
+        self.adb = f'adb -s {shlex.quote(serial)}' if serial else 'adb'
+        # The shell session is opened on the first command, once adbd has been restarted as root
+        self.persistent_shell = persistent_shell
+        self.shell_session = None
         self.is_rooted()
         self._check_frida_server_installed()
         self.__connect()
@@ -41,19 +103,41 @@ class AndroidDevice:
             ('api_level', 'ro.build.version.sdk'),
         ]
         device_properties = {}
+        try:
+            properties = self.get_properties()
+        except CalledProcessError as e:
+            log.error(f'Unable to get the properties of the device: {e}')
+            properties = {}
         for name, key in props:
-            try:
-                device_properties[name] = self.get_property(key).strip()
-            except Exception:
-                pass
+            if key in properties:
+                device_properties[name] = properties[key].strip()
         # Get IMEI
         try:
-            imei = self.adb_shell("""service call iphonesubinfo 1 | awk -F "'" '{print $2}' | sed '1 d' | tr -d '.' | awk '{print}' ORS=""")
-            device_properties['imei'] = imei.strip()
+            # The IMEI is spread over the quoted columns of the parcel dump, after its first line
+            parcel = self.adb_shell('service call iphonesubinfo 1')
+            imei = ''.join(line.split("'")[1] for line in parcel.splitlines()[1:] if "'" in line)
+            device_properties['imei'] = imei.replace('.', '').strip()
         except Exception:
             pass
+        device_properties['properties'] = properties
         return device_properties
 
+    def get_ip_addresses(self) -> list:
+        try:
+            output = self.adb_shell('ip -o addr show')
+        except CalledProcessError as e:
+            log.error(f'Unable to list the IP addresses of the device: {e}')
+            return []
+        return parse_ip_addresses(output)
+
+    def get_mac_addresses(self) -> list:
+        try:
+            output = self.adb_shell('ip -o link show')
+        except CalledProcessError as e:
+            log.error(f'Unable to list the MAC addresses of the device: {e}')
+            return []
+        return parse_mac_addresses(output)
+
     def get_architecture(self):
         try:
             cpu = self.get_property('ro.product.cpu.abi')
@@ -72,7 +156,7 @@ class AndroidDevice:
     def is_rooted(self):
         try:
             output = subprocess.check_output(
-                'adb root',
+                f'{self.adb} root',
                 shell=True,
                 stderr=subprocess.PIPE, )
             self.has_adb_root = True
@@ -83,10 +167,10 @@ class AndroidDevice:
             ):
                 self.has_adb_root = False
                 try:
-                    time.sleep(1)
+                    self._wait_for_device()
                     # Check whether root escalation is possible through su.
                     subprocess.check_call(
-                        'adb shell su -c "echo 1"',
+                        f'{self.adb} shell su -c "echo 1"',
                         shell=True,
                         stdout=subprocess.PIPE,
                         stderr=subprocess.PIPE, )
@@ -95,30 +179,79 @@ class AndroidDevice:
                     pass
         except CalledProcessError as e:
             pass
+        if self.has_adb_root:
+            # adbd restarts when it switches to root
+            self._wait_for_device()
         self.rooted = self.has_adb_root or self.requires_su
+        # adbd may have been restarted as root
+        self.invalidate_properties()
         return self.rooted
 
+    def _get_shell_session(self):
+        if not self.persistent_shell:
+            return None
+        if self.shell_session is None:
+            self.shell_session = AdbShellSession(serial=self.serial, su=self.requires_su)
+        return self.shell_session
+
+    def close(self):
+        if self.shell_session:
+            self.shell_session.close()
+            self.shell_session = None
+
+    def _wait_for_device(self):
+        try:
+            subprocess.check_call(
+                f'{self.adb} wait-for-device',
+                shell=True,
+                timeout=DEVICE_READY_TIMEOUT,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except (CalledProcessError, subprocess.TimeoutExpired) as e:
+            log.warning(f'The device is not ready: {e}')
+
     def adb_shell(self, command):
+        session = self._get_shell_session()
+        if session:
+            try:
+                return session.run(command)
+            except AdbShellSessionError as e:
+                # Commands are run by a dedicated adb shell from now on
+                log.warning(f'{e}, falling back to one adb shell per command')
+                self.persistent_shell = False
+                self.close()
+            except TimeoutExpired as e:
+                # The session has been closed, it is started again by the next command
+                log.warning(f'{e}, running it again with a dedicated adb shell')
+                return self._adb_shell_subprocess(command, timeout=session.timeout)
+        return self._adb_shell_subprocess(command)
+
+    def _adb_shell_subprocess(self, command, timeout=None):
         if self.requires_su:
             command = f'su -c "{command}"'
-        output = subprocess.check_output(
-            f'adb shell {command}',
-            shell=True,
-            stderr=subprocess.PIPE)
+        try:
+            output = subprocess.check_output(
+                f'{self.adb} shell {command}',
+                shell=True,
+                stderr=subprocess.PIPE,
+                timeout=timeout)
+        except TimeoutExpired as e:
+            # The callers handle the failed commands, the command has been killed
+            raise CalledProcessError(-signal.SIGKILL, e.cmd, e.output, e.stderr) from e
         return output.decode('utf-8')
 
     def adb_shell_no_wait(self, command):
         try:
             if self.requires_su:
                 command = f'su -c "{command}"'
-            subprocess.Popen(f'adb shell {command}', shell=True)
+            subprocess.Popen(f'{self.adb} shell {command}', shell=True)
         except CalledProcessError as e:
             raise e
 
     def adb_push(self, local_file, to):
         try:
             subprocess.check_call(
-                f'adb push {local_file} {to}',
+                f'{self.adb} push {local_file} {to}',
                 shell=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE)
@@ -128,16 +261,30 @@ class AndroidDevice:
     def adb_pull(self, device_path, local_path):
         try:
             subprocess.check_call(
-                f'adb pull {device_path} {local_path}',
+                f'{self.adb} pull {device_path} {local_path}',
                 shell=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE)
         except CalledProcessError as e:
             raise e
 
+    def get_properties(self, refresh: bool = False) -> dict:
+        # All the properties are fetched at once and shared by the lookups until they expire
+        if refresh:
+            self.invalidate_properties()
+        return device_properties_cache.get(self.serial, lambda: parse_getprop(self.adb_shell('getprop')))
+
+    def invalidate_properties(self):
+        device_properties_cache.invalidate(self.serial)
+
     def get_property(self, key: str) -> str:
-        value = self.adb_shell(f'getprop {key}')
-        return value
+        return self.get_properties().get(key, '')
+
+    def set_property(self, key: str, value: str):
+        try:
+            self.adb_shell(f'setprop {key} {value}')
+        finally:
+            self.invalidate_properties()
 
     def _check_frida_server_running(self):
         try:
@@ -183,6 +330,12 @@ class AndroidDevice:
             log.info(f'Starting Frida server...')
             self.adb_shell_no_wait(f'{self.frida_server_install_dir} --daemonize')
 
+    def wait_for_frida_server(self, timeout: float = FRIDA_SERVER_READY_TIMEOUT) -> bool:
+        if wait_until(self._check_frida_server_running, timeout):
+            return True
+        log.warning(f'Frida server is not running after {timeout} seconds')
+        return False
+
     def stop_frida_server(self):
         log.info(f'Stopping Frida server...')
         try:
@@ -190,12 +343,25 @@ class AndroidDevice:
         except Exception as e:
             log.error(e)
 
+    def get_frida_server_sha256(self):
+        try:
+            return self.adb_shell(f'sha256sum {self.frida_server_install_dir}').split()[0]
+        except (CalledProcessError, IndexError):
+            return None
+
     def install_latest_frida_server(self):
         frida_client_version = self.get_frida_client_version()
-        log.info(f'Installing the matching version of frida-server as {self.frida_server_name}...')
-        with NamedTemporaryFile(mode='wb') as frida_server:
-            FridaServer.download_frida_server(self.get_architecture(), frida_server.name, 'android', frida_client_version)
-            frida_server.seek(0)
-            self.adb_push(frida_server.name, self.frida_server_install_dir)
-            self.adb_shell(f'chmod +x {self.frida_server_install_dir}')
-            log.info('Matching version of frida-server successfully installed...')
+        frida_server = FridaServer.get_frida_server(
+            self.get_architecture(), 'android', frida_client_version, self.frida_server_cache)
+        if frida_server is None:
+            return
+        # The binary on the device is compared to the cached one, an identical one is not pushed again
+        if self.get_frida_server_sha256() == frida_server['sha256']:
+            log.info(f'frida-server {frida_server["version"]} is already installed as {self.frida_server_name}...')
+            return
+        log.info(f'Installing frida-server {frida_server["version"]} as {self.frida_server_name}...')
+        self.adb_push(self.frida_server_cache.path(frida_server), self.frida_server_install_dir)
+        self.adb_shell(f'chmod +x {self.frida_server_install_dir}')
+        if self.get_frida_server_sha256() not in (None, frida_server['sha256']):
+            raise Exception('The frida-server installed on the device does not match the downloaded one')
+        log.info('Matching version of frida-server successfully installed...')
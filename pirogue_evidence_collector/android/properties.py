@@ -0,0 +1,74 @@
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+DEFAULT_PROPERTIES_TTL = 60
+
+_PROPERTY_LINE = re.compile(r'^\[([^\]]+)\]: \[(.*?)\]$', re.MULTILINE | re.DOTALL)
+
+
+def parse_getprop(output: str) -> Dict[str, str]:
+    # Lines of getprop are formatted as [key]: [value], a value may span several lines
+    return {match.group(1): match.group(2) for match in _PROPERTY_LINE.finditer(output)}
+
+
+class DevicePropertiesCache:
+    """
+    Snapshots of the system properties of the devices, by serial number.
+
+    A snapshot is fetched with a single getprop call and served until it is older than
+    ``ttl`` seconds or invalidated, e.g. after a property has been set. The snapshots of
+    different devices are fetched concurrently, the concurrent lookups of the same device
+    share a single fetch.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_PROPERTIES_TTL):
+        self.ttl = ttl
+        self._snapshots = {}
+        # Incremented when the snapshot of a device is invalidated
+        self._generations = {}
+        self._fetch_locks = {}
+        self._lock = threading.Lock()
+
+    def _fresh_snapshot(self, serial: Optional[str]) -> Optional[Dict[str, str]]:
+        with self._lock:
+            snapshot = self._snapshots.get(serial)
+            if snapshot and time.monotonic() - snapshot[0] < self.ttl:
+                return snapshot[1]
+            return None
+
+    def get(self, serial: Optional[str], fetch: Callable[[], Dict[str, str]]) -> Dict[str, str]:
+        properties = self._fresh_snapshot(serial)
+        if properties is not None:
+            return properties
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(serial, threading.Lock())
+        with fetch_lock:
+            # Fetched by another thread while waiting
+            properties = self._fresh_snapshot(serial)
+            if properties is not None:
+                return properties
+            with self._lock:
+                generation = self._generations.get(serial, 0)
+            properties = fetch()
+            with self._lock:
+                # A snapshot taken before an invalidation is not kept
+                if self._generations.get(serial, 0) == generation:
+                    self._snapshots[serial] = (time.monotonic(), properties)
+            return properties
+
+    def invalidate(self, serial: Optional[str]):
+        with self._lock:
+            self._snapshots.pop(serial, None)
+            self._generations[serial] = self._generations.get(serial, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            for serial in self._snapshots:
+                self._generations[serial] = self._generations.get(serial, 0) + 1
+            self._snapshots.clear()
+
+
+# Shared by all the AndroidDevice instances of the process
+device_properties_cache = DevicePropertiesCache()
@@ -0,0 +1,127 @@
+import logging
+import queue
+import subprocess
+import threading
+import uuid
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_COMMAND_TIMEOUT = 30
+
+
+class AdbShellSessionError(Exception):
+    pass
+
+
+class AdbShellSession:
+    """
+    Long-lived ``adb shell`` running the commands it is given one after the other.
+
+    Each command is followed by a unique sentinel line carrying its exit status, the output
+    of the command is everything read before the sentinel. This saves spawning a host
+    shell and an adb client, and the handshake with the adb server, for each command.
+
+    With ``su``, the remote shell is replaced by a root shell once when the session starts.
+    """
+
+    def __init__(self, serial: Optional[str] = None, su: bool = False,
+                 timeout: float = DEFAULT_COMMAND_TIMEOUT):
+        self.serial = serial
+        self.su = su
+        self.timeout = timeout
+        self.sentinel = f'__pirogue_{uuid.uuid4().hex}__'
+        self.process = None
+        self._lines = queue.Queue()
+        self._lock = threading.Lock()
+        self._reader = None
+
+    def _adb_command(self) -> List[str]:
+        cmd = ['adb']
+        if self.serial:
+            cmd.extend(['-s', self.serial])
+        cmd.append('shell')
+        return cmd
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self._adb_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(
+            target=self._read, args=(self.process.stdout, self._lines), name='adb-shell-session', daemon=True)
+        self._reader.start()
+        if self.su:
+            self._send('exec su\n')
+        try:
+            uid = self._run('id -u', self.timeout).strip()
+        except (CalledProcessError, TimeoutExpired) as e:
+            self.close()
+            raise AdbShellSessionError(f'Unable to start the adb shell session: {e}')
+        if self.su and uid != '0':
+            self.close()
+            raise AdbShellSessionError('Unable to get a root shell through su')
+
+    @staticmethod
+    def _read(stdout, lines: queue.Queue):
+        for line in iter(stdout.readline, b''):
+            lines.put(line)
+        # The remote shell exited
+        lines.put(None)
+
+    def _send(self, data: str):
+        try:
+            self.process.stdin.write(data.encode('utf-8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise AdbShellSessionError(f'The adb shell session is closed: {e}')
+
+    def _run(self, command: str, timeout: float) -> str:
+        # Commands never read the session input, their stderr is discarded as before
+        self._send(f'{{ {command}\n}} </dev/null 2>/dev/null; printf "\\n{self.sentinel} %d\\n" $?\n')
+        sentinel = self.sentinel.encode('utf-8')
+        output = []
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                # The output of the command can no longer be told apart from the next one
+                self.close()
+                raise TimeoutExpired(command, timeout)
+            if line is None:
+                self.close()
+                raise AdbShellSessionError('The adb shell session has been closed by the device')
+            if line.startswith(sentinel):
+                returncode = int(line[len(sentinel):].strip())
+                break
+            output.append(line)
+        # Drop the line feed printed before the sentinel
+        output = b''.join(output)[:-1].decode('utf-8')
+        if returncode != 0:
+            raise CalledProcessError(returncode, command, output)
+        return output
+
+    def run(self, command: str, timeout: Optional[float] = None) -> str:
+        with self._lock:
+            if not self.is_alive():
+                self.start()
+            return self._run(command, timeout or self.timeout)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except TimeoutExpired:
+            self.process.kill()
+        self.process = None
@@ -1,6 +1,5 @@
 import gc
 import os
-import json
 import secrets
 from datetime import datetime, timezone
 from pathlib import Path
@@ -11,6 +10,8 @@ from werkzeug.serving import BaseWSGIServer
 from werkzeug.utils import secure_filename
 import logging
 
+from pirogue_evidence_collector.utils import serializer
+
 
 def create_server(secret_token, output_folder):
     output_folder = Path(output_folder)
@@ -51,7 +52,7 @@ def create_server(secret_token, output_folder):
             return ''
         tz = datetime.now(timezone.utc).astimezone().tzinfo
         if request.method == 'POST':
-            metadata = json.loads(request.values.get('metadata'))
+            metadata = serializer.loads(request.values.get('metadata'))
             files = request.files.getlist('file')
             for file in files:
                 file_metadata = metadata.get(file.filename, {})
@@ -62,8 +63,8 @@ def create_server(secret_token, output_folder):
                 if file_metadata:
                     file_metadata['modification_date'] = datetime.fromtimestamp(
                         file_metadata.get('modification_timestamp'), tz).isoformat()
-                with open(filepath + '.metadata.json', 'w') as f:
-                    json.dump(file_metadata, f)
+                with open(filepath + '.metadata.json', 'w', encoding='utf-8') as f:
+                    serializer.dump(file_metadata, f, pretty=False)
         return redirect(url_for('done', token=token, **request.args))
 
     return app, shutdown
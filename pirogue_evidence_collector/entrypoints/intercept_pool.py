@@ -0,0 +1,64 @@
+import argparse
+import logging
+import sys
+
+from rich.logging import RichHandler
+
+from pirogue_evidence_collector.frida.device_pool import DEFAULT_REPORT_INTERVAL, POOL_MODES, DevicePool
+
+LOG_FORMAT = '%(message)s'
+logging.basicConfig(level='INFO', format=LOG_FORMAT, handlers=[
+    RichHandler(show_path=False, log_time_format='%X')])
+
+
+def parse_mapping(values, option):
+    mapping = {}
+    for value in values or []:
+        serial, sep, setting = value.partition('=')
+        if not sep or not serial:
+            logging.error(f'Invalid {option} {value}, expected SERIAL=VALUE')
+            sys.exit(1)
+        mapping[serial] = setting
+    return mapping
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog='pirogue-intercept-pool',
+        description='Instrument an Android application on several devices at the same time, '
+                    'the arguments after -- are passed to each interception',
+        usage='%(prog)s -o OUTPUT [options] -- [interception options]'
+    )
+    arg_parser.add_argument('-o', '--output', required=True,
+                            help='The output directory, each device is captured in a subdirectory named after its serial')
+    arg_parser.add_argument('-D', '--device', dest='serials', action='append', default=None,
+                            help='Serial number of a device to capture, all the connected devices by default')
+    arg_parser.add_argument('-m', '--mode', choices=list(POOL_MODES), default='gated',
+                            help='The interception to run on each device')
+    arg_parser.add_argument('-i', '--iface', dest='ifaces', action='append', metavar='SERIAL=IFACE',
+                            help='The network interface to capture for a device')
+    arg_parser.add_argument('--bpf-filter', dest='bpf_filters', action='append', metavar='SERIAL=FILTER',
+                            help='BPF filter of a device, replaces the default filter on the IP addresses of the device')
+    arg_parser.add_argument('--report-interval', type=float, default=DEFAULT_REPORT_INTERVAL, metavar='SECONDS',
+                            help='Interval between the reports of the CPU and disk usage of each device')
+    arg_parser.add_argument('extra_args', nargs=argparse.REMAINDER,
+                            help='Options passed to each interception, e.g. -- -f com.example.app')
+    args = arg_parser.parse_args()
+
+    extra_args = args.extra_args
+    if extra_args and extra_args[0] == '--':
+        extra_args = extra_args[1:]
+    pool = DevicePool(
+        args.output,
+        serials=args.serials,
+        mode=args.mode,
+        ifaces=parse_mapping(args.ifaces, 'interface'),
+        bpf_filters=parse_mapping(args.bpf_filters, 'BPF filter'),
+        extra_args=extra_args,
+        report_interval=args.report_interval,
+    )
+    try:
+        pool.run()
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
@@ -24,9 +24,8 @@ def finalize(app):
     if app:
         app.save_data()
         log.info('You can analyze the results with the following commands in the output folder:')
-        log.info('  * Generate a PCAPNG file: editcap --inject-secrets tls,sslkeylog.txt traffic.pcap decrypted.pcapng')
-        log.info('  * Export decrypted traffic to JSON: tshark -2 -T ek --enable-protocol communityid -Ndmn -r decrypted.pcapng > traffic.json')
-        log.info('  * View the decrypted traffic: pirogue-view-tls -i traffic.json')
+        for hint in app.capture_manager.analysis_hints():
+            log.info(f'  * {hint}')
         log.info('⚠️ depending on the configuration of your system you would have to run the commands with sudo.')
         sys.exit(0)
 
@@ -44,4 +43,8 @@ def start_interception():
         signal(SIGINT, dummy)
         signal(SIGTERM, dummy)
         log.info('Instrumentation stopped')
-        finalize(app)
\ No newline at end of file
+        finalize(app)
+
+
+if __name__ == '__main__':
+    start_interception()
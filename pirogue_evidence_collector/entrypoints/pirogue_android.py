@@ -10,21 +10,21 @@ logging.basicConfig(level='INFO', format=LOG_FORMAT, handlers=[
 console = Console()
 
 
-def __install_frida():
+def __install_frida(args):
     from pirogue_evidence_collector.android.device import AndroidDevice
-    device = AndroidDevice()
+    device = AndroidDevice(frida_server_mirror=args.frida_server_mirror)
     device.install_latest_frida_server()
 
 
-def __start_frida():
+def __start_frida(args):
     from pirogue_evidence_collector.android.device import AndroidDevice
-    device = AndroidDevice()
+    device = AndroidDevice(frida_server_mirror=args.frida_server_mirror)
     device.start_frida_server()
 
 
-def __stop_frida():
+def __stop_frida(args):
     from pirogue_evidence_collector.android.device import AndroidDevice
-    device = AndroidDevice()
+    device = AndroidDevice(frida_server_mirror=args.frida_server_mirror)
     device.stop_frida_server()
 
 
@@ -36,6 +36,13 @@ def main():
         help='Interact with Android device connected to the PiRogue',
         nargs='?',
         choices=['install-frida', 'start-frida', 'stop-frida'])
+    arg_parser.add_argument(
+        '--frida-server-mirror',
+        help='Directory containing frida-server release archives (e.g. frida-server-16.1.4-android-arm64.xz) '
+             'used instead of downloading them from GitHub',
+        default=None,
+        required=False,
+        type=str)
 
     args = arg_parser.parse_args()
 
@@ -44,4 +51,4 @@ def main():
         'start-frida': __start_frida,
         'stop-frida': __stop_frida,
     }
-    android_route.get(args.action, __install_frida)()
+    android_route.get(args.action, __install_frida)(args)
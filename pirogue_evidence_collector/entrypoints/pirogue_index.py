@@ -0,0 +1,64 @@
+import argparse
+import logging
+import pathlib
+
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.table import Table
+
+from pirogue_evidence_collector.index.experiment_index import ExperimentIndex
+
+LOG_FORMAT = '%(message)s'
+logging.basicConfig(level='INFO', format=LOG_FORMAT, handlers=[
+    RichHandler(show_path=False, log_time_format='%X')])
+
+console = Console()
+
+
+def print_rows(rows: list):
+    if not rows:
+        console.print('No result')
+        return
+    table = Table(*rows[0].keys())
+    for row in rows:
+        table.add_row(*(str(value) if value is not None else '' for value in row))
+    console.print(table)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog='pirogue-index',
+        description='Index the files of an experiment folder into a SQLite database'
+    )
+    arg_parser.add_argument(
+        'path',
+        help='Path of the experiment folder, i.e. the output folder of pirogue-intercept-*',
+        type=pathlib.Path
+    )
+    arg_parser.add_argument(
+        '-d',
+        '--database',
+        help='Path of the SQLite database, defaults to experiment.sqlite in the experiment folder',
+        type=pathlib.Path,
+        required=False
+    )
+    arg_parser.add_argument(
+        '-q',
+        '--query',
+        help='SQL query to run once the index is up to date, '
+             'e.g. "SELECT DISTINCT stack FROM socket_traces WHERE dest_ip = \'1.2.3.4\'"',
+        required=False
+    )
+
+    args = arg_parser.parse_args()
+    if not args.path.is_dir():
+        logging.error(f'{args.path} is not a folder')
+        return
+
+    with ExperimentIndex(args.path, args.database) as index:
+        logging.info(f'Updating the index {index.db_path}')
+        new_records = index.update()
+        for table, count in new_records.items():
+            logging.info(f'{table}: {count} new records')
+        if args.query:
+            print_rows(index.query(args.query))
@@ -1,7 +1,46 @@
-from pathlib import Path
+import argparse
+import logging
+import pathlib
+import sys
+
+from rich.logging import RichHandler
 
 from pirogue_evidence_collector.file_handler.metadata import BatchExporter
 
+LOG_FORMAT = '%(message)s'
+logging.basicConfig(level='INFO', format=LOG_FORMAT, handlers=[
+    RichHandler(show_path=False, log_time_format='%X')])
+
 
 def main():
-    pass  # ToDo - Implement the main function
+    arg_parser = argparse.ArgumentParser(
+        prog='pirogue-save-metadata',
+        description='Save the metadata and the hashes of all the files contained in a folder'
+    )
+    arg_parser.add_argument(
+        'path',
+        help='Path of the folder containing the files',
+        type=pathlib.Path
+    )
+    arg_parser.add_argument(
+        '--verify',
+        help='Hash all the files again instead of reusing the cached hashes and report the files whose content '
+             'changed',
+        default=False,
+        required=False,
+        action='store_true'
+    )
+
+    args = arg_parser.parse_args()
+    if not args.path.is_dir():
+        logging.error(f'{args.path} is not a folder')
+        sys.exit(1)
+
+    logging.info(f'Saving the metadata of the files contained in {args.path}')
+    exporter = BatchExporter(args.path, verify=args.verify)
+    exporter.export()
+
+    if exporter.hash_cache.mismatches:
+        for filename, algorithm in exporter.hash_cache.mismatches:
+            logging.error(f'The content of {filename} changed since it was hashed ({algorithm})')
+        sys.exit(1)
@@ -1,16 +1,35 @@
 import argparse
 import logging
 import pathlib
+import subprocess
+import sys
 
 from rich.logging import RichHandler
 
-from pirogue_evidence_collector.utils.rfc3161 import FolderTimestamper, FileTimestamper
+from pirogue_evidence_collector.utils.hash_cache import HashCache
+from pirogue_evidence_collector.utils.rfc3161 import (DEFAULT_TIMESTAMP_WORKERS, FolderTimestamper,
+                                                     FileTimestamper, check_inclusion_proof,
+                                                     proof_verification_command)
 
 LOG_FORMAT = '%(message)s'
 logging.basicConfig(level='INFO', format=LOG_FORMAT, handlers=[
     RichHandler(show_path=False, log_time_format='%X')])
 
 
+def check_proof(file_path: pathlib.Path):
+    try:
+        proof = check_inclusion_proof(file_path)
+        cmd = proof_verification_command(proof)
+    except Exception as e:
+        logging.error(f'Invalid proof: {e}')
+        sys.exit(1)
+    logging.info(f'{file_path.name} is leaf {proof["leaf_index"]} of the Merkle tree of root {proof["root"]}')
+    # The signature of the timestamp is verified by openssl with the certificates of the server
+    if subprocess.call(cmd, cwd=file_path.parent) != 0:
+        logging.error('Unable to verify the timestamp of the Merkle tree root')
+        sys.exit(1)
+
+
 def main():
     arg_parser = argparse.ArgumentParser(
         prog='pirogue-timestamp',
@@ -30,16 +49,62 @@ def main():
         required=False,
         action='store_true'
     )
+    arg_parser.add_argument(
+        '-m',
+        '--merkle',
+        help='Combine all the files in the folder into a Merkle tree and time stamp its root. Each file gets a proof '
+             'of its inclusion in the tree. Files added to the folder since the last run extend the existing tree',
+        default=False,
+        required=False,
+        action='store_true'
+    )
+    arg_parser.add_argument(
+        '--check-proof',
+        help='Check the inclusion proof of the given file against the timestamp of the Merkle tree root',
+        default=False,
+        required=False,
+        action='store_true'
+    )
+    arg_parser.add_argument(
+        '-w',
+        '--workers',
+        help=f'Maximum number of timestamp requests sent at the same time, default {DEFAULT_TIMESTAMP_WORKERS}',
+        default=DEFAULT_TIMESTAMP_WORKERS,
+        required=False,
+        type=int
+    )
+    arg_parser.add_argument(
+        '--verify',
+        help='Hash all the files again instead of reusing the cached hashes and report the files whose content '
+             'changed',
+        default=False,
+        required=False,
+        action='store_true'
+    )
 
     args = arg_parser.parse_args()
     target_path = args.path
 
+    if args.check_proof:
+        check_proof(target_path)
+        return
+
     if target_path.is_dir():
         logging.info(f'Timestamping the files contained in {target_path}')
-        bt = FolderTimestamper(target_path)
-        bt.timestamp_all(args.combine)
+        bt = FolderTimestamper(target_path, verify=args.verify, max_workers=args.workers)
+        bt.timestamp_all(args.combine, merkle=args.merkle)
+        hash_cache = bt.hash_cache
     elif target_path.is_file():
         logging.info(f'Timestamping the file {target_path}')
-        ft = FileTimestamper(target_path)
+        hash_cache = HashCache(target_path.parent, verify=args.verify)
+        ft = FileTimestamper(target_path, hash_cache=hash_cache)
         ft.timestamp()
+        hash_cache.save()
+    else:
+        return
+
+    if hash_cache.mismatches:
+        for filename, algorithm in hash_cache.mismatches:
+            logging.error(f'The content of {filename} changed since it was hashed ({algorithm})')
+        sys.exit(1)
 
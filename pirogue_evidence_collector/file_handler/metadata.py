@@ -1,16 +1,19 @@
-import hashlib
+import json
 import os
 import mimetypes
-import json
 from datetime import datetime, timezone
 from pathlib import Path
 
 from pirogue_colander_connector.collectors.ignore import ColanderIgnoreFile
 
+from pirogue_evidence_collector.utils.hash_cache import HASH_CACHE_FILE_NAME, HashCache
+from pirogue_evidence_collector.utils.hashing import hash_file
+
 
 class MetadataExporter:
-    def __init__(self, input_file: Path):
+    def __init__(self, input_file: Path, hash_cache: HashCache = None):
         self.input_file: Path = input_file
+        self.hash_cache = hash_cache
         self.metadata: dict = {}
         self.tz = datetime.now(timezone.utc).astimezone().tzinfo
 
@@ -21,24 +24,11 @@ class MetadataExporter:
         self.metadata.update(metadata)
 
     def get_file_checksums(self):
-        md5_hash = hashlib.md5()
-        sha1_hash = hashlib.sha1()
-        sha256_hash = hashlib.sha256()
-        sha512_hash = hashlib.sha512()
-        with self.input_file.open('rb') as _f:
-            for chunk in iter(lambda: _f.read(4096), b''):
-                md5_hash.update(chunk)
-                sha1_hash.update(chunk)
-                sha256_hash.update(chunk)
-                sha512_hash.update(chunk)
-        return {
-            'md5': md5_hash.hexdigest(),
-            'sha1': sha1_hash.hexdigest(),
-            'sha256': sha256_hash.hexdigest(),
-            'sha512': sha512_hash.hexdigest()
-        }
+        if self.hash_cache:
+            return self.hash_cache.get(self.input_file)
+        return hash_file(self.input_file)
 
-    def extract(self):
+    def extract(self, checksums: dict = None):
         self.metadata = {
             'filename': self.input_file.name,
             'size': os.path.getsize(self.input_file),
@@ -46,9 +36,11 @@ class MetadataExporter:
             'extraction_date': datetime.now(self.tz).isoformat(),
             'resolved_type': mimetypes.guess_type(self.input_file)[0] or 'application/octet-stream'
         }
-        self.metadata.update(self.get_file_checksums())
+        self.metadata.update(checksums or self.get_file_checksums())
 
     def export(self):
+        # Written with the json module, the format of the metadata files does not depend on the
+        # serializer backend
         if os.path.exists(self.input_file.name + '.metadata.json'):
             with open(self.input_file.name + '.metadata.json') as _f:
                 existing_metadata = json.load(_f)
@@ -58,19 +50,25 @@ class MetadataExporter:
 
 
 class BatchExporter:
-    def __init__(self, input_folder: Path, extra_metadata: dict = None):
+    def __init__(self, input_folder: Path, extra_metadata: dict = None, verify: bool = False):
         self.input_folder: Path = input_folder
         self.extra_metadata: dict = extra_metadata
         self.colander_ignore = ColanderIgnoreFile(self.input_folder)
+        self.colander_ignore.add_ignored_pattern(HASH_CACHE_FILE_NAME)
+        # Files already hashed, e.g. when timestamped, are not hashed again unless verify is set
+        self.hash_cache = HashCache(self.input_folder, verify=verify)
 
     def export(self):
-        for input_file in self.input_folder.glob('*'):
-            if not input_file.is_file():
-                continue
-            if self.colander_ignore.is_ignored(input_file):
-                continue
-            exporter = MetadataExporter(input_file)
-            exporter.extract()
+        input_files = [
+            input_file for input_file in self.input_folder.glob('*')
+            if input_file.is_file() and not self.colander_ignore.is_ignored(input_file)
+        ]
+        # Files are hashed concurrently, the metadata are then written one file at a time
+        checksums = self.hash_cache.get_many(input_files)
+        self.hash_cache.save()
+        for input_file in input_files:
+            exporter = MetadataExporter(input_file, self.hash_cache)
+            exporter.extract(checksums.get(input_file))
             if self.extra_metadata:
                 exporter.add_extra_metadata(self.extra_metadata)
             exporter.export()
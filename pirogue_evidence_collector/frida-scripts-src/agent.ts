@@ -4,6 +4,7 @@ import { log_aes_info } from "./pirogue/log_aes_info.js";
 import { socket_trace } from "./pirogue/log_socket_operations.js";
 import  { no_root } from "./pirogue/no_root.js";
 import  { inject_hooks } from "./pirogue/dynamic_hook_injector.js";
+import { dispose, flush_batches } from "./pirogue/batch_sender.js";
 
 console.log = function(str: string) {
     let message = {
@@ -23,3 +24,7 @@ rpc.exports['noRoot'] = no_root;
 rpc.exports['no_root'] = no_root;
 rpc.exports['injectDynamicHooks'] = inject_hooks;
 rpc.exports['inject_dynamic_hooks'] = inject_hooks;
+rpc.exports['flushBatches'] = flush_batches;
+rpc.exports['flush_batches'] = flush_batches;
+// Lifecycle hook called by Frida when the script is unloaded
+rpc.exports.dispose = dispose;
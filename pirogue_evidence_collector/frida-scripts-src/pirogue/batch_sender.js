@@ -0,0 +1,91 @@
+// Coalesce the records sent by the hooks into one message per dump target.
+// The envelope (type, dump, data_type, pid, process) is sent once per batch and
+// byte payloads travel through the binary channel of send() instead of hex strings.
+
+const MAX_BATCH_RECORDS = 256;
+const MAX_BATCH_BYTES = 512 * 1024;
+const FLUSH_INTERVAL_MS = 500;
+
+const _batches = {};
+let _flush_timer = null;
+let _disposed = false;
+
+function _to_bytes(arr) {
+    if (arr === null || arr === undefined)
+        return null;
+    if (arr instanceof ArrayBuffer)
+        return new Uint8Array(arr);
+    const bytes = new Uint8Array(arr.length);
+    for (let i = 0; i < arr.length; i++) {
+        bytes[i] = arr[i] & 0xFF;
+    }
+    return bytes;
+}
+
+function _send_batch(key) {
+    const batch = _batches[key];
+    delete _batches[key];
+    if (batch === undefined || batch.records.length === 0)
+        return;
+    const msg = Object.assign({contentType: 'batch', records: batch.records}, batch.envelope);
+    if (batch.size === 0) {
+        send(msg);
+        return;
+    }
+    const payload = new Uint8Array(batch.size);
+    let offset = 0;
+    batch.chunks.forEach(chunk => {
+        payload.set(chunk, offset);
+        offset += chunk.length;
+    });
+    send(msg, payload.buffer);
+}
+
+export function flush_batches() {
+    if (_flush_timer !== null) {
+        clearTimeout(_flush_timer);
+        _flush_timer = null;
+    }
+    Object.keys(_batches).forEach(key => _send_batch(key));
+}
+
+// Frida calls rpc.exports.dispose() when the script is unloaded, e.g. when the instrumented
+// process exits: the pending batches are sent and the records queued afterwards are sent at once.
+export function dispose() {
+    _disposed = true;
+    flush_batches();
+}
+
+// envelope: fields shared by all the records of a dump target
+// data: the record itself
+// payloads: optional {field_name: byte array} transferred as raw bytes, the Python
+//           side stores them hex-encoded in data[field_name]
+export function queue_record(envelope, data, payloads) {
+    const key = `${envelope.dump}:${envelope.pid}`;
+    let batch = _batches[key];
+    if (batch === undefined) {
+        batch = {envelope: envelope, records: [], chunks: [], size: 0};
+        _batches[key] = batch;
+    }
+    const record = {timestamp: Date.now(), data: data};
+    if (payloads) {
+        record.bin = {};
+        Object.keys(payloads).forEach(name => {
+            const bytes = _to_bytes(payloads[name]);
+            if (bytes === null)
+                return;
+            record.bin[name] = [batch.size, bytes.length];
+            batch.chunks.push(bytes);
+            batch.size += bytes.length;
+        });
+    }
+    batch.records.push(record);
+    if (_disposed || batch.records.length >= MAX_BATCH_RECORDS || batch.size >= MAX_BATCH_BYTES) {
+        _send_batch(key);
+    } else if (_flush_timer === null) {
+        _flush_timer = setTimeout(() => {
+            _flush_timer = null;
+            flush_batches();
+        }, FLUSH_INTERVAL_MS);
+    }
+}
@@ -1,6 +1,8 @@
 // SPDX-FileCopyrightText: 2024 Pôle d'Expertise de la Régulation Numérique - PEReN <contact@peren.gouv.fr>
 // SPDX-License-Identifier: MIT
 
+import { intern_stack } from "./stack_interning.js";
+
 function _inject_hooks(pid, process, hook_list) {
     console.log('Inject dynamic hooks')
     hook_list.forEach(item => {
@@ -45,6 +47,7 @@ function _inject_hook(pid, process, taxonomy_id, description, class_name, method
                 const args = [].slice.call(arguments);
                 const returned_value = this[method_name].apply(this, arguments);
                 const stacktrace = Exception.$new().getStackTrace().toString().split(',');
+                const stacktrace_id = intern_stack(pid, process, stacktrace.join('\n'), () => stacktrace);
                 _send_msg({
                     taxonomy_id: taxonomy_id,
                     description: description,
@@ -53,7 +56,7 @@ function _inject_hook(pid, process, taxonomy_id, description, class_name, method
                     method: method_name,
                     arguments: args,
                     returned_value: returned_value ? returned_value : null,
-                    stacktrace: stacktrace
+                    stacktrace_id: stacktrace_id
                 });
                 return returned_value;
             } catch (error) {}
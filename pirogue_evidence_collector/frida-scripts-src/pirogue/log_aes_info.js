@@ -1,3 +1,5 @@
+import { queue_record } from "./batch_sender.js";
+
 export function log_aes_info(pid, process) {
 
     var use_single_byte = false;
@@ -5,6 +7,14 @@ export function log_aes_info(pid, process) {
     var index = 0;
 
 
+    const envelope = {
+        'type': 'crypto_traces',
+        'dump': 'aes_info.json',
+        'data_type': 'json',
+        'pid': pid,
+        'process': process
+    }
+
     var secretKeySpecDef = Java.use('javax.crypto.spec.SecretKeySpec');
 
     var ivParameterSpecDef = Java.use('javax.crypto.spec.IvParameterSpec');
@@ -32,45 +42,29 @@ export function log_aes_info(pid, process) {
     var ivParameterSpecDef_init_2 = ivParameterSpecDef.$init.overload('[B', 'int', 'int');
 
     secretKeySpecDef_init_1.implementation = function(arr, alg) {
-        var key = b2s(arr);
-        const msg = {
-            'type': 'crypto_traces',
-            'dump': 'aes_info.json',
-            'data_type': 'json',
-            'pid': pid,
-            'process': process,
-            'timestamp': Date.now(),
-            'data': {
-                'iv': '',
-                'alg': alg,
-                'in': '',
-                'out': '',
-                'key': toHexString(arr)
-            }
-        }
-        send(msg)
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'key': arr
+        });
         // console.log("Creating " + alg + " secret key, plaintext:\\n" + hexdump(key));
         return secretKeySpecDef_init_1.call(this, arr, alg);
     }
 
     secretKeySpecDef_init_2.implementation = function(arr, off, len, alg) {
-        var key = b2s(arr);
-        const msg = {
-            'type': 'crypto_traces',
-            'dump': 'aes_info.json',
-            'data_type': 'json',
-            'pid': pid,
-            'process': process,
-            'timestamp': Date.now(),
-            'data': {
-                'iv': '',
-                'alg': alg,
-                'in': '',
-                'out': '',
-                'key': toHexString(arr)
-            }
-        }
-        send(msg)
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'key': arr
+        });
         // console.log("Creating " + alg + " secret key, plaintext:\\n" + hexdump(key));
         return secretKeySpecDef_init_2.call(this, arr, off, len, alg);
     }
@@ -137,34 +131,21 @@ export function log_aes_info(pid, process) {
     }
 
     function info(iv, alg, plain, encoded) {
-        const msg = {
-            'type': 'crypto_traces',
-            'dump': 'aes_info.json',
-            'data_type': 'json',
-            'pid': pid,
-            'process': process,
-            'timestamp': Date.now(),
-            'data': {
-                'iv': toHexString(iv),
-                'alg': alg,
-                'in': toHexString(plain),
-                'out': toHexString(encoded),
-                'key': ''
-            }
-        }
-        send(msg);
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'iv': iv,
+            'in': plain,
+            'out': encoded
+        });
         complete_bytes = [];
         index = 0;
     }
 
-    function toHexString(byteArray) {
-        if (byteArray === null)
-            return '';
-        return Array.from(byteArray, function(byte) {
-          return ('0' + (byte & 0xFF).toString(16)).slice(-2);
-        }).join('')
-      }
-
     function hexdump(buffer, blockSize) {
         blockSize = blockSize || 16;
         var lines = [];
@@ -184,20 +165,6 @@ export function log_aes_info(pid, process) {
         return lines.join("\\n");
     }
 
-    function b2s(array) {
-        var result = "";
-        if (array === null)
-            return result;
-        for (var i = 0; i < array.length; i++) {
-            result += String.fromCharCode(modulus(array[i], 256));
-        }
-        return result;
-    }
-
-    function modulus(x, n) {
-        return ((x % n) + n) % n;
-    }
-
     function addtoarray(arr) {
         for (var i = 0; i < arr.length; i++) {
             complete_bytes[index] = arr[i];
@@ -1,16 +1,66 @@
-function _socket_trace(pid, process) {
+import { queue_record } from "./batch_sender.js";
+import { intern_stack } from "./stack_interning.js";
 
-    function _send_msg(msg) {
-        const _msg = {
-            'type': 'socket_traces',
-            'dump': 'socket_trace.json',
-            'pid': pid,
-            'process': process,
-            'data_type': 'json',
-            'timestamp': Date.now(),
-            'data': msg
+const MAX_TRACKED_FLOWS = 4096;
+
+// Decide which socket events are worth a trace, see CaptureManager for the available modes:
+//  - all: every event
+//  - first-per-flow: the first event of each (fd, 5-tuple)
+//  - every-n: the first event of each flow then one event out of n
+//  - token-bucket: at most `rate` events per second for the process, with bursts of `burst` events
+function _build_sampler(policy) {
+    const mode = (policy && policy.mode) || 'all';
+    if (mode === 'all')
+        return null;
+    const flows = new Map();
+    function _flow_count(flow_key) {
+        const count = flows.has(flow_key) ? flows.get(flow_key) + 1 : 1;
+        if (count === 1 && flows.size >= MAX_TRACKED_FLOWS) {
+            // Forget the oldest flow, Map preserves the insertion order
+            flows.delete(flows.keys().next().value);
         }
-        send(_msg)
+        flows.set(flow_key, count);
+        return count;
+    }
+    if (mode === 'first-per-flow')
+        return flow_key => _flow_count(flow_key) === 1;
+    if (mode === 'every-n') {
+        const n = Math.max(1, policy.n || 1);
+        return flow_key => (_flow_count(flow_key) - 1) % n === 0;
+    }
+    if (mode === 'token-bucket') {
+        const rate = policy.rate || 1;
+        const burst = Math.max(1, policy.burst || 1);
+        let tokens = burst;
+        let last_refill = Date.now();
+        return flow_key => {
+            const now = Date.now();
+            tokens = Math.min(burst, tokens + (now - last_refill) * rate / 1000);
+            last_refill = now;
+            if (tokens < 1)
+                return false;
+            tokens -= 1;
+            return true;
+        };
+    }
+    console.log(`Unknown socket sampling mode ${mode}, tracing every socket event`);
+    return null;
+}
+
+function _socket_trace(pid, process, policy) {
+
+    const should_trace = _build_sampler(policy);
+
+    const envelope = {
+        'type': 'socket_traces',
+        'dump': 'socket_trace.json',
+        'pid': pid,
+        'process': process,
+        'data_type': 'json'
+    }
+
+    function _send_msg(msg) {
+        queue_record(envelope, msg);
     }
 
     Process
@@ -29,6 +79,11 @@ function _socket_trace(pid, process) {
                 const local_addr = Socket.localAddress(fd);
                 if (local_addr === null)
                     return;
+                if (should_trace !== null) {
+                    const flow_key = `${fd}|${socket_type}|${local_addr.ip}|${local_addr.port}|${dest_addr.ip}|${dest_addr.port}`;
+                    if (!should_trace(flow_key))
+                        return;
+                }
                 const socket_info = {
                     socket_fd: fd,
                     socket_type: socket_type,
@@ -44,23 +99,29 @@ function _socket_trace(pid, process) {
                     let java_lang_Exception = Java.use("java.lang.Exception")
                     var exception = java_lang_Exception.$new()
                     const trace = exception.getStackTrace()
-                    socket_info.stack = trace.map(trace_elt => {
-                      return {
-                        class: trace_elt.getClassName(),
-                        file: trace_elt.getFileName(),
-                        line: trace_elt.getLineNumber(),
-                        method: trace_elt.getMethodName(),
-                        is_native: trace_elt.isNativeMethod(),
-                        str: trace_elt.toString()
-                      }
+                    const trace_str = trace.map(trace_elt => trace_elt.toString())
+                    socket_info.stack_id = intern_stack(pid, process, trace_str.join('\n'), () => {
+                      return trace.map((trace_elt, i) => {
+                        return {
+                          class: trace_elt.getClassName(),
+                          file: trace_elt.getFileName(),
+                          line: trace_elt.getLineNumber(),
+                          method: trace_elt.getMethodName(),
+                          is_native: trace_elt.isNativeMethod(),
+                          str: trace_str[i]
+                        }
+                      })
                     })
                   }
                 _send_msg(socket_info);
             }
         })
     })
+
+    // The policy actually applied, unknown modes fall back to tracing every event
+    return should_trace === null ? {mode: 'all'} : policy;
 }
 
-export function socket_trace(pid, process) {
-    _socket_trace(pid, process);
+export function socket_trace(pid, process, policy) {
+    return _socket_trace(pid, process, policy);
 }
@@ -0,0 +1,31 @@
+// Send each distinct stack trace only once and reference it by its identifier afterwards.
+// The stack definitions are saved by the capture manager in stacks.json.
+
+import { queue_record } from "./batch_sender.js";
+
+// Identifier of each stack already sent, by string representation
+const _stack_ids = new Map();
+
+// key: string representation of the stack, e.g. the frames joined with new lines
+// build_frames: callback returning the full frames, only called the first time a stack is seen
+//
+// The identifier is the SHA-256 digest of the key: a collision would attach the wrong call
+// stack to a trace, and the same stack gets the same identifier in every process.
+export function intern_stack(pid, process, key, build_frames) {
+    let stack_id = _stack_ids.get(key);
+    if (stack_id === undefined) {
+        stack_id = Checksum.compute('sha256', key);
+        _stack_ids.set(key, stack_id);
+        queue_record({
+            'type': 'stack_traces',
+            'dump': 'stacks.json',
+            'data_type': 'stacks',
+            'pid': pid,
+            'process': process
+        }, {
+            'stack_id': stack_id,
+            'frames': build_frames()
+        });
+    }
+    return stack_id;
+}
@@ -1,5 +1,5 @@
 📦
-652 /pirogue_evidence_collector/frida-scripts-src/agent.js
+1134 /pirogue_evidence_collector/frida-scripts-src/agent.js
 1608 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/android/android_agent.js
 547 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/android/android_java_tls_libs.js
 2098 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/android/bouncycastle.js
@@ -41,13 +41,44 @@
 6722 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/windows/sspi.js
 1554 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/windows/windows_agent.js
 788 /pirogue_evidence_collector/frida-scripts-src/friTap/agent/windows/wolfssl_windows.js
-917 /pirogue_evidence_collector/frida-scripts-src/pirogue/dynamic_hook_injector.js
-421 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_ad_ids.js
-2561 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_aes_info.js
-1132 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_socket_operations.js
-6322 /pirogue_evidence_collector/frida-scripts-src/pirogue/no_root.js
-✄
-import"./friTap/agent/ssl_log.js";import{log_ad_ids as o}from"./pirogue/log_ad_ids.js";import{log_aes_info as r}from"./pirogue/log_aes_info.js";import{socket_trace as e}from"./pirogue/log_socket_operations.js";import{no_root as p}from"./pirogue/no_root.js";import{inject_hooks as s}from"./pirogue/dynamic_hook_injector.js";console.log=function(o){send({contentType:"console",console:o})},rpc.exports.logAdIds=o,rpc.exports.log_ad_ids=o,rpc.exports.logAesInfo=r,rpc.exports.log_aes_info=r,rpc.exports.socketTrace=e,rpc.exports.socket_trace=e,rpc.exports.noRoot=p,rpc.exports.no_root=p,rpc.exports.injectDynamicHooks=s,rpc.exports.inject_dynamic_hooks=s;
+2999 /pirogue_evidence_collector/frida-scripts-src/pirogue/batch_sender.js
+2660 /pirogue_evidence_collector/frida-scripts-src/pirogue/dynamic_hook_injector.js
+738 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_ad_ids.js
+5826 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_aes_info.js
+5118 /pirogue_evidence_collector/frida-scripts-src/pirogue/log_socket_operations.js
+15311 /pirogue_evidence_collector/frida-scripts-src/pirogue/no_root.js
+1208 /pirogue_evidence_collector/frida-scripts-src/pirogue/stack_interning.js
+✄
+import "./friTap/agent/ssl_log.js";
+import { log_ad_ids } from "./pirogue/log_ad_ids.js";
+import { log_aes_info } from "./pirogue/log_aes_info.js";
+import { socket_trace } from "./pirogue/log_socket_operations.js";
+import  { no_root } from "./pirogue/no_root.js";
+import  { inject_hooks } from "./pirogue/dynamic_hook_injector.js";
+import { dispose, flush_batches } from "./pirogue/batch_sender.js";
+
+console.log = function(str) {
+    let message = {
+        contentType: "console",
+        console: str
+    }
+    send(message)
+}
+
+rpc.exports['logAdIds'] = log_ad_ids;
+rpc.exports['log_ad_ids'] = log_ad_ids;
+rpc.exports['logAesInfo'] = log_aes_info;
+rpc.exports['log_aes_info'] = log_aes_info;
+rpc.exports['socketTrace'] = socket_trace;
+rpc.exports['socket_trace'] = socket_trace;
+rpc.exports['noRoot'] = no_root;
+rpc.exports['no_root'] = no_root;
+rpc.exports['injectDynamicHooks'] = inject_hooks;
+rpc.exports['inject_dynamic_hooks'] = inject_hooks;
+rpc.exports['flushBatches'] = flush_batches;
+rpc.exports['flush_batches'] = flush_batches;
+// Lifecycle hook called by Frida when the script is unloaded
+rpc.exports.dispose = dispose;
 ✄
 import{module_library_mapping as o}from"../shared/shared_structures.js";import{getModuleNames as r,ssl_library_loader as e,invokeHookingFunction as d}from"../shared/shared_functions.js";import{log as s,devlog as i}from"../util/log.js";import{gnutls_execute as n}from"./gnutls_android.js";import{wolfssl_execute as t}from"./wolfssl_android.js";import{nss_execute as l}from"./nss_android.js";import{mbedTLS_execute as a}from"./mbedTLS_android.js";import{boring_execute as m}from"./openssl_boringssl_android.js";import{java_execute as f}from"./android_java_tls_libs.js";var u=r();global.addresses={};export const socket_library="libc";export function load_android_hooking_agent(){o.linux=[[/.*libssl_sb.so/,d(m)],[/.*libssl\.so/,d(m)],[/.*libgnutls\.so/,d(n)],[/.*libwolfssl\.so/,d(t)],[/.*libnspr[0-9]?\.so/,d(l)],[/libmbedtls\.so.*/,d(a)]],f(),function(o,r){e("linux",o,u,"Android",r)}(o,!0),function(o,r){try{const i=/.*libdl.*\.so/,n=u.find((o=>o.match(i)));if(void 0===n)throw"Android Dynamic loader not found!";let t=Process.getModuleByName(n).enumerateExports();var e="dlopen";for(var d of t)if("android_dlopen_ext"===d.name){e="android_dlopen_ext";break}Interceptor.attach(Module.getExportByName(n,e),{onEnter:function(o){this.moduleName=o[0].readCString()},onLeave:function(e){if(null!=this.moduleName)for(let e of o.linux){let o=e[0],d=e[1];o.test(this.moduleName)&&(s(`${this.moduleName} was loaded & will be hooked on Android!`),d(this.moduleName,r))}}}),console.log("[*] Android dynamic loader hooked.")}catch(o){i("Loader error: "+o),s("No dynamic loader present for hooking on Android.")}}(o,!1)}
 ✄
@@ -131,12 +162,846 @@ import{module_library_mapping as o}from"../shared/shared_structures.js";import{l
 ✄
 import{WolfSSL as e}from"../ssl_lib/wolfssl.js";import{socket_library as o}from"./windows_agent.js";import{log as t}from"../util/log.js";export class WolfSSL_Windows extends e{constructor(e,o,t){let s={};s[`${e}`]=["wolfSSL_read","wolfSSL_write","wolfSSL_get_fd","wolfSSL_get_session","wolfSSL_connect","wolfSSL_KeepArrays"],s[`*${o}*`]=["getpeername","getsockname","ntohs","ntohl"],super(e,o,s),this.moduleName=e,this.socket_library=o}install_tls_keys_callback_hook(){t("Key extraction currently not implemented for windows!")}execute_hooks(){this.install_plaintext_read_hook(),this.install_plaintext_write_hook()}}export function wolfssl_execute(e,t){var s=new WolfSSL_Windows(e,o,t);if(s.execute_hooks(),t){const o=s.addresses[e];Object.keys(o).length>0&&(global.init_addresses[e]=o)}}
 ✄
-function t(t,o,a){console.log("Inject dynamic hooks"),a.forEach((a=>{a.methods.forEach((n=>{try{const e=n.split("/"),c=e.slice(0,-1).join("/").slice(1),s=e[e.length-1];if(n.startsWith("L"))try{!function(t,o,a,n,e,c){function s(a){const n={message_type:"java_hook_data",type:"dynamic_hook_log",dump:"dynamic_hook.json",data_type:"json",pid:t,process:o,timestamp:Date.now(),data:a};send(n)}const i=Java.use(e),r=i[c].overloads,l=Java.use("java.lang.Exception");r.forEach((t=>{t.implementation=function(){const t=Date.now();try{const o=[].slice.call(arguments),e=this[c].apply(this,arguments),r=l.$new().getStackTrace().toString().split(",");return s({taxonomy_id:a,description:n,timestamp:t,class:i.$className,method:c,arguments:o,returned_value:e||null,stacktrace:r}),e}catch(t){}}}))}(t,o,a.taxonomy_id,a.description,c,s)}catch(t){}}catch(t){}}))}))}export function inject_hooks(o,a,n){Java.perform((()=>{t(o,a,n)}))}
-✄
-export function log_ad_ids(){Java.perform((()=>{!function(){try{Java.use("com.google.android.gms.ads.identifier.AdvertisingIdClient").getAdvertisingIdInfo.overload("android.content.Context").implementation=function(t){const e=this.getAdvertisingIdInfo(t),n=e.getId(),d={type:"advertising_id_log",dump:"ad_ids.txt",data_type:"plain",data:n};return console.log(`Advertising ID requested: ${n}`),send(d),e}}catch(t){}}()}))}
-✄
-export function log_aes_info(t,n){var i=new Array,e=0,a=Java.use("javax.crypto.spec.SecretKeySpec"),o=Java.use("javax.crypto.spec.IvParameterSpec"),r=Java.use("javax.crypto.Cipher"),l=r.doFinal.overload(),s=r.doFinal.overload("[B"),c=r.doFinal.overload("[B","int"),u=r.doFinal.overload("[B","int","int"),p=r.doFinal.overload("[B","int","int","[B"),m=r.doFinal.overload("[B","int","int","[B","int"),d=r.update.overload("[B"),v=r.update.overload("[B","int","int"),h=r.update.overload("[B","int","int","[B"),g=r.update.overload("[B","int","int","[B","int"),f=a.$init.overload("[B","java.lang.String"),y=a.$init.overload("[B","int","int","java.lang.String");o.$init.overload("[B"),o.$init.overload("[B","int","int");function B(a,o,r,l){const s={type:"crypto_traces",dump:"aes_info.json",data_type:"json",pid:t,process:n,timestamp:Date.now(),data:{iv:j(a),alg:o,in:j(r),out:j(l),key:""}};send(s),i=[],e=0}function j(t){return null===t?"":Array.from(t,(function(t){return("0"+(255&t).toString(16)).slice(-2)})).join("")}function _(t){var n,i="";if(null===t)return i;for(var e=0;e<t.length;e++)i+=String.fromCharCode((t[e]%(n=256)+n)%n);return i}function A(t){for(var n=0;n<t.length;n++)i[e]=t[n],e+=1}f.implementation=function(i,e){_(i);const a={type:"crypto_traces",dump:"aes_info.json",data_type:"json",pid:t,process:n,timestamp:Date.now(),data:{iv:"",alg:e,in:"",out:"",key:j(i)}};return send(a),f.call(this,i,e)},y.implementation=function(i,e,a,o){_(i);const r={type:"crypto_traces",dump:"aes_info.json",data_type:"json",pid:t,process:n,timestamp:Date.now(),data:{iv:"",alg:o,in:"",out:"",key:j(i)}};return send(r),y.call(this,i,e,a,o)},l.implementation=function(){var t=l.call(this);return B(this.getIV(),this.getAlgorithm(),i,t),t},s.implementation=function(t){A(t);var n=s.call(this,t);return B(this.getIV(),this.getAlgorithm(),i,n),n},c.implementation=function(t,n){A(t);var e=c.call(this,t,n);return B(this.getIV(),this.getAlgorithm(),i,e),e},u.implementation=function(t,n,e){A(t);var a=u.call(this,t,n,e);return B(this.getIV(),this.getAlgorithm(),i,a),a},p.implementation=function(t,n,e,a){A(t);var o=p.call(this,t,n,e,a);return B(this.getIV(),this.getAlgorithm(),i,o),o},m.implementation=function(t,n,e,a,o){A(t);var r=m.call(this,t,n,e,a,o);return B(this.getIV(),this.getAlgorithm(),i,a),r},d.implementation=function(t){return A(t),d.call(this,t)},v.implementation=function(t,n,i){return A(t),v.call(this,t,n,i)},h.implementation=function(t,n,i,e){return A(t),h.call(this,t,n,i,e)},g.implementation=function(t,n,i,e,a){return A(t),g.call(this,t,n,i,e,a)}}
-✄
-function e(e,t){Process.getModuleByName({linux:"libc.so",darwin:"libSystem.B.dylib",windows:"ws2_32.dll"}[Process.platform]).enumerateExports().filter((e=>"function"===e.type&&["connect","recv","send","read","write"].some((t=>0===e.name.indexOf(t))))).forEach((o=>{Interceptor.attach(o.address,{onEnter:function(n){const s=n[0].toInt32(),a=Socket.type(s);if("tcp"!==a&&"tcp6"!==a&&"udp"!==a&&"udp6"!==a)return;const c=Socket.peerAddress(s);if(null===c)return;const r=Socket.localAddress(s);if(null===r)return;const i={socket_fd:s,socket_type:a,pid:Process.id,thread_id:this.threadId,socket_event_type:o.name,dest_ip:c.ip,dest_port:c.port,local_ip:r.ip,local_port:r.port};if(null!==Java.vm&&null!==Java.vm.tryGetEnv()){const e=Java.use("java.lang.Exception").$new().getStackTrace();i.stack=e.map((e=>({class:e.getClassName(),file:e.getFileName(),line:e.getLineNumber(),method:e.getMethodName(),is_native:e.isNativeMethod(),str:e.toString()})))}!function(o){const n={type:"socket_traces",dump:"socket_trace.json",pid:e,process:t,data_type:"json",timestamp:Date.now(),data:o};send(n)}(i)}})}))}export function socket_trace(t,o){e(t,o)}
-✄
-export function no_root(){Java.perform((function(){var e=["com.noshufou.android.su","com.noshufou.android.su.elite","eu.chainfire.supersu","com.koushikdutta.superuser","com.thirdparty.superuser","com.yellowes.su","com.koushikdutta.rommanager","com.koushikdutta.rommanager.license","com.dimonvideo.luckypatcher","com.chelpus.lackypatch","com.ramdroid.appquarantine","com.ramdroid.appquarantinepro","com.devadvance.rootcloak","com.devadvance.rootcloakplus","de.robv.android.xposed.installer","com.saurik.substrate","com.zachspong.temprootremovejb","com.amphoras.hidemyroot","com.amphoras.hidemyrootadfree","com.formyhm.hiderootPremium","com.formyhm.hideroot","me.phh.superuser","eu.chainfire.supersu.pro","com.kingouser.com","com.topjohnwu.magisk"],a=["su","busybox","supersu","Superuser.apk","KingoUser.apk","SuperSu.apk","magisk"],o={"ro.build.selinux":"1","ro.debuggable":"0","service.adb.root":"0","ro.secure":"1"},n=[];for(var t in o)n.push(t);var s=Java.use("android.app.ApplicationPackageManager"),i=Java.use("java.lang.Runtime"),r=Java.use("java.io.File"),l=Java.use("java.lang.String"),c=Java.use("android.os.SystemProperties"),u=Java.use("java.io.BufferedReader"),d=Java.use("java.lang.ProcessBuilder");Java.use("java.lang.StringBuffer"),Java.enumerateLoadedClassesSync();s.getPackageInfo.overload("java.lang.String","int").implementation=function(a,o){return e.indexOf(a)>-1&&(console.log("Bypass root check for package: "+a),a="set.package.name.to.a.fake.one.so.we.can.bypass.it"),this.getPackageInfo.overload("java.lang.String","int").call(this,a,o)},r.exists.implementation=function(){var e=r.getName.call(this);return a.indexOf(e)>-1?(console.log("Bypass return value for binary: "+e),!1):this.exists.call(this)};var m=i.exec.overload("[Ljava.lang.String;"),p=i.exec.overload("java.lang.String"),h=i.exec.overload("java.lang.String","[Ljava.lang.String;"),g=i.exec.overload("[Ljava.lang.String;","[Ljava.lang.String;"),f=i.exec.overload("[Ljava.lang.String;","[Ljava.lang.String;","java.io.File"),v=i.exec.overload("java.lang.String","[Ljava.lang.String;","java.io.File");v.implementation=function(e,a,o){if(-1!=e.indexOf("getprop")||"mount"==e||-1!=e.indexOf("build.prop")||"id"==e||"sh"==e){var n="grep";return console.log("Bypass "+e+" command"),p.call(this,n)}if("su"==e){n="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,n)}return v.call(this,e,a,o)},f.implementation=function(e,a,o){for(var n=0;n<e.length;n+=1){var t=e[n];if(-1!=t.indexOf("getprop")||"mount"==t||-1!=t.indexOf("build.prop")||"id"==t||"sh"==t){var s="grep";return console.log("Bypass "+e+" command"),p.call(this,s)}if("su"==t){s="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,s)}}return f.call(this,e,a,o)},g.implementation=function(e,a){for(var o=0;o<e.length;o+=1){var n=e[o];if(-1!=n.indexOf("getprop")||"mount"==n||-1!=n.indexOf("build.prop")||"id"==n||"sh"==n){var t="grep";return console.log("Bypass "+e+" command"),p.call(this,t)}if("su"==n){t="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,t)}}return g.call(this,e,a)},h.implementation=function(e,a){if(-1!=e.indexOf("getprop")||"mount"==e||-1!=e.indexOf("build.prop")||"id"==e||"sh"==e){var o="grep";return console.log("Bypass "+e+" command"),p.call(this,o)}if("su"==e){o="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,o)}return h.call(this,e,a)},m.implementation=function(e){for(var a=0;a<e.length;a+=1){var o=e[a];if(-1!=o.indexOf("getprop")||"mount"==o||-1!=o.indexOf("build.prop")||"id"==o||"sh"==o){var n="grep";return console.log("Bypass "+e+" command"),p.call(this,n)}if("su"==o){n="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,n)}}return m.call(this,e)},p.implementation=function(e){if(-1!=e.indexOf("getprop")||"mount"==e||-1!=e.indexOf("build.prop")||"id"==e||"sh"==e){var a="grep";return console.log("Bypass "+e+" command"),p.call(this,a)}if("su"==e){a="justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";return console.log("Bypass "+e+" command"),p.call(this,a)}return p.call(this,e)},l.contains.implementation=function(e){return"test-keys"==e?(console.log("Bypass test-keys check"),!1):this.contains.call(this,e)},c.get.overload("java.lang.String").implementation=function(e){return-1!=n.indexOf(e)?(console.log("Bypass "+e),o[e]):this.get.call(this,e)},Interceptor.attach(Module.findExportByName("libc.so","fopen"),{onEnter:function(e){var o=Memory.readCString(e[0]),n=(o=o.split("/"))[o.length-1];a.indexOf(n)>-1&&(Memory.writeUtf8String(e[0],"/notexists"),console.log("Bypass native fopen"))},onLeave:function(e){}}),Interceptor.attach(Module.findExportByName("libc.so","system"),{onEnter:function(e){var a=Memory.readCString(e[0]);console.log("SYSTEM CMD: "+a),-1==a.indexOf("getprop")&&"mount"!=a&&-1==a.indexOf("build.prop")&&"id"!=a||(console.log("Bypass native system: "+a),Memory.writeUtf8String(e[0],"grep")),"su"==a&&(console.log("Bypass native system: "+a),Memory.writeUtf8String(e[0],"justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled"))},onLeave:function(e){}}),u.readLine.overload("boolean").implementation=function(){var e=this.readLine.overload("boolean").call(this);null===e||e.indexOf("ro.build.tags=test-keys")>-1&&(console.log("Bypass build.prop file read"),e=e.replace("ro.build.tags=test-keys","ro.build.tags=release-keys"));return e};d.command.overload("java.util.List");d.start.implementation=function(){for(var e=this.command.call(this),a=!1,o=0;o<e.size();o+=1){var n=e.get(o).toString();-1==n.indexOf("getprop")&&-1==n.indexOf("mount")&&-1==n.indexOf("build.prop")&&-1==n.indexOf("id")||(a=!0)}return a?(console.log("Bypass ProcessBuilder "+e),this.command.call(this,["grep"]),this.start.call(this)):-1!=e.indexOf("su")?(console.log("Bypass ProcessBuilder "+e),this.command.call(this,["justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled"]),this.start.call(this)):this.start.call(this)}}))}
\ No newline at end of file
+// Coalesce the records sent by the hooks into one message per dump target.
+// The envelope (type, dump, data_type, pid, process) is sent once per batch and
+// byte payloads travel through the binary channel of send() instead of hex strings.
+
+const MAX_BATCH_RECORDS = 256;
+const MAX_BATCH_BYTES = 512 * 1024;
+const FLUSH_INTERVAL_MS = 500;
+
+const _batches = {};
+let _flush_timer = null;
+let _disposed = false;
+
+function _to_bytes(arr) {
+    if (arr === null || arr === undefined)
+        return null;
+    if (arr instanceof ArrayBuffer)
+        return new Uint8Array(arr);
+    const bytes = new Uint8Array(arr.length);
+    for (let i = 0; i < arr.length; i++) {
+        bytes[i] = arr[i] & 0xFF;
+    }
+    return bytes;
+}
+
+function _send_batch(key) {
+    const batch = _batches[key];
+    delete _batches[key];
+    if (batch === undefined || batch.records.length === 0)
+        return;
+    const msg = Object.assign({contentType: 'batch', records: batch.records}, batch.envelope);
+    if (batch.size === 0) {
+        send(msg);
+        return;
+    }
+    const payload = new Uint8Array(batch.size);
+    let offset = 0;
+    batch.chunks.forEach(chunk => {
+        payload.set(chunk, offset);
+        offset += chunk.length;
+    });
+    send(msg, payload.buffer);
+}
+
+export function flush_batches() {
+    if (_flush_timer !== null) {
+        clearTimeout(_flush_timer);
+        _flush_timer = null;
+    }
+    Object.keys(_batches).forEach(key => _send_batch(key));
+}
+
+// Frida calls rpc.exports.dispose() when the script is unloaded, e.g. when the instrumented
+// process exits: the pending batches are sent and the records queued afterwards are sent at once.
+export function dispose() {
+    _disposed = true;
+    flush_batches();
+}
+
+// envelope: fields shared by all the records of a dump target
+// data: the record itself
+// payloads: optional {field_name: byte array} transferred as raw bytes, the Python
+//           side stores them hex-encoded in data[field_name]
+export function queue_record(envelope, data, payloads) {
+    const key = `${envelope.dump}:${envelope.pid}`;
+    let batch = _batches[key];
+    if (batch === undefined) {
+        batch = {envelope: envelope, records: [], chunks: [], size: 0};
+        _batches[key] = batch;
+    }
+    const record = {timestamp: Date.now(), data: data};
+    if (payloads) {
+        record.bin = {};
+        Object.keys(payloads).forEach(name => {
+            const bytes = _to_bytes(payloads[name]);
+            if (bytes === null)
+                return;
+            record.bin[name] = [batch.size, bytes.length];
+            batch.chunks.push(bytes);
+            batch.size += bytes.length;
+        });
+    }
+    batch.records.push(record);
+    if (_disposed || batch.records.length >= MAX_BATCH_RECORDS || batch.size >= MAX_BATCH_BYTES) {
+        _send_batch(key);
+    } else if (_flush_timer === null) {
+        _flush_timer = setTimeout(() => {
+            _flush_timer = null;
+            flush_batches();
+        }, FLUSH_INTERVAL_MS);
+    }
+}
+✄
+// SPDX-FileCopyrightText: 2024 Pôle d'Expertise de la Régulation Numérique - PEReN <contact@peren.gouv.fr>
+// SPDX-License-Identifier: MIT
+
+import { intern_stack } from "./stack_interning.js";
+
+function _inject_hooks(pid, process, hook_list) {
+    console.log('Inject dynamic hooks')
+    hook_list.forEach(item => {
+        item.methods.forEach(method => {
+            try {
+                const name_split = method.split('/');
+                const class_name = name_split.slice(0, -1).join('/').slice(1);
+                const method_name = name_split[name_split.length - 1];
+                if (method.startsWith('L')) {
+                    try {
+                        _inject_hook(pid, process, item.taxonomy_id, item.description, class_name, method_name);
+                    } catch (error) {}
+                }
+            } catch (error) {}
+        });
+    });
+}
+
+function _inject_hook(pid, process, taxonomy_id, description, class_name, method_name) {
+    function _send_msg(msg) {
+        const _msg = {
+            message_type: "java_hook_data",
+            type: 'dynamic_hook_log',
+            dump: 'dynamic_hook.json',
+            data_type: 'json',
+            pid: pid,
+            process: process,
+            timestamp: Date.now(),
+            data: msg
+        }
+        send(_msg)
+    }
+
+    const target_class = Java.use(class_name);
+    const overloads = target_class[method_name].overloads;
+    const Exception = Java.use('java.lang.Exception');
+    // hook each method's overloads
+    overloads.forEach(overload => {
+        overload.implementation = function () {
+            const timestamp = Date.now();
+            try {
+                const args = [].slice.call(arguments);
+                const returned_value = this[method_name].apply(this, arguments);
+                const stacktrace = Exception.$new().getStackTrace().toString().split(',');
+                const stacktrace_id = intern_stack(pid, process, stacktrace.join('\n'), () => stacktrace);
+                _send_msg({
+                    taxonomy_id: taxonomy_id,
+                    description: description,
+                    timestamp: timestamp,
+                    class: target_class.$className,
+                    method: method_name,
+                    arguments: args,
+                    returned_value: returned_value ? returned_value : null,
+                    stacktrace_id: stacktrace_id
+                });
+                return returned_value;
+            } catch (error) {}
+        };
+    });
+}
+
+export function inject_hooks(pid, process, hook_list) {
+    Java.perform(() => {
+        _inject_hooks(pid, process, hook_list);
+    });
+}
+✄
+function _log_ad_ids() {
+    try {
+        const client = Java.use('com.google.android.gms.ads.identifier.AdvertisingIdClient');
+        client.getAdvertisingIdInfo.overload('android.content.Context').implementation = function (x) {
+            const i = this.getAdvertisingIdInfo(x);
+            const id = i.getId();
+            const msg = {
+                'type': 'advertising_id_log',
+                'dump': 'ad_ids.txt',
+                'data_type': 'plain',
+                'data': id
+            }
+            console.log(`Advertising ID requested: ${id}`)
+            send(msg);
+            return i;
+        };
+    } catch (e) {
+    }
+}
+
+export function log_ad_ids() {
+    Java.perform(() => {
+        _log_ad_ids();
+    });
+}
+✄
+import { queue_record } from "./batch_sender.js";
+
+export function log_aes_info(pid, process) {
+
+    var use_single_byte = false;
+    var complete_bytes = new Array();
+    var index = 0;
+
+
+    const envelope = {
+        'type': 'crypto_traces',
+        'dump': 'aes_info.json',
+        'data_type': 'json',
+        'pid': pid,
+        'process': process
+    }
+
+    var secretKeySpecDef = Java.use('javax.crypto.spec.SecretKeySpec');
+
+    var ivParameterSpecDef = Java.use('javax.crypto.spec.IvParameterSpec');
+
+    var cipherDef = Java.use('javax.crypto.Cipher');
+
+    var cipherDoFinal_1 = cipherDef.doFinal.overload();
+    var cipherDoFinal_2 = cipherDef.doFinal.overload('[B');
+    var cipherDoFinal_3 = cipherDef.doFinal.overload('[B', 'int');
+    var cipherDoFinal_4 = cipherDef.doFinal.overload('[B', 'int', 'int');
+    var cipherDoFinal_5 = cipherDef.doFinal.overload('[B', 'int', 'int', '[B');
+    var cipherDoFinal_6 = cipherDef.doFinal.overload('[B', 'int', 'int', '[B', 'int');
+
+    var cipherUpdate_1 = cipherDef.update.overload('[B');
+    var cipherUpdate_2 = cipherDef.update.overload('[B', 'int', 'int');
+    var cipherUpdate_3 = cipherDef.update.overload('[B', 'int', 'int', '[B');
+    var cipherUpdate_4 = cipherDef.update.overload('[B', 'int', 'int', '[B', 'int');
+
+    var secretKeySpecDef_init_1 = secretKeySpecDef.$init.overload('[B', 'java.lang.String');
+
+    var secretKeySpecDef_init_2 = secretKeySpecDef.$init.overload('[B', 'int', 'int', 'java.lang.String');
+
+    var ivParameterSpecDef_init_1 = ivParameterSpecDef.$init.overload('[B');
+
+    var ivParameterSpecDef_init_2 = ivParameterSpecDef.$init.overload('[B', 'int', 'int');
+
+    secretKeySpecDef_init_1.implementation = function(arr, alg) {
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'key': arr
+        });
+        // console.log("Creating " + alg + " secret key, plaintext:\\n" + hexdump(key));
+        return secretKeySpecDef_init_1.call(this, arr, alg);
+    }
+
+    secretKeySpecDef_init_2.implementation = function(arr, off, len, alg) {
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'key': arr
+        });
+        // console.log("Creating " + alg + " secret key, plaintext:\\n" + hexdump(key));
+        return secretKeySpecDef_init_2.call(this, arr, off, len, alg);
+    }
+
+    cipherDoFinal_1.implementation = function() {
+        var ret = cipherDoFinal_1.call(this);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, ret);
+        return ret;
+    }
+
+    cipherDoFinal_2.implementation = function(arr) {
+        addtoarray(arr);
+        var ret = cipherDoFinal_2.call(this, arr);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, ret);
+        return ret;
+    }
+
+    cipherDoFinal_3.implementation = function(arr, a) {
+        addtoarray(arr);
+        var ret = cipherDoFinal_3.call(this, arr, a);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, ret);
+        return ret;
+    }
+
+    cipherDoFinal_4.implementation = function(arr, a, b) {
+        addtoarray(arr);
+        var ret = cipherDoFinal_4.call(this, arr, a, b);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, ret);
+        return ret;
+    }
+
+    cipherDoFinal_5.implementation = function(arr, a, b, c) {
+        addtoarray(arr);
+        var ret = cipherDoFinal_5.call(this, arr, a, b, c);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, ret);
+        return ret;
+    }
+
+    cipherDoFinal_6.implementation = function(arr, a, b, c, d) {
+        addtoarray(arr);
+        var ret = cipherDoFinal_6.call(this, arr, a, b, c, d);
+        info(this.getIV(), this.getAlgorithm(), complete_bytes, c);
+        return ret;
+    }
+
+    cipherUpdate_1.implementation = function(arr) {
+        addtoarray(arr);
+        return cipherUpdate_1.call(this, arr);
+    }
+
+    cipherUpdate_2.implementation = function(arr, a, b) {
+        addtoarray(arr);
+        return cipherUpdate_2.call(this, arr, a, b);
+    }
+
+    cipherUpdate_3.implementation = function(arr, a, b, c) {
+        addtoarray(arr);
+        return cipherUpdate_3.call(this, arr, a, b, c);
+    }
+
+    cipherUpdate_4.implementation = function(arr, a, b, c, d) {
+        addtoarray(arr);
+        return cipherUpdate_4.call(this, arr, a, b, c, d);
+    }
+
+    function info(iv, alg, plain, encoded) {
+        queue_record(envelope, {
+            'iv': '',
+            'alg': alg,
+            'in': '',
+            'out': '',
+            'key': ''
+        }, {
+            'iv': iv,
+            'in': plain,
+            'out': encoded
+        });
+        complete_bytes = [];
+        index = 0;
+    }
+
+    function hexdump(buffer, blockSize) {
+        blockSize = blockSize || 16;
+        var lines = [];
+        var hex = "0123456789ABCDEF";
+        for (var b = 0; b < buffer.length; b += blockSize) {
+            var block = buffer.slice(b, Math.min(b + blockSize, buffer.length));
+            var addr = ("0000" + b.toString(16)).slice(-4);
+            var codes = block.split('').map(function(ch) {
+                var code = ch.charCodeAt(0);
+                return " " + hex[(0xF0 & code) >> 4] + hex[0x0F & code];
+            }).join("");
+            codes += "   ".repeat(blockSize - block.length);
+            var chars = block.replace(/[\\x00-\\x1F\\x20]/g, '.');
+            chars += " ".repeat(blockSize - block.length);
+            lines.push(addr + " " + codes + "  " + chars);
+        }
+        return lines.join("\\n");
+    }
+
+    function addtoarray(arr) {
+        for (var i = 0; i < arr.length; i++) {
+            complete_bytes[index] = arr[i];
+            index = index + 1;
+        }
+    }
+}
+✄
+import { queue_record } from "./batch_sender.js";
+import { intern_stack } from "./stack_interning.js";
+
+const MAX_TRACKED_FLOWS = 4096;
+
+// Decide which socket events are worth a trace, see CaptureManager for the available modes:
+//  - all: every event
+//  - first-per-flow: the first event of each (fd, 5-tuple)
+//  - every-n: the first event of each flow then one event out of n
+//  - token-bucket: at most `rate` events per second for the process, with bursts of `burst` events
+function _build_sampler(policy) {
+    const mode = (policy && policy.mode) || 'all';
+    if (mode === 'all')
+        return null;
+    const flows = new Map();
+    function _flow_count(flow_key) {
+        const count = flows.has(flow_key) ? flows.get(flow_key) + 1 : 1;
+        if (count === 1 && flows.size >= MAX_TRACKED_FLOWS) {
+            // Forget the oldest flow, Map preserves the insertion order
+            flows.delete(flows.keys().next().value);
+        }
+        flows.set(flow_key, count);
+        return count;
+    }
+    if (mode === 'first-per-flow')
+        return flow_key => _flow_count(flow_key) === 1;
+    if (mode === 'every-n') {
+        const n = Math.max(1, policy.n || 1);
+        return flow_key => (_flow_count(flow_key) - 1) % n === 0;
+    }
+    if (mode === 'token-bucket') {
+        const rate = policy.rate || 1;
+        const burst = Math.max(1, policy.burst || 1);
+        let tokens = burst;
+        let last_refill = Date.now();
+        return flow_key => {
+            const now = Date.now();
+            tokens = Math.min(burst, tokens + (now - last_refill) * rate / 1000);
+            last_refill = now;
+            if (tokens < 1)
+                return false;
+            tokens -= 1;
+            return true;
+        };
+    }
+    console.log(`Unknown socket sampling mode ${mode}, tracing every socket event`);
+    return null;
+}
+
+function _socket_trace(pid, process, policy) {
+
+    const should_trace = _build_sampler(policy);
+
+    const envelope = {
+        'type': 'socket_traces',
+        'dump': 'socket_trace.json',
+        'pid': pid,
+        'process': process,
+        'data_type': 'json'
+    }
+
+    function _send_msg(msg) {
+        queue_record(envelope, msg);
+    }
+
+    Process
+    .getModuleByName({ linux: 'libc.so', darwin: 'libSystem.B.dylib', windows: 'ws2_32.dll' }[Process.platform])
+    .enumerateExports().filter(ex => ex.type === 'function' && ['connect', 'recv', 'send', 'read', 'write'].some(prefix => ex.name.indexOf(prefix) === 0))
+    .forEach(ex => {
+        Interceptor.attach(ex.address, {
+            onEnter: function (args) {
+                const fd = args[0].toInt32();
+                const socket_type = Socket.type(fd);
+                if (socket_type !== 'tcp' && socket_type !== 'tcp6' && socket_type !== 'udp' && socket_type !== 'udp6')
+                    return;
+                const dest_addr = Socket.peerAddress(fd);
+                if (dest_addr === null)
+                    return;
+                const local_addr = Socket.localAddress(fd);
+                if (local_addr === null)
+                    return;
+                if (should_trace !== null) {
+                    const flow_key = `${fd}|${socket_type}|${local_addr.ip}|${local_addr.port}|${dest_addr.ip}|${dest_addr.port}`;
+                    if (!should_trace(flow_key))
+                        return;
+                }
+                const socket_info = {
+                    socket_fd: fd,
+                    socket_type: socket_type,
+                    pid: Process.id,
+                    thread_id: this.threadId,
+                    socket_event_type: ex.name,
+                    dest_ip: dest_addr.ip,
+                    dest_port: dest_addr.port,
+                    local_ip: local_addr.ip,
+                    local_port: local_addr.port,
+                }
+                if (Java.vm !== null && Java.vm.tryGetEnv() !== null) {
+                    let java_lang_Exception = Java.use("java.lang.Exception")
+                    var exception = java_lang_Exception.$new()
+                    const trace = exception.getStackTrace()
+                    const trace_str = trace.map(trace_elt => trace_elt.toString())
+                    socket_info.stack_id = intern_stack(pid, process, trace_str.join('\n'), () => {
+                      return trace.map((trace_elt, i) => {
+                        return {
+                          class: trace_elt.getClassName(),
+                          file: trace_elt.getFileName(),
+                          line: trace_elt.getLineNumber(),
+                          method: trace_elt.getMethodName(),
+                          is_native: trace_elt.isNativeMethod(),
+                          str: trace_str[i]
+                        }
+                      })
+                    })
+                  }
+                _send_msg(socket_info);
+            }
+        })
+    })
+
+    // The policy actually applied, unknown modes fall back to tracing every event
+    return should_trace === null ? {mode: 'all'} : policy;
+}
+
+export function socket_trace(pid, process, policy) {
+    return _socket_trace(pid, process, policy);
+}
+✄
+/*
+Original author: Daniele Linguaglossa
+28/07/2021 -    Edited by Simone Quatrini
+                Code amended to correctly run on the latest frida version
+        		Added controls to exclude Magisk Manager
+*/
+
+export function no_root(){
+    Java.perform(function() {
+        var RootPackages = ["com.noshufou.android.su", "com.noshufou.android.su.elite", "eu.chainfire.supersu",
+            "com.koushikdutta.superuser", "com.thirdparty.superuser", "com.yellowes.su", "com.koushikdutta.rommanager",
+            "com.koushikdutta.rommanager.license", "com.dimonvideo.luckypatcher", "com.chelpus.lackypatch",
+            "com.ramdroid.appquarantine", "com.ramdroid.appquarantinepro", "com.devadvance.rootcloak", "com.devadvance.rootcloakplus",
+            "de.robv.android.xposed.installer", "com.saurik.substrate", "com.zachspong.temprootremovejb", "com.amphoras.hidemyroot",
+            "com.amphoras.hidemyrootadfree", "com.formyhm.hiderootPremium", "com.formyhm.hideroot", "me.phh.superuser",
+            "eu.chainfire.supersu.pro", "com.kingouser.com", "com.topjohnwu.magisk"
+        ];
+        var RootBinaries = ["su", "busybox", "supersu", "Superuser.apk", "KingoUser.apk", "SuperSu.apk", "magisk"];
+        var RootProperties = {
+            "ro.build.selinux": "1",
+            "ro.debuggable": "0",
+            "service.adb.root": "0",
+            "ro.secure": "1"
+        };
+        var RootPropertiesKeys = [];
+    
+        for (var k in RootProperties) RootPropertiesKeys.push(k);
+        var PackageManager = Java.use("android.app.ApplicationPackageManager");
+        var Runtime = Java.use('java.lang.Runtime');
+        var NativeFile = Java.use('java.io.File');
+        var String = Java.use('java.lang.String');
+        var SystemProperties = Java.use('android.os.SystemProperties');
+        var BufferedReader = Java.use('java.io.BufferedReader');
+        var ProcessBuilder = Java.use('java.lang.ProcessBuilder');
+        var StringBuffer = Java.use('java.lang.StringBuffer');
+        var loaded_classes = Java.enumerateLoadedClassesSync();
+        var useKeyInfo = false;
+        var useProcessManager = false;
+        var KeyInfo = null;
+    
+        PackageManager.getPackageInfo.overload('java.lang.String', 'int').implementation = function(pname, flags) {
+            var shouldFakePackage = (RootPackages.indexOf(pname) > -1);
+            if (shouldFakePackage) {
+                console.log("Bypass root check for package: " + pname);
+                pname = "set.package.name.to.a.fake.one.so.we.can.bypass.it";
+            }
+            return this.getPackageInfo.overload('java.lang.String', 'int').call(this, pname, flags);
+        };
+    
+        NativeFile.exists.implementation = function() {
+            var name = NativeFile.getName.call(this);
+            var shouldFakeReturn = (RootBinaries.indexOf(name) > -1);
+            if (shouldFakeReturn) {
+                console.log("Bypass return value for binary: " + name);
+                return false;
+            } else {
+                return this.exists.call(this);
+            }
+        };
+        var exec = Runtime.exec.overload('[Ljava.lang.String;');
+        var exec1 = Runtime.exec.overload('java.lang.String');
+        var exec2 = Runtime.exec.overload('java.lang.String', '[Ljava.lang.String;');
+        var exec3 = Runtime.exec.overload('[Ljava.lang.String;', '[Ljava.lang.String;');
+        var exec4 = Runtime.exec.overload('[Ljava.lang.String;', '[Ljava.lang.String;', 'java.io.File');
+        var exec5 = Runtime.exec.overload('java.lang.String', '[Ljava.lang.String;', 'java.io.File');
+    
+        exec5.implementation = function(cmd, env, dir) {
+            if (cmd.indexOf("getprop") != -1 || cmd == "mount" || cmd.indexOf("build.prop") != -1 || cmd == "id" || cmd == "sh") {
+                var fakeCmd = "grep";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            if (cmd == "su") {
+                var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            return exec5.call(this, cmd, env, dir);
+        };
+    
+        exec4.implementation = function(cmdarr, env, file) {
+            for (var i = 0; i < cmdarr.length; i = i + 1) {
+                var tmp_cmd = cmdarr[i];
+                if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd == "mount" || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd == "id" || tmp_cmd == "sh") {
+                    var fakeCmd = "grep";
+                    console.log("Bypass " + cmdarr + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+    
+                if (tmp_cmd == "su") {
+                    var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                    console.log("Bypass " + cmdarr + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+            }
+            return exec4.call(this, cmdarr, env, file);
+        };
+    
+        exec3.implementation = function(cmdarr, envp) {
+            for (var i = 0; i < cmdarr.length; i = i + 1) {
+                var tmp_cmd = cmdarr[i];
+                if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd == "mount" || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd == "id" || tmp_cmd == "sh") {
+                    var fakeCmd = "grep";
+                    console.log("Bypass " + cmdarr + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+    
+                if (tmp_cmd == "su") {
+                    var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                    console.log("Bypass " + cmdarr + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+            }
+            return exec3.call(this, cmdarr, envp);
+        };
+    
+        exec2.implementation = function(cmd, env) {
+            if (cmd.indexOf("getprop") != -1 || cmd == "mount" || cmd.indexOf("build.prop") != -1 || cmd == "id" || cmd == "sh") {
+                var fakeCmd = "grep";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            if (cmd == "su") {
+                var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            return exec2.call(this, cmd, env);
+        };
+    
+        exec.implementation = function(cmd) {
+            for (var i = 0; i < cmd.length; i = i + 1) {
+                var tmp_cmd = cmd[i];
+                if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd == "mount" || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd == "id" || tmp_cmd == "sh") {
+                    var fakeCmd = "grep";
+                    console.log("Bypass " + cmd + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+    
+                if (tmp_cmd == "su") {
+                    var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                    console.log("Bypass " + cmd + " command");
+                    return exec1.call(this, fakeCmd);
+                }
+            }
+    
+            return exec.call(this, cmd);
+        };
+    
+        exec1.implementation = function(cmd) {
+            if (cmd.indexOf("getprop") != -1 || cmd == "mount" || cmd.indexOf("build.prop") != -1 || cmd == "id" || cmd == "sh") {
+                var fakeCmd = "grep";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            if (cmd == "su") {
+                var fakeCmd = "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled";
+                console.log("Bypass " + cmd + " command");
+                return exec1.call(this, fakeCmd);
+            }
+            return exec1.call(this, cmd);
+        };
+    
+        String.contains.implementation = function(name) {
+            if (name == "test-keys") {
+                console.log("Bypass test-keys check");
+                return false;
+            }
+            return this.contains.call(this, name);
+        };
+        var get = SystemProperties.get.overload('java.lang.String');
+    
+        get.implementation = function(name) {
+            if (RootPropertiesKeys.indexOf(name) != -1) {
+                console.log("Bypass " + name);
+                return RootProperties[name];
+            }
+            return this.get.call(this, name);
+        };
+    
+        Interceptor.attach(Module.findExportByName("libc.so", "fopen"), {
+            onEnter: function(args) {
+                var path = Memory.readCString(args[0]);
+                path = path.split("/");
+                var executable = path[path.length - 1];
+                var shouldFakeReturn = (RootBinaries.indexOf(executable) > -1)
+                if (shouldFakeReturn) {
+                    Memory.writeUtf8String(args[0], "/notexists");
+                    console.log("Bypass native fopen");
+                }
+            },
+            onLeave: function(retval) {
+    
+            }
+        });
+    
+        Interceptor.attach(Module.findExportByName("libc.so", "system"), {
+            onEnter: function(args) {
+                var cmd = Memory.readCString(args[0]);
+                console.log("SYSTEM CMD: " + cmd);
+                if (cmd.indexOf("getprop") != -1 || cmd == "mount" || cmd.indexOf("build.prop") != -1 || cmd == "id") {
+                    console.log("Bypass native system: " + cmd);
+                    Memory.writeUtf8String(args[0], "grep");
+                }
+                if (cmd == "su") {
+                    console.log("Bypass native system: " + cmd);
+                    Memory.writeUtf8String(args[0], "justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled");
+                }
+            },
+            onLeave: function(retval) {
+    
+            }
+        });
+    
+        /*
+    
+        TO IMPLEMENT:
+    
+        Exec Family
+    
+        int execl(const char *path, const char *arg0, ..., const char *argn, (char *)0);
+        int execle(const char *path, const char *arg0, ..., const char *argn, (char *)0, char *const envp[]);
+        int execlp(const char *file, const char *arg0, ..., const char *argn, (char *)0);
+        int execlpe(const char *file, const char *arg0, ..., const char *argn, (char *)0, char *const envp[]);
+        int execv(const char *path, char *const argv[]);
+        int execve(const char *path, char *const argv[], char *const envp[]);
+        int execvp(const char *file, char *const argv[]);
+        int execvpe(const char *file, char *const argv[], char *const envp[]);
+    
+        */
+    
+    
+        BufferedReader.readLine.overload('boolean').implementation = function() {
+            var text = this.readLine.overload('boolean').call(this);
+            if (text === null) {
+                // just pass , i know it's ugly as hell but test != null won't work :(
+            } else {
+                var shouldFakeRead = (text.indexOf("ro.build.tags=test-keys") > -1);
+                if (shouldFakeRead) {
+                    console.log("Bypass build.prop file read");
+                    text = text.replace("ro.build.tags=test-keys", "ro.build.tags=release-keys");
+                }
+            }
+            return text;
+        };
+        var executeCommand = ProcessBuilder.command.overload('java.util.List');
+    
+        ProcessBuilder.start.implementation = function() {
+            var cmd = this.command.call(this);
+            var shouldModifyCommand = false;
+            for (var i = 0; i < cmd.size(); i = i + 1) {
+                var tmp_cmd = cmd.get(i).toString();
+                if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd.indexOf("mount") != -1 || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd.indexOf("id") != -1) {
+                    shouldModifyCommand = true;
+                }
+            }
+            if (shouldModifyCommand) {
+                console.log("Bypass ProcessBuilder " + cmd);
+                this.command.call(this, ["grep"]);
+                return this.start.call(this);
+            }
+            if (cmd.indexOf("su") != -1) {
+                console.log("Bypass ProcessBuilder " + cmd);
+                this.command.call(this, ["justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled"]);
+                return this.start.call(this);
+            }
+    
+            return this.start.call(this);
+        };
+    
+        if (useProcessManager) {
+            var ProcManExec = ProcessManager.exec.overload('[Ljava.lang.String;', '[Ljava.lang.String;', 'java.io.File', 'boolean');
+            var ProcManExecVariant = ProcessManager.exec.overload('[Ljava.lang.String;', '[Ljava.lang.String;', 'java.lang.String', 'java.io.FileDescriptor', 'java.io.FileDescriptor', 'java.io.FileDescriptor', 'boolean');
+    
+            ProcManExec.implementation = function(cmd, env, workdir, redirectstderr) {
+                var fake_cmd = cmd;
+                for (var i = 0; i < cmd.length; i = i + 1) {
+                    var tmp_cmd = cmd[i];
+                    if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd == "mount" || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd == "id") {
+                        var fake_cmd = ["grep"];
+                        console.log("Bypass " + cmdarr + " command");
+                    }
+    
+                    if (tmp_cmd == "su") {
+                        var fake_cmd = ["justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled"];
+                        console.log("Bypass " + cmdarr + " command");
+                    }
+                }
+                return ProcManExec.call(this, fake_cmd, env, workdir, redirectstderr);
+            };
+    
+            ProcManExecVariant.implementation = function(cmd, env, directory, stdin, stdout, stderr, redirect) {
+                var fake_cmd = cmd;
+                for (var i = 0; i < cmd.length; i = i + 1) {
+                    var tmp_cmd = cmd[i];
+                    if (tmp_cmd.indexOf("getprop") != -1 || tmp_cmd == "mount" || tmp_cmd.indexOf("build.prop") != -1 || tmp_cmd == "id") {
+                        var fake_cmd = ["grep"];
+                        console.log("Bypass " + cmdarr + " command");
+                    }
+    
+                    if (tmp_cmd == "su") {
+                        var fake_cmd = ["justafakecommandthatcannotexistsusingthisshouldthowanexceptionwheneversuiscalled"];
+                        console.log("Bypass " + cmdarr + " command");
+                    }
+                }
+                return ProcManExecVariant.call(this, fake_cmd, env, directory, stdin, stdout, stderr, redirect);
+            };
+        }
+    
+        if (useKeyInfo) {
+            KeyInfo.isInsideSecureHardware.implementation = function() {
+                console.log("Bypass isInsideSecureHardware");
+                return true;
+            }
+        }
+    
+    });
+}
+✄
+// Send each distinct stack trace only once and reference it by its identifier afterwards.
+// The stack definitions are saved by the capture manager in stacks.json.
+
+import { queue_record } from "./batch_sender.js";
+
+// Identifier of each stack already sent, by string representation
+const _stack_ids = new Map();
+
+// key: string representation of the stack, e.g. the frames joined with new lines
+// build_frames: callback returning the full frames, only called the first time a stack is seen
+//
+// The identifier is the SHA-256 digest of the key: a collision would attach the wrong call
+// stack to a trace, and the same stack gets the same identifier in every process.
+export function intern_stack(pid, process, key, build_frames) {
+    let stack_id = _stack_ids.get(key);
+    if (stack_id === undefined) {
+        stack_id = Checksum.compute('sha256', key);
+        _stack_ids.set(key, stack_id);
+        queue_record({
+            'type': 'stack_traces',
+            'dump': 'stacks.json',
+            'data_type': 'stacks',
+            'pid': pid,
+            'process': process
+        }, {
+            'stack_id': stack_id,
+            'frames': build_frames()
+        });
+    }
+    return stack_id;
+}
\ No newline at end of file
@@ -0,0 +1,23 @@
+from typing import Iterator, Optional
+
+
+def unpack_records(payload: dict, data: Optional[bytes] = None) -> Iterator[dict]:
+    """
+    Expand a message sent by the Frida agent into the records it carries.
+
+    Batched messages share a single envelope for all their records and transfer byte
+    payloads through the binary channel of send(). Each record is rebuilt as if it had
+    been sent on its own, with byte payloads hex-encoded.
+    """
+    if payload.get('contentType', '') != 'batch':
+        yield payload
+        return
+    envelope = {k: v for k, v in payload.items() if k not in ('contentType', 'records')}
+    for record in payload.get('records', []):
+        record_data = record.get('data')
+        for name, (offset, length) in record.get('bin', {}).items():
+            record_data[name] = data[offset:offset + length].hex() if data else ''
+        unpacked = envelope.copy()
+        unpacked['timestamp'] = record.get('timestamp')
+        unpacked['data'] = record_data
+        yield unpacked
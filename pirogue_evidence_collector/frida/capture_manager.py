@@ -1,26 +1,107 @@
-import json
 import logging
 import os
+import tempfile
 import time
 from importlib import resources
 from pathlib import Path
 
 from pirogue_evidence_collector.android.device import AndroidDevice
 from pirogue_evidence_collector.android.screen import ScreenRecorder
-from pirogue_evidence_collector.network.packet_capture import TcpDump
+from pirogue_evidence_collector.frida.record_writer import (DEFAULT_QUEUE_SIZE, QUEUE_POLICIES, QueuedRecordWriter,
+                                                            RecordWriter)
+from pirogue_evidence_collector.network.flow_tracker import FLOWS_FILE_NAME, FlowTracker
+from pirogue_evidence_collector.network.packet_capture import TcpDump, build_host_filter, is_ethernet_interface
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.compressed_io import check_compression_available
+from pirogue_evidence_collector.utils.startup import StartupPhases
 
 log = logging.getLogger(__name__)
 
 
+SOCKET_SAMPLING_MODES = ('all', 'first-per-flow', 'every-n', 'token-bucket')
+CAPTURE_READY_TIMEOUT = 5
+
+
+def add_capture_arguments(parser):
+    """
+    Add the options of the capture shared by the interception commands.
+    """
+    parser.add_argument(
+        '--capture-command',
+        help=(
+            'Specify directly a capture command instead of building it from interface. '
+            'Useful for remote capture over SSH. Example: '
+            'ssh root@openwrt "tcpdump -U -n -w - -i wlan0 \'host PHONE_IP\'"'
+        )
+    )
+    parser.add_argument('-o', '--output', help='The output directory')
+    parser.add_argument('-i', '--iface', help='The network interface to capture', default=None)
+    parser.add_argument('--disable-screenrecord', action='store_false', help='Use to disable screen recording')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='Maximum number of Frida records waiting to be written to disk')
+    parser.add_argument('--queue-policy', choices=QUEUE_POLICIES, default='block',
+                        help='What to do with new Frida records when the writer queue is full')
+    parser.add_argument('--socket-sampling', choices=SOCKET_SAMPLING_MODES, default='all',
+                        help='Which socket events are traced: all of them, the first one of each flow, the first one '
+                             'and then one out of N of each flow, or a rate limited number per process')
+    parser.add_argument('--socket-sampling-n', type=int, default=100,
+                        help='Trace one socket event out of N for each flow in every-n mode')
+    parser.add_argument('--socket-sampling-rate', type=float, default=50.0,
+                        help='Maximum number of socket events traced per second and per process in token-bucket mode')
+    parser.add_argument('--socket-sampling-burst', type=int, default=100,
+                        help='Maximum burst of socket events traced per process in token-bucket mode')
+    parser.add_argument('--bpf-filter', default=None,
+                        help='Capture filter given to tcpdump, defaults to the traffic of the IP and MAC addresses of '
+                             'the device')
+    parser.add_argument('--disable-device-filter', action='store_false',
+                        help='Use to capture the traffic of all the hosts instead of the device only')
+    parser.add_argument('--snaplen', type=int, default=None,
+                        help='Maximum number of bytes captured per packet, defaults to the tcpdump default')
+    parser.add_argument('--disable-flow-tracking', action='store_false',
+                        help='Use to disable the live accounting of the network flows saved in flows.json')
+    parser.add_argument('--rotate-size', type=int, default=None, metavar='MIB',
+                        help='Start a new capture file, traffic-00001.pcap, traffic-00002.pcap..., every MIB mebibytes')
+    parser.add_argument('--rotate-seconds', type=int, default=None, metavar='SECONDS',
+                        help='Start a new capture file, traffic-00001.pcap, traffic-00002.pcap..., every SECONDS seconds')
+    parser.add_argument('--compress', action='store_true',
+                        help='Compress the capture and the Frida traces with zstd, their SHA-256 and SHA-512 '
+                             'digests are saved in experiment.json')
+    parser.add_argument('--compact-json', action='store_true',
+                        help='Write compact JSON files instead of indented ones, faster and smaller')
+
+
 class CaptureManager:
-    def __init__(self, output_dir, iface=None, record_screen=True):
+    def __init__(self, output_dir, iface=None, record_screen=True, queue_size=DEFAULT_QUEUE_SIZE, queue_policy='block',
+                 socket_sampling=None, rotate_size=None, rotate_seconds=None, track_flows=True,
+                 bpf_filter=None, snaplen=None, filter_device=True, compress=False, serial=None):
+        if compress:
+            check_compression_available()
         self.output_dir = output_dir
-        self._output_files = {}
+        # Serial number of the device to capture, the only connected one if not set
+        self.serial = serial
+        self.compress = compress
+        self.bpf_filter = bpf_filter
+        self.snaplen = snaplen
+        self.filter_device = filter_device
+        self.device_ip_addresses = []
+        self.device_mac_addresses = []
+        self.track_flows = track_flows
+        self.flow_tracker = None
+        self.rotate_size = rotate_size
+        self.rotate_seconds = rotate_seconds
+        self.writer = None
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.socket_sampling = socket_sampling or {'mode': 'all'}
         self.captured_data = {}
         self.tcp_dump = None
         self.device = None
+        self.device_capture_ts = None
+        self.net_capture_ts = None
+        self.screen_capture_ts = None
         self._js_script = None
         self.screen_recorder = None
+        self.started = False
         self.record_screen = record_screen
         # ToDo - Load configuration from the administration interface
         default_iface = 'wlan0'
@@ -32,34 +113,54 @@ class CaptureManager:
     def start_capture(self, capture_cmd=None):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
-        self.tcp_dump = TcpDump(
-            interface=self.iface,
-            output_dir=self.output_dir,
-            pcap_file_name='traffic.pcap',
-            capture_cmd=capture_cmd
+        self.writer = QueuedRecordWriter(
+            RecordWriter(self.output_dir, compress=self.compress),
+            max_size=self.queue_size,
+            policy=self.queue_policy
         )
-        self.device = AndroidDevice()
+        self.writer.start()
+        # Independent steps run concurrently, e.g. tcpdump is probed while the device is set up
+        startup = StartupPhases('Capture startup')
+        capture_rights = None
+        if not capture_cmd:
+            capture_rights = startup.run('capture rights', TcpDump.check_user_rights)
+        device = startup.run('device', self._connect_device)
+        startup.run('device properties', self.save_device_properties, after=[device])
+        # The device is needed first to only capture its traffic
+        capture_filter = startup.run('capture filter', self.build_capture_filter, after=[device])
+        startup.run(
+            'network capture', self._start_network_capture, capture_cmd, capture_filter,
+            after=[capture_rights, capture_filter])
+        startup.run('frida server', self._start_frida_server, after=[device])
         if self.record_screen:
-            self.screen_recorder = ScreenRecorder(self.device, self.output_dir)
-        self.save_device_properties()
-        device_capture_ts = time.time()*1000
-        # Prevent Zygote from pre-forking, Android >= 10 (API 29)
-        if int(self.device.get_property('ro.build.version.sdk').strip()) >= 29:
-            self.device.adb_shell('setprop persist.device_config.runtime_native.usap_pool_enabled false')
-        self.device.start_frida_server()
-        self.tcp_dump.start_capture()
-        net_capture_ts = time.time()*1000
+            startup.run('screen recording', self._start_screen_recording, after=[device])
+        try:
+            startup.wait()
+        except Exception:
+            self._abort_startup()
+            raise
+        self.started = True
         self.captured_data = {
+            'compression': 'zstd' if self.compress else None,
             'network': {
-                'start_capture_time': net_capture_ts,
-                'file': 'traffic.pcap'
+                'start_capture_time': self.net_capture_ts,
+                'file': 'traffic.pcap',
+                'rotation': {
+                    'max_size': self.rotate_size,
+                    'max_seconds': self.rotate_seconds
+                },
+                'bpf_filter': self.tcp_dump.bpf_filter,
+                'snaplen': self.tcp_dump.snaplen,
+                'device_ip_addresses': self.device_ip_addresses,
+                'device_mac_addresses': self.device_mac_addresses
             },
             'device': {
-                'start_capture_time': device_capture_ts,
+                'start_capture_time': self.device_capture_ts,
                 'file': 'device.json'
             },
             'socket_traces': {
-                'file': 'socket_trace.json'
+                'file': 'socket_trace.json',
+                'sampling': self.socket_sampling
             },
             'crypto_traces': {
                 'file': 'aes_info.json'
@@ -68,14 +169,92 @@ class CaptureManager:
                 'file': 'sslkeylog.txt'
             }
         }
+        if self.flow_tracker:
+            self.captured_data['flows'] = {
+                'file': FLOWS_FILE_NAME
+            }
         if self.record_screen:
-            self.screen_recorder.start_recording()
-            screen_capture_ts = time.time()*1000
             self.captured_data['screen'] = {
-                'start_capture_time': screen_capture_ts,
+                'start_capture_time': self.screen_capture_ts,
                 'file': 'screen.mp4'
             }
 
+    def _abort_startup(self):
+        # Stop the phases which started before another one failed, e.g. tcpdump would keep running
+        log.error('The capture failed to start, stopping the started phases')
+        steps = []
+        if self.tcp_dump and self.tcp_dump.process:
+            steps.append(self.tcp_dump.stop_capture)
+        if self.flow_tracker:
+            steps.append(self.flow_tracker.stop)
+        if self.screen_recorder:
+            steps.append(self.screen_recorder.stop_recording)
+        if self.device:
+            steps.extend([self.device.stop_frida_server, self.device.close])
+        steps.append(self.writer.close)
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                log.error(e)
+
+    def _connect_device(self):
+        self.device = AndroidDevice(serial=self.serial)
+
+    def _start_network_capture(self, capture_cmd, capture_filter):
+        self.tcp_dump = TcpDump(
+            interface=self.iface,
+            output_dir=self.output_dir,
+            pcap_file_name='traffic.pcap',
+            capture_cmd=capture_cmd,
+            rotate_size=self.rotate_size,
+            rotate_seconds=self.rotate_seconds,
+            bpf_filter=capture_filter.result(),
+            snaplen=self.snaplen,
+            compress=self.compress
+        )
+        if self.track_flows:
+            self.flow_tracker = FlowTracker(self.output_dir)
+            self.flow_tracker.start()
+            self.tcp_dump.add_listener(self.flow_tracker.on_packet)
+        # The user rights have been checked concurrently
+        self.tcp_dump.start_capture(check_user_rights=False)
+        if not self.tcp_dump.wait_until_ready(CAPTURE_READY_TIMEOUT):
+            log.warning(f'The network capture did not start within {CAPTURE_READY_TIMEOUT} seconds')
+        self.net_capture_ts = time.time()*1000
+
+    def _start_frida_server(self):
+        # Prevent Zygote from pre-forking, Android >= 10 (API 29)
+        api_level = self.device.get_property('ro.build.version.sdk').strip()
+        if not api_level.isdigit():
+            # The property is ignored by the older versions, disabling the pool is harmless
+            log.warning(f'Unable to get the API level of the device ({api_level!r}), disabling the USAP pool')
+        if not api_level.isdigit() or int(api_level) >= 29:
+            self.device.set_property('persist.device_config.runtime_native.usap_pool_enabled', 'false')
+        self.device.start_frida_server()
+        self.device.wait_for_frida_server()
+
+    def _start_screen_recording(self):
+        self.screen_recorder = ScreenRecorder(self.device, self.output_dir)
+        self.screen_recorder.start_recording()
+        self.screen_capture_ts = time.time()*1000
+
+    def build_capture_filter(self):
+        if self.bpf_filter:
+            return self.bpf_filter
+        if not self.filter_device:
+            return None
+        # The IP addresses are only read once, the ones the device gets during the capture, e.g.
+        # new IPv6 privacy addresses or another DHCP lease, are matched by its MAC address
+        self.device_ip_addresses = self.device.get_ip_addresses()
+        if is_ethernet_interface(self.iface):
+            self.device_mac_addresses = self.device.get_mac_addresses()
+        if not self.device_ip_addresses and not self.device_mac_addresses:
+            log.warning('Unable to get the addresses of the device, capturing the traffic of all the hosts')
+        elif not self.device_mac_addresses:
+            log.warning('The traffic of the IP addresses the device gets during the capture will not be captured')
+        return build_host_filter(self.device_ip_addresses, self.device_mac_addresses)
+
     def get_dynamic_hooks_definitions(self) -> (str, bool):
         hook_definitions = []
         ref = resources.files('pirogue_evidence_collector')
@@ -85,7 +264,7 @@ class CaptureManager:
             return hook_definitions, False
         for hook_file in hook_files:
             with hook_file.open('r') as file:
-                hook_definitions.extend(json.load(file))
+                hook_definitions.extend(serializer.load(file))
         return hook_definitions, True
 
     def get_agent_script(self, extra_scripts_dir=None):
@@ -104,9 +283,11 @@ class CaptureManager:
         # Load the content of the scripts
         for js_file in js_files:
             self._js_script += js_file.read_text()
-        # Write the script to a file for debugging
-        with open('/tmp/script.js', 'w') as f:
+        # Write the script to a file for debugging, one per capture as several may run at the same time
+        script_path = Path(tempfile.gettempdir()) / f'pirogue-script-{os.getpid()}.js'
+        with script_path.open('w', encoding='utf-8') as f:
             f.write(self._js_script)
+        log.debug(f'Agent script written to {script_path}')
 
         return self._js_script
 
@@ -119,40 +300,146 @@ class CaptureManager:
         output_file = data.get('dump')
         if output_file is None:
             return
-        if output_file not in self._output_files:
-            self._output_files[output_file] = []
         if output_type := data.get('type'):
-            self.captured_data[output_type] = {'file': output_file}
-        self._output_files[output_file].append(data)
+            self.captured_data.setdefault(output_type, {})['file'] = output_file
+        if output_type == 'socket_traces' and self.flow_tracker:
+            # The flow is attributed by the flow tracker thread, off the Frida thread
+            self.flow_tracker.attribute(data)
+        self.writer.put(output_file, data)
+
+    def set_applied_socket_sampling(self, policy):
+        # An agent without sampling support returns nothing and traces every socket event
+        applied = policy or {'mode': 'all'}
+        if applied != self.socket_sampling:
+            log.warning(f'The agent applied the socket sampling policy {applied} instead of {self.socket_sampling}')
+        if 'socket_traces' in self.captured_data:
+            self.captured_data['socket_traces']['sampling'] = applied
+
+    @classmethod
+    def from_options(cls, options, serial=None):
+        """
+        Create the capture manager from the options added by add_capture_arguments().
+        """
+        serializer.set_compact_output(options.compact_json)
+        return cls(
+            options.output,
+            iface=options.iface,
+            record_screen=options.disable_screenrecord,
+            queue_size=options.queue_size,
+            queue_policy=options.queue_policy,
+            socket_sampling=cls.build_socket_sampling_policy(
+                options.socket_sampling,
+                n=options.socket_sampling_n,
+                rate=options.socket_sampling_rate,
+                burst=options.socket_sampling_burst,
+            ),
+            rotate_size=options.rotate_size * 1024 * 1024 if options.rotate_size else None,
+            rotate_seconds=options.rotate_seconds,
+            track_flows=options.disable_flow_tracking,
+            bpf_filter=options.bpf_filter,
+            snaplen=options.snaplen,
+            filter_device=options.disable_device_filter,
+            compress=options.compress,
+            serial=serial,
+        )
+
+    @staticmethod
+    def build_socket_sampling_policy(mode='all', n=100, rate=50.0, burst=100):
+        if mode not in SOCKET_SAMPLING_MODES:
+            raise ValueError(f'Unknown socket sampling mode {mode}, expected one of {", ".join(SOCKET_SAMPLING_MODES)}')
+        policy = {'mode': mode}
+        if mode == 'every-n':
+            policy['n'] = n
+        elif mode == 'token-bucket':
+            policy['rate'] = rate
+            policy['burst'] = burst
+        return policy
 
     def save_device_properties(self):
         props = self.device.get_device_properties()
         log.info('Saving device properties')
-        log.info(props)
-        with open(f'{self.output_dir}/device.json', mode='w') as out:
-            json.dump(props, out, indent=2)
+        log.info({name: value for name, value in props.items() if name != 'properties'})
+        with open(f'{self.output_dir}/device.json', mode='w', encoding='utf-8') as out:
+            serializer.dump(props, out)
+        self.device_capture_ts = time.time()*1000
+
+    def save_network_segments(self):
+        if not self.tcp_dump:
+            return
+        if self.flow_tracker:
+            self.flow_tracker.stop()
+            log.info(f'{len(self.flow_tracker)} network flows saved in {FLOWS_FILE_NAME}')
+        segments = self.tcp_dump.get_segments()
+        self.captured_data['network']['segments'] = segments
+        if segments:
+            self.captured_data['network']['file'] = segments[0].get('file')
+        for segment in segments:
+            if segment.get('digests'):
+                self.captured_data.setdefault('digests', {})[segment.get('file')] = segment.get('digests')
+
+    def save_frida_outputs(self):
+        record_writer = self.writer.writer
+        # Compressed outputs are saved under another name than the one requested by the agent
+        for entry in self.captured_data.values():
+            if isinstance(entry, dict) and entry.get('file') in record_writer.outputs:
+                entry['file'] = record_writer.outputs.get(entry.get('file'))
+        if record_writer.digests:
+            self.captured_data.setdefault('digests', {}).update(record_writer.digests)
 
     def save_data_files(self):
+        self.save_network_segments()
         log.info('Saving the data captured by Frida')
-        for filename, elt in self._output_files.items():
-            if len(elt) == 0:
-                with open(f'{self.output_dir}/{filename}', mode='w') as out:
-                    out.write('[]')
-            data_type = elt[0].get('data_type')
-            with open(f'{self.output_dir}/{filename}', mode='w') as out:
-                if data_type == 'json':
-                    json.dump(elt, out, indent=2)
-                else:
-                    for record in elt:
-                        data = record.get('data')
-                        out.write(f'{data}\n')
+        if self.writer:
+            self.writer.close()
+            stats = self.writer.stats()
+            self.captured_data['frida_writer'] = stats
+            if stats.get('dropped'):
+                log.warning(f'{stats.get("dropped")} Frida records have been dropped because the writer queue was full')
+            log.info(
+                f'Frida writer: {stats.get("written")} records written, max queue depth {stats.get("max_queue_depth")}, '
+                f'avg enqueue latency {stats.get("avg_enqueue_latency_ms"):.3f} ms'
+            )
+            self.save_frida_outputs()
         # Save the details of the experiment
-        with open(f'{self.output_dir}/experiment.json', mode='w') as out:
-            json.dump(self.captured_data, out, indent=2)
+        with open(f'{self.output_dir}/experiment.json', mode='w', encoding='utf-8') as out:
+            serializer.dump(self.captured_data, out)
+
+    def analysis_hints(self) -> list:
+        # Commands to analyze the files actually written, once the capture is saved
+        if not self.captured_data:
+            return []
+        network = self.captured_data.get('network', {})
+        segments = [segment.get('file') for segment in network.get('segments', [])] or [network.get('file')]
+        keylog = self.captured_data.get('sslkeylog', {}).get('file')
+        pcap = segments[0]
+        merged = None
+        if len(segments) > 1:
+            # Segments are named traffic-00001.pcap, traffic-00002.pcap...
+            name, suffix = pcap.split('.', 1)
+            stem = name.rsplit('-', 1)[0]
+            pcap = f'{stem}-*.{suffix}'
+            merged = f'{stem}.pcap'
+        hints = []
+        compressed = [name for name in (pcap, keylog) if name.endswith('.zst')]
+        if compressed:
+            hints.append(f'Decompress the files first: zstd -d {" ".join(compressed)}')
+            pcap = pcap.removesuffix('.zst')
+            keylog = keylog.removesuffix('.zst')
+        if merged:
+            hints.append(f'Merge the capture segments: mergecap -w {merged} {pcap}')
+            pcap = merged
+        hints.append(f'View the decrypted traffic: pirogue-view-tls -r {pcap} -k {keylog}')
+        hints.append(f'Or generate a PCAPNG file: editcap --inject-secrets tls,{keylog} {pcap} decrypted.pcapng')
+        return hints
 
     def stop_capture(self):
+        if not self.started:
+            # Nothing is running, the startup has been aborted
+            return
+        # Stop the network capture first so experiment.json lists all its segments
+        self.tcp_dump.stop_capture()
         self.save_data_files()
         if self.record_screen:
             self.screen_recorder.stop_recording()
         self.device.stop_frida_server()
-        self.tcp_dump.stop_capture()
+        self.device.close()
@@ -0,0 +1,247 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from pirogue_evidence_collector.android.device import list_devices
+from pirogue_evidence_collector.utils import serializer
+
+log = logging.getLogger(__name__)
+
+POOL_MODES = {
+    'gated': 'pirogue_evidence_collector.entrypoints.intercept_gated',
+    'single': 'pirogue_evidence_collector.entrypoints.intercept_single',
+}
+POOL_FILE_NAME = 'pool.json'
+DEFAULT_REPORT_INTERVAL = 10
+STOP_TIMEOUT = 60
+TERMINATE_TIMEOUT = 10
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def _read_proc_stats() -> Dict[int, tuple]:
+    # (parent pid, CPU time in seconds) of every process, from /proc
+    stats = {}
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry.name}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The process name may contain spaces, the fields start after its closing parenthesis
+        fields = stat[stat.rfind(')') + 2:].split()
+        stats[int(entry.name)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS)
+    return stats
+
+
+def _tree_cpu_seconds(pid: int, stats: Dict[int, tuple]) -> float:
+    # CPU time of the process and of its descendants, e.g. tcpdump
+    children = {}
+    for child, (parent, _) in stats.items():
+        children.setdefault(parent, []).append(child)
+    total = 0.0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        if current in stats:
+            total += stats[current][1]
+        pending.extend(children.get(current, []))
+    return total
+
+
+def _directory_size(path: Path) -> int:
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size += _directory_size(Path(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                size += entry.stat().st_size
+        except OSError:
+            pass
+    return size
+
+
+class DeviceCapture:
+    """
+    Capture of a single device of the pool, run by its own interception process.
+    """
+
+    def __init__(self, serial: str, output_dir: Path, command: List[str]):
+        self.serial = serial
+        self.output_dir = output_dir
+        self.command = command
+        self.process = None
+        self.start_time = None
+        self.end_time = None
+        self.cpu_seconds = 0.0
+        self.bytes_written = 0
+        self.cpu_percent = 0.0
+        self.write_rate = 0.0
+        self.max_cpu_percent = 0.0
+        self.max_write_rate = 0.0
+        # Set once the capture has been asked to stop and is saving its data
+        self.stopping = False
+        self._last_sample = None
+
+    def start(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        log.info(f'Starting the capture of {self.serial} in {self.output_dir}')
+        self.process = subprocess.Popen(self.command)
+        self.start_time = time.time()
+        self._last_sample = (time.monotonic(), 0.0, 0)
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def sample(self, stats: Dict[int, tuple]):
+        if self.is_running():
+            # The CPU time of the exited processes is lost, the last sample is kept
+            self.cpu_seconds = max(self.cpu_seconds, _tree_cpu_seconds(self.process.pid, stats))
+        self.bytes_written = _directory_size(self.output_dir)
+        now = time.monotonic()
+        last_time, last_cpu, last_bytes = self._last_sample
+        elapsed = now - last_time
+        if elapsed > 0:
+            self.cpu_percent = (self.cpu_seconds - last_cpu) / elapsed * 100
+            self.write_rate = (self.bytes_written - last_bytes) / elapsed
+            self.max_cpu_percent = max(self.max_cpu_percent, self.cpu_percent)
+            self.max_write_rate = max(self.max_write_rate, self.write_rate)
+        self._last_sample = (now, self.cpu_seconds, self.bytes_written)
+
+    def stop(self):
+        # A second interruption would abort the saving of the data
+        if self.is_running() and not self.stopping:
+            self.process.send_signal(signal.SIGINT)
+        self.stopping = True
+
+    def wait(self, timeout: float):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            log.error(f'The capture of {self.serial} did not stop, terminating it')
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                log.error(f'The capture of {self.serial} did not terminate, killing it')
+                self.process.kill()
+                self.process.wait()
+        if self.end_time is None:
+            self.end_time = time.time()
+
+    def to_dict(self) -> dict:
+        duration = (self.end_time or time.time()) - self.start_time if self.start_time else 0
+        return {
+            'serial': self.serial,
+            'output': self.output_dir.name,
+            'command': self.command,
+            'returncode': self.process.returncode if self.process else None,
+            'start_time': self.start_time * 1000 if self.start_time else None,
+            'duration': duration,
+            'cpu_seconds': self.cpu_seconds,
+            'max_cpu_percent': self.max_cpu_percent,
+            'bytes_written': self.bytes_written,
+            'avg_write_rate': self.bytes_written / duration if duration else 0,
+            'max_write_rate': self.max_write_rate,
+        }
+
+
+class DevicePool:
+    """
+    Captures several devices at the same time, one interception process per device.
+
+    Each device is captured in a subdirectory of the output directory named after its
+    serial number, with its own Frida connection and a capture filter on its own IP
+    addresses. The CPU time and the disk write rate of each capture are reported
+    periodically and saved in pool.json.
+    """
+
+    def __init__(self, output_dir, serials: Optional[Sequence[str]] = None, mode: str = 'gated',
+                 ifaces: Optional[Dict[str, str]] = None, bpf_filters: Optional[Dict[str, str]] = None,
+                 extra_args: Sequence[str] = (), report_interval: float = DEFAULT_REPORT_INTERVAL):
+        if mode not in POOL_MODES:
+            raise ValueError(f'Unknown mode {mode}, expected one of {", ".join(POOL_MODES)}')
+        self.output_dir = Path(output_dir)
+        self.serials = list(serials or [])
+        self.mode = mode
+        self.ifaces = ifaces or {}
+        self.bpf_filters = bpf_filters or {}
+        self.extra_args = list(extra_args)
+        self.report_interval = report_interval
+        self.captures: List[DeviceCapture] = []
+
+    def _build_command(self, serial: str, output_dir: Path) -> List[str]:
+        command = [sys.executable, '-m', POOL_MODES[self.mode], '-o', str(output_dir), '-D', serial]
+        if serial in self.ifaces:
+            command.extend(['-i', self.ifaces[serial]])
+        if serial in self.bpf_filters:
+            command.extend(['--bpf-filter', self.bpf_filters[serial]])
+        return command + self.extra_args
+
+    def start(self):
+        serials = self.serials or list_devices()
+        if not serials:
+            raise Exception('No Android device connected')
+        for serial in serials:
+            output_dir = self.output_dir / serial
+            capture = DeviceCapture(serial, output_dir, self._build_command(serial, output_dir))
+            self.captures.append(capture)
+            capture.start()
+
+    def sample(self):
+        try:
+            stats = _read_proc_stats()
+        except OSError:
+            stats = {}
+        for capture in self.captures:
+            capture.sample(stats)
+
+    def report(self):
+        for capture in self.captures:
+            state = 'running' if capture.is_running() else f'exited ({capture.process.returncode})'
+            log.info(
+                f'{capture.serial}: {state}, CPU {capture.cpu_percent:5.1f} %, '
+                f'write {capture.write_rate / 1024 / 1024:6.2f} MiB/s, '
+                f'{capture.bytes_written / 1024 / 1024:8.1f} MiB written')
+
+    def stop(self):
+        for capture in self.captures:
+            capture.stop()
+        # The captures save their data concurrently, they share the same deadline
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for capture in self.captures:
+            capture.wait(max(0.0, deadline - time.monotonic()))
+
+    def save(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with (self.output_dir / POOL_FILE_NAME).open('w', encoding='utf-8') as out:
+            serializer.dump({'mode': self.mode, 'devices': [capture.to_dict() for capture in self.captures]}, out)
+
+    def run(self):
+        self.start()
+        try:
+            while any(capture.is_running() for capture in self.captures):
+                deadline = time.monotonic() + self.report_interval
+                while time.monotonic() < deadline and any(capture.is_running() for capture in self.captures):
+                    time.sleep(0.5)
+                self.sample()
+                self.report()
+        except KeyboardInterrupt:
+            # The captures are in the process group of the terminal, they received the interruption
+            # as well and are saving their data
+            log.info('Waiting for the captures to be saved')
+            for capture in self.captures:
+                capture.stopping = True
+        finally:
+            self.stop()
+            self.sample()
+            self.save()
@@ -4,7 +4,8 @@ import threading
 import frida
 import logging
 
-from pirogue_evidence_collector.frida.capture_manager import CaptureManager
+from pirogue_evidence_collector.frida.batch import unpack_records
+from pirogue_evidence_collector.frida.capture_manager import CaptureManager, add_capture_arguments
 
 log = logging.getLogger(__name__)
 
@@ -15,7 +16,7 @@ def on_spawned(spawn):
     FridaApplication.event.set()
 
 
-def on_message(capture_manager, spawn, message, script):
+def on_message(capture_manager, spawn, message, binary_data, script):
     data = message.get('payload')
     # Pass options to friTap hooks
     if data == 'experimental':
@@ -34,7 +35,8 @@ def on_message(capture_manager, spawn, message, script):
             data['dump'] = 'sslkeylog.txt'
             data['type'] = 'sslkeylog'
             data['data'] = data.get('keylog')
-        capture_manager.capture_data(data)
+        for record in unpack_records(data, binary_data):
+            capture_manager.capture_data(record)
 
 
 class FridaApplication:
@@ -45,29 +47,28 @@ class FridaApplication:
 
     def __init__(self):
         parser = argparse.ArgumentParser()
-        parser.add_argument(
-            '--capture-command',
-            help=(
-                'Specify directly a capture command instead of building it from interface. '
-                'Useful for remote capture over SSH. Example:\n'
-                'ssh root@openwrt "tcpdump -U -n -w - -i wlan0 \'host PHONE_IP\'"'
-            )
-        )
-        parser.add_argument('-o', '--output', help='The output directory')
-        parser.add_argument('-i', '--iface', help='The network interface to capture', default=None)
-        parser.add_argument('--disable-screenrecord', action='store_false', help='Use to disable screen recording')
+        add_capture_arguments(parser)
+        parser.add_argument('-D', '--device', dest='device_id', default=None,
+                            help='Serial number of the device to instrument, the USB device if not set')
         self.options = parser.parse_args()
         self._device = None
-
-        self.capture_manager = CaptureManager(self.options.output, self.options.iface, self.options.disable_screenrecord)
+        self.capture_manager = CaptureManager.from_options(self.options, serial=self.options.device_id)
 
     def save_data(self):
+        for script in FridaApplication.scripts:
+            try:
+                script.exports.flush_batches()
+            except Exception:
+                pass
         self.capture_manager.stop_capture()
 
     def run(self):
         self.capture_manager.start_capture(capture_cmd=self.options.capture_command)
 
-        self._device = frida.get_usb_device()
+        if self.options.device_id:
+            self._device = frida.get_device(self.options.device_id)
+        else:
+            self._device = frida.get_usb_device()
         self._device.on('spawn-added', on_spawned)
         self._device.enable_spawn_gating()
         FridaApplication.event = threading.Event()
@@ -85,10 +86,15 @@ class FridaApplication:
                 log.info(f'[blue bold]Instrumenting {spawn}[/]', extra={"markup": True})
                 session = self._device.attach(spawn.pid)
                 script = session.create_script(self.capture_manager.get_agent_script())
-                script.on('message', lambda message, data: on_message(self.capture_manager, spawn, message, script))
+                script.on(
+                    'message',
+                    lambda message, data, spawn=spawn, script=script: on_message(
+                        self.capture_manager, spawn, message, data, script)
+                )
                 script.load()
                 api = script.exports
-                api.socket_trace(spawn.pid, spawn.identifier)
+                self.capture_manager.set_applied_socket_sampling(
+                    api.socket_trace(spawn.pid, spawn.identifier, self.capture_manager.socket_sampling))
                 try:
                     api.log_aes_info(spawn.pid, spawn.identifier)
                 except Exception:
@@ -3,7 +3,8 @@ import time
 
 from frida_tools.application import ConsoleApplication
 
-from pirogue_evidence_collector.frida.capture_manager import CaptureManager
+from pirogue_evidence_collector.frida.batch import unpack_records
+from pirogue_evidence_collector.frida.capture_manager import CaptureManager, add_capture_arguments
 
 log = logging.getLogger(__name__)
 
@@ -17,20 +18,10 @@ class FridaApplication(ConsoleApplication):
         super(FridaApplication, self).__init__()
 
     def _add_options(self, parser):
-        parser.add_argument(
-            '--capture-command',
-            help=(
-                'Specify directly a capture command instead of building it from interface. '
-                'Useful for remote capture over SSH. Example: '
-                'ssh root@openwrt "tcpdump -U -n -w - -i wlan0 \'host PHONE_IP\'"'
-            )
-        )
-        parser.add_argument('-o', '--output', help='The output directory')
-        parser.add_argument('-i', '--iface', help='The network interface to capture', default=None)
-        parser.add_argument('--disable-screenrecord', action='store_false', help='Use to disable screen recording')
+        add_capture_arguments(parser)
 
     def _initialize(self, parser, options, args):
-        self.capture_manager = CaptureManager(options.output, iface=options.iface, record_screen=options.disable_screenrecord)
+        self.capture_manager = CaptureManager.from_options(options, serial=options.device_id)
         self.capture_manager.start_capture(capture_cmd=options.capture_command)
 
     def _needs_target(self):
@@ -43,7 +34,8 @@ class FridaApplication(ConsoleApplication):
         self._script = self._session.create_script(self.capture_manager.get_agent_script())
 
         def on_message(message, data):
-            self._reactor.schedule(lambda: self._on_message(message, data))
+            # Records are only queued to the capture writer, no need to go through the reactor
+            self._on_message(message, data)
 
         self._script.on('message', on_message)
         self._session_cache = set()
@@ -51,7 +43,8 @@ class FridaApplication(ConsoleApplication):
         self._script.load()
         self._update_status('Loaded script')
         api = self._script.exports
-        api.socket_trace('unknown', 'unknown')
+        self.capture_manager.set_applied_socket_sampling(
+            api.socket_trace('unknown', 'unknown', self.capture_manager.socket_sampling))
         try:
             api.log_aes_info('unknown', 'unknown')
         except Exception:
@@ -69,9 +62,13 @@ class FridaApplication(ConsoleApplication):
         return ''
 
     def save_data(self):
+        try:
+            self._script.exports.flush_batches()
+        except Exception:
+            pass
         self.capture_manager.stop_capture()
 
-    def _on_message(self, message, data):
+    def _on_message(self, message, binary_data):
         data = message.get('payload')
         # Pass options to friTap hooks
         if data == 'experimental':
@@ -90,4 +87,5 @@ class FridaApplication(ConsoleApplication):
                 data['dump'] = 'sslkeylog.txt'
                 data['type'] = 'sslkeylog'
                 data['data'] = data.get('keylog')
-            self.capture_manager.capture_data(data)
+            for record in unpack_records(data, binary_data):
+                self.capture_manager.capture_data(record)
@@ -0,0 +1,418 @@
+import abc
+import logging
+import os
+import queue
+import textwrap
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.compressed_io import open_hashing_writer
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_FSYNC_INTERVAL = 30.0
+DEFAULT_QUEUE_SIZE = 10000
+QUEUE_POLICIES = ('block', 'drop')
+PUT_RETRY_INTERVAL = 0.5
+
+
+class RecordSink(abc.ABC):
+    """
+    Buffered append-only file receiving the records of a single Frida dump target.
+
+    The file is flushed at most every ``flush_interval`` seconds and synced to disk at most
+    every ``fsync_interval`` seconds (``None`` disables fsync, ``0`` syncs on every flush).
+
+    With ``compress``, the final file is written with zstd and its digests are computed
+    while it is written.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 fsync_interval: Optional[float] = DEFAULT_FSYNC_INTERVAL, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 compress: bool = False):
+        self.path = Path(path)
+        self.output_path = self.path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self.digests = None
+        self.record_count = 0
+        self._writer = None
+        self._file = self._open(buffer_size)
+        self._last_flush = time.monotonic()
+        self._last_fsync = self._last_flush
+
+    def _open(self, buffer_size: int):
+        if not self.compress:
+            return self.path.open(mode='w', buffering=buffer_size, encoding='utf-8')
+        # Only the digests are computed for plain files, they are small and read by tshark
+        fp, self._writer = open_hashing_writer(self.path, compress=False, text=True, buffer_size=buffer_size)
+        return fp
+
+    @abc.abstractmethod
+    def _serialize(self, record: dict) -> str:
+        pass
+
+    def write(self, record: dict):
+        self._file.write(self._serialize(record))
+        self.record_count += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        now = time.monotonic()
+        if now - self._last_flush < self.flush_interval:
+            return
+        do_fsync = self.fsync_interval is not None and now - self._last_fsync >= self.fsync_interval
+        self.flush(fsync=do_fsync)
+
+    def flush(self, fsync: bool = False):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._writer:
+            self._writer.flush()
+        now = time.monotonic()
+        self._last_flush = now
+        if fsync:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush(fsync=self.fsync_interval is not None)
+        self._file.close()
+        if self._writer:
+            self.digests = self._writer.digests()
+
+    def finalize(self):
+        self.close()
+
+
+class PlainRecordSink(RecordSink):
+    """
+    Writes the ``data`` field of each record as a line of text, e.g. for sslkeylog.txt.
+    """
+
+    def _serialize(self, record: dict) -> str:
+        return f'{record.get("data")}\n'
+
+
+class JsonRecordSink(RecordSink):
+    """
+    Streams JSON records to a NDJSON staging file next to the target file.
+
+    When finalized, the staging file is converted into the JSON array expected by the
+    analysis tools, one record at a time so memory stays constant.
+    """
+
+    def __init__(self, path: Path, keep_staging_file: bool = False, **kwargs):
+        self.target_path = Path(path)
+        self.keep_staging_file = keep_staging_file
+        super().__init__(self.target_path.with_suffix('.ndjson'), **kwargs)
+        self.output_path = self.target_path
+
+    def _open(self, buffer_size: int):
+        # The staging file is temporary, it is never compressed
+        return self.path.open(mode='w', buffering=buffer_size, encoding='utf-8')
+
+    def _serialize(self, record: dict) -> str:
+        return serializer.dumps(record, pretty=False) + '\n'
+
+    def finalize(self):
+        self.close()
+        log.info(f'Writing {self.target_path.name} ({self.record_count} records)')
+        self.output_path, self.digests = write_json_array(self.path, self.target_path, compress=self.compress)
+        if not self.keep_staging_file:
+            self.path.unlink(missing_ok=True)
+
+
+class StackRecordSink(JsonRecordSink):
+    """
+    Collects the stack traces interned by the Frida agent.
+
+    Each stack is stored once, whatever the number of processes that reported it, and the
+    final file is a dictionary mapping the stack identifiers to their frames.
+    """
+
+    def __init__(self, path: Path, **kwargs):
+        self._stack_ids = set()
+        super().__init__(path, **kwargs)
+
+    def _serialize(self, record: dict) -> str:
+        stack = record.get('data', {})
+        return serializer.dumps([stack.get('stack_id'), stack.get('frames')], pretty=False) + '\n'
+
+    def write(self, record: dict):
+        stack_id = record.get('data', {}).get('stack_id')
+        if stack_id is None or stack_id in self._stack_ids:
+            return
+        self._stack_ids.add(stack_id)
+        super().write(record)
+
+    def finalize(self):
+        self.close()
+        log.info(f'Writing {self.target_path.name} ({self.record_count} stack traces)')
+        self.output_path, self.digests = write_json_dict(self.path, self.target_path, compress=self.compress)
+        if not self.keep_staging_file:
+            self.path.unlink(missing_ok=True)
+
+
+def _iter_ndjson(ndjson_path: Path):
+    with ndjson_path.open(mode='r', encoding='utf-8') as ndjson:
+        for line in ndjson:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield serializer.loads(line)
+            except ValueError:
+                # Truncated last line after a crash
+                log.warning(f'Skipping a corrupted record in {ndjson_path.name}')
+
+
+def _open_output(output_path: Path, compress: bool) -> tuple:
+    if not compress:
+        return output_path.open(mode='w', encoding='utf-8'), None
+    return open_hashing_writer(output_path, compress=True, buffer_size=DEFAULT_BUFFER_SIZE)
+
+
+def _close_output(output_path: Path, writer) -> tuple:
+    # Returns the path of the file actually written and its digests if computed
+    if writer is None:
+        return output_path, None
+    return writer.path, writer.digests()
+
+
+def write_json_dict(ndjson_path: Path, output_path: Path, compress: bool = False) -> tuple:
+    # Produces the same layout as serializer.dump({key: value, ...}, out)
+    pretty = not serializer.is_compact_output()
+    out, writer = _open_output(output_path, compress)
+    with out:
+        first = True
+        for key, value in _iter_ndjson(ndjson_path):
+            if pretty:
+                out.write('{\n' if first else ',\n')
+                out.write(f'  {serializer.dumps(key)}: ')
+                out.write(textwrap.indent(serializer.dumps(value, pretty=True), '  ')[2:])
+            else:
+                out.write('{' if first else ',')
+                out.write(f'{serializer.dumps(key, pretty=False)}:{serializer.dumps(value, pretty=False)}')
+            first = False
+        if first:
+            out.write('{}')
+        else:
+            out.write('\n}' if pretty else '}')
+    return _close_output(output_path, writer)
+
+
+def write_json_array(ndjson_path: Path, output_path: Path, compress: bool = False) -> tuple:
+    # Produces the same layout as serializer.dump(records, out)
+    pretty = not serializer.is_compact_output()
+    out, writer = _open_output(output_path, compress)
+    with out:
+        first = True
+        for record in _iter_ndjson(ndjson_path):
+            if pretty:
+                out.write('[\n' if first else ',\n')
+                out.write(textwrap.indent(serializer.dumps(record, pretty=True), '  '))
+            else:
+                out.write('[' if first else ',')
+                out.write(serializer.dumps(record, pretty=False))
+            first = False
+        if first:
+            out.write('[]')
+        else:
+            out.write('\n]' if pretty else ']')
+    return _close_output(output_path, writer)
+
+
+class RecordWriter:
+    """
+    Owns one sink per Frida dump target, created on the first record received for it.
+    """
+
+    def __init__(self, output_dir, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 fsync_interval: Optional[float] = DEFAULT_FSYNC_INTERVAL, compress: bool = False):
+        self.output_dir = Path(output_dir)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self.sinks = {}
+        # Name of the file written for each dump target and digests of the files, by name
+        self.outputs = {}
+        self.digests = {}
+
+    def _open_sink(self, filename: str, data_type: Optional[str]) -> RecordSink:
+        path = self.output_dir / filename
+        options = {
+            'flush_interval': self.flush_interval,
+            'fsync_interval': self.fsync_interval,
+            'compress': self.compress,
+        }
+        if data_type == 'stacks':
+            sink = StackRecordSink(path, **options)
+        elif data_type == 'json':
+            sink = JsonRecordSink(path, **options)
+        else:
+            sink = PlainRecordSink(path, **options)
+        self.sinks[filename] = sink
+        return sink
+
+    def write(self, filename: str, record: dict):
+        sink = self.sinks.get(filename)
+        if sink is None:
+            sink = self._open_sink(filename, record.get('data_type'))
+        sink.write(record)
+
+    def flush(self, fsync: bool = False):
+        for sink in self.sinks.values():
+            sink.flush(fsync=fsync)
+
+    def close(self):
+        for filename, sink in self.sinks.items():
+            try:
+                sink.finalize()
+            except Exception as e:
+                log.error(f'Unable to save {filename}: {e}')
+                continue
+            self.outputs[filename] = sink.output_path.name
+            if sink.digests:
+                self.digests[sink.output_path.name] = sink.digests
+
+
+class QueuedRecordWriter:
+    """
+    Decouples the Frida message callbacks from disk I/O.
+
+    Records are pushed to a bounded queue consumed by a dedicated thread which owns all the
+    sinks. When the queue is full, the ``block`` policy waits for room while the ``drop``
+    policy discards the record and counts it. Once the writer thread is gone, the records
+    are dropped right away instead of waiting for room that would never be made.
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer: RecordWriter, max_size: int = DEFAULT_QUEUE_SIZE, policy: str = 'block'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f'Unknown queue policy {policy}, expected one of {", ".join(QUEUE_POLICIES)}')
+        self.writer = writer
+        self.policy = policy
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='frida-record-writer', daemon=True)
+        self._failed = False
+        self._failure_reported = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._enqueue_time = 0.0
+        self.max_enqueue_latency = 0.0
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, filename: str, record: dict):
+        start = time.perf_counter()
+        try:
+            self._enqueue((filename, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.enqueued += 1
+            self._enqueue_time += latency
+            self.max_enqueue_latency = max(self.max_enqueue_latency, latency)
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _enqueue(self, item):
+        if self.policy == 'drop':
+            self._check_alive()
+            self._queue.put(item, block=False)
+            return
+        # Nothing would ever make room in the queue once the writer thread is gone
+        while True:
+            self._check_alive()
+            try:
+                self._queue.put(item, timeout=PUT_RETRY_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def _check_alive(self):
+        if not self._failed:
+            return
+        if not self._failure_reported:
+            self._failure_reported = True
+            log.error('The Frida record writer has stopped, the new records are dropped')
+        raise queue.Full
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.writer.flush_interval)
+                except queue.Empty:
+                    # Nothing received for a while, make sure buffered records reach the disk
+                    self._flush()
+                    continue
+                if item is self._STOP:
+                    break
+                filename, record = item
+                try:
+                    self.writer.write(filename, record)
+                    self.written += 1
+                except Exception as e:
+                    self.errors += 1
+                    log.error(f'Unable to write a record to {filename}: {e}')
+        except Exception as e:
+            log.error(f'The Frida record writer has stopped: {e}')
+        finally:
+            self._failed = True
+
+    def _flush(self):
+        try:
+            self.writer.flush()
+        except Exception as e:
+            self.errors += 1
+            log.error(f'Unable to flush the Frida records: {e}')
+
+    def close(self):
+        while self._thread.is_alive():
+            try:
+                self._queue.put(self._STOP, timeout=PUT_RETRY_INTERVAL)
+                break
+            except queue.Full:
+                pass
+        if self._thread.ident is not None:
+            self._thread.join()
+        self.writer.close()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            enqueued = self.enqueued
+            return {
+                'policy': self.policy,
+                'queue_size': self._queue.maxsize,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'enqueued': enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'avg_enqueue_latency_ms': (self._enqueue_time / enqueued * 1000) if enqueued else 0.0,
+                'max_enqueue_latency_ms': self.max_enqueue_latency * 1000,
+            }
@@ -1,42 +1,238 @@
+import fcntl
+import hashlib
 import logging
 import lzma
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional
 
 import requests
 
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.hashing import hash_file
+
 
 FRIDA_SERVER_LATEST_RELEASE_URL = 'https://api.github.com/repos/frida/frida/releases/latest'
 FRIDA_SERVER_RELEASE_BY_TAG_URL = 'https://api.github.com/repos/frida/frida/releases/tags/{TAG}'
+FRIDA_SERVER_CACHE_DIR = Path(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))) / 'pirogue-evidence-collector' / 'frida-server'
+# Directory containing frida-server release assets, e.g. frida-server-16.1.4-android-arm64.xz
+FRIDA_SERVER_MIRROR_ENV = 'PIROGUE_FRIDA_SERVER_MIRROR'
+MANIFEST_FILE_NAME = 'manifest.json'
+MANIFEST_LOCK_FILE_NAME = 'manifest.lock'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 log = logging.getLogger(__name__)
 
 
+def _version_key(version: str) -> tuple:
+    return tuple(int(part) if part.isdigit() else 0 for part in version.split('.'))
+
+
+class FridaServerCache:
+    """
+    Local cache of the frida-server binaries, by version, platform and architecture.
+
+    The binaries are decompressed while they are downloaded from the GitHub releases, or
+    read from a mirror directory of release assets, and their SHA-256 digests are kept in a
+    manifest. A cached binary is only used if it still matches its digest, it is hashed
+    again only when its size or modification time changed.
+
+    The cache can be shared by concurrent captures: binaries are written to temporary files
+    before being moved in place, and the manifest is updated under an exclusive lock.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, mirror_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir or FRIDA_SERVER_CACHE_DIR)
+        mirror_dir = mirror_dir or os.environ.get(FRIDA_SERVER_MIRROR_ENV)
+        self.mirror_dir = Path(mirror_dir) if mirror_dir else None
+        self.manifest_path = self.cache_dir / MANIFEST_FILE_NAME
+
+    @staticmethod
+    def artifact_name(version: str, platform: str, arch: str) -> str:
+        return f'frida-server-{version}-{platform}-{arch}'
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with self.manifest_path.open('r') as f:
+                return serializer.load(f)
+        except Exception as e:
+            log.warning(f'Unable to load the frida-server cache manifest: {e}')
+            return {}
+
+    def _save_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path.with_name(MANIFEST_FILE_NAME + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            serializer.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @contextmanager
+    def _update_manifest(self):
+        # Other processes may update the manifest at the same time, the lock serializes the updates
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with (self.cache_dir / MANIFEST_LOCK_FILE_NAME).open('a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                manifest = self._load_manifest()
+                yield manifest
+                self._save_manifest(manifest)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _cached(self, name: str) -> Optional[dict]:
+        entry = self._load_manifest().get(name)
+        if not entry:
+            return None
+        path = self.cache_dir / entry['file']
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            log.warning(f'The cached {name} is missing, fetching it again')
+            return None
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry.get('mtime_ns'):
+            return entry
+        if hash_file(path, ('sha256',))['sha256'] != entry['sha256']:
+            log.warning(f'The cached {name} is corrupted, fetching it again')
+            return None
+        # Touched but not modified, it is not hashed again next time
+        with self._update_manifest() as manifest:
+            if manifest.get(name, {}).get('sha256') == entry['sha256']:
+                manifest[name]['mtime_ns'] = stat.st_mtime_ns
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return entry
+
+    def latest_cached_version(self, platform: str, arch: str) -> Optional[str]:
+        versions = [
+            entry['version'] for entry in self._load_manifest().values()
+            if entry['platform'] == platform and entry['arch'] == arch
+        ]
+        return max(versions, key=_version_key) if versions else None
+
+    def _store(self, chunks, name: str, version: str, platform: str, arch: str, source: str) -> dict:
+        # The archive is decompressed and hashed while it is read, it is never fully in memory
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / name
+        decompressor = lzma.LZMADecompressor()
+        sha256 = hashlib.sha256()
+        size = 0
+        # Another process may be storing the same binary
+        out = NamedTemporaryFile(dir=self.cache_dir, prefix=f'{name}.', suffix='.tmp', delete=False)
+        tmp_path = Path(out.name)
+        try:
+            with out:
+                for chunk in chunks:
+                    data = decompressor.decompress(chunk)
+                    sha256.update(data)
+                    size += len(data)
+                    out.write(data)
+            if not decompressor.eof:
+                raise Exception(f'The archive of {name} is truncated')
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        # Temporary files are only readable by their owner
+        tmp_path.chmod(0o644)
+        os.replace(tmp_path, path)
+        entry = {
+            'version': version,
+            'platform': platform,
+            'arch': arch,
+            'file': name,
+            'sha256': sha256.hexdigest(),
+            'size': size,
+            'mtime_ns': path.stat().st_mtime_ns,
+            'source': source,
+        }
+        with self._update_manifest() as manifest:
+            manifest[name] = entry
+        return entry
+
+    def _fetch_from_mirror(self, name: str, version: str, platform: str, arch: str) -> Optional[dict]:
+        if not self.mirror_dir:
+            return None
+        archive = self.mirror_dir / f'{name}.xz'
+        if not archive.exists():
+            return None
+        log.info(f'Extracting {archive}...')
+        with archive.open('rb') as f:
+            return self._store(
+                iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''), name, version, platform, arch, str(archive))
+
+    @staticmethod
+    def _get_release(version: Optional[str]) -> dict:
+        if version:
+            resp = requests.get(FRIDA_SERVER_RELEASE_BY_TAG_URL.format(TAG=version))
+        else:
+            resp = requests.get(FRIDA_SERVER_LATEST_RELEASE_URL)
+        resp.raise_for_status()
+        release = resp.json()
+        if version:
+            assert release.get('tag_name') == version
+        return release
+
+    def _fetch_from_github(self, release: dict, name: str, platform: str, arch: str) -> dict:
+        for asset in release['assets']:
+            if asset['name'] == f'{name}.xz':
+                log.info(f'Downloading {asset["browser_download_url"]}...')
+                with requests.get(asset['browser_download_url'], stream=True) as xz_file:
+                    xz_file.raise_for_status()
+                    return self._store(
+                        xz_file.iter_content(DOWNLOAD_CHUNK_SIZE), name, release['tag_name'], platform, arch,
+                        asset['browser_download_url'])
+        raise FileNotFoundError((arch, platform, release.get('tag_name')))
+
+    def get(self, version: Optional[str], platform: str, arch: str) -> dict:
+        """
+        Return the manifest entry of the requested frida-server, the latest one if no version is given.
+        """
+        release = None
+        if not version:
+            try:
+                release = self._get_release(None)
+                version = release['tag_name']
+            except Exception as e:
+                # Offline, the latest cached version is the best guess
+                version = self.latest_cached_version(platform, arch)
+                if not version:
+                    raise e
+                log.warning(f'Unable to get the latest frida-server release, using the cached version {version}')
+        name = self.artifact_name(version, platform, arch)
+        entry = self._cached(name) or self._fetch_from_mirror(name, version, platform, arch)
+        if entry is None:
+            entry = self._fetch_from_github(release or self._get_release(version), name, platform, arch)
+        return entry
+
+    def path(self, entry: dict) -> Path:
+        return self.cache_dir / entry['file']
+
+
 class FridaServer:
     @staticmethod
-    def download_frida_server(arch: str, output_file: str, platform: str, client_version: str):
+    def get_frida_server(arch: str, platform: str, client_version: Optional[str],
+                         cache: Optional[FridaServerCache] = None) -> Optional[dict]:
         if not arch:
-            log.error(f'Unable to determine device ABI, please install Frida server manually at {output_file}')
-            return
-        resp = requests.get(FRIDA_SERVER_RELEASE_BY_TAG_URL.format(TAG=client_version))
+            log.error('Unable to determine device ABI, please install Frida server manually')
+            return None
+        cache = cache or FridaServerCache()
         try:
-            resp.raise_for_status()
-            release = resp.json()
-            assert release.get('tag_name') == client_version
-            for asset in release['assets']:
-                asset_name = asset['name']
-                if 'server' in asset_name and f'{platform}-{arch}.xz' in asset_name:
-                    log.info(f'Downloading {asset["browser_download_url"]}...')
-                    xz_file = requests.get(asset['browser_download_url'])
-                    xz_file.raise_for_status()
-                    log.info(f'Extracting {asset_name}...')
-                    server_binary = lzma.decompress(xz_file.content)
-                    log.info(f'Writing {asset_name} to {output_file}...')
-                    with open(output_file, mode='wb') as out:
-                        out.write(server_binary)
-                        out.flush()
-                    return
-            raise FileNotFoundError((arch, platform, client_version))
+            return cache.get(client_version, platform, arch)
         except Exception as e:
             log.error(
                 f'Unable to find frida-server version {client_version} in GitHub releases. '
                 'Please install it by hand at /data/local/tmp/frydaxx-server and make it executable using chmod +x.'
             )
             raise Exception(f'Unable to find frida-server version {client_version} in GitHub releases.') from e
+
+    @staticmethod
+    def download_frida_server(arch: str, output_file: str, platform: str, client_version: str):
+        if not arch:
+            log.error(f'Unable to determine device ABI, please install Frida server manually at {output_file}')
+            return
+        cache = FridaServerCache()
+        entry = FridaServer.get_frida_server(arch, platform, client_version, cache)
+        log.info(f'Writing {entry["file"]} to {output_file}...')
+        shutil.copyfile(cache.path(entry), output_file)
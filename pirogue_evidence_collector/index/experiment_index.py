@@ -0,0 +1,419 @@
+import hashlib
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Optional
+
+from pirogue_evidence_collector.network.community_id import compute_community_id
+from pirogue_evidence_collector.network.traffic_join import compact_stack
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.compressed_io import find_evidence, open_evidence
+from pirogue_evidence_collector.utils.json_stream import iter_json_records
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = 'experiment.sqlite'
+# Bumped when the schema changes, the tables of an older index are rebuilt
+SCHEMA_VERSION = 4
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_state (
+    file TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS socket_traces (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER,
+    pid INTEGER,
+    process TEXT,
+    community_id TEXT,
+    socket_type TEXT,
+    event_type TEXT,
+    local_ip TEXT,
+    local_port INTEGER,
+    dest_ip TEXT,
+    dest_port INTEGER,
+    thread_id INTEGER,
+    stack_id TEXT,
+    stack TEXT
+);
+CREATE INDEX IF NOT EXISTS socket_traces_community_id ON socket_traces (community_id);
+CREATE INDEX IF NOT EXISTS socket_traces_pid ON socket_traces (pid);
+CREATE INDEX IF NOT EXISTS socket_traces_process ON socket_traces (process);
+CREATE INDEX IF NOT EXISTS socket_traces_timestamp ON socket_traces (timestamp);
+CREATE INDEX IF NOT EXISTS socket_traces_dest_ip ON socket_traces (dest_ip);
+CREATE TABLE IF NOT EXISTS crypto_traces (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER,
+    pid INTEGER,
+    process TEXT,
+    alg TEXT,
+    key TEXT,
+    iv TEXT,
+    input TEXT,
+    output TEXT
+);
+CREATE INDEX IF NOT EXISTS crypto_traces_pid ON crypto_traces (pid);
+CREATE INDEX IF NOT EXISTS crypto_traces_process ON crypto_traces (process);
+CREATE INDEX IF NOT EXISTS crypto_traces_timestamp ON crypto_traces (timestamp);
+CREATE TABLE IF NOT EXISTS dynamic_hooks (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER,
+    pid INTEGER,
+    process TEXT,
+    taxonomy_id TEXT,
+    description TEXT,
+    class TEXT,
+    method TEXT,
+    arguments TEXT,
+    returned_value TEXT,
+    stacktrace_id TEXT,
+    stacktrace TEXT
+);
+CREATE INDEX IF NOT EXISTS dynamic_hooks_taxonomy_id ON dynamic_hooks (taxonomy_id);
+CREATE INDEX IF NOT EXISTS dynamic_hooks_pid ON dynamic_hooks (pid);
+CREATE INDEX IF NOT EXISTS dynamic_hooks_process ON dynamic_hooks (process);
+CREATE INDEX IF NOT EXISTS dynamic_hooks_timestamp ON dynamic_hooks (timestamp);
+CREATE TABLE IF NOT EXISTS stacks (
+    stack_id TEXT PRIMARY KEY,
+    frames TEXT
+);
+CREATE VIEW IF NOT EXISTS dynamic_hook_stacktraces AS
+    SELECT h.id, h.timestamp, h.pid, h.process, h.taxonomy_id, h.description, h.class, h.method,
+           h.arguments, h.returned_value, h.stacktrace_id, COALESCE(h.stacktrace, s.frames) AS stacktrace
+    FROM dynamic_hooks h LEFT JOIN stacks s ON s.stack_id = h.stacktrace_id;
+CREATE TABLE IF NOT EXISTS sslkeylog (
+    id INTEGER PRIMARY KEY,
+    label TEXT,
+    client_random TEXT,
+    secret TEXT
+);
+CREATE INDEX IF NOT EXISTS sslkeylog_client_random ON sslkeylog (client_random);
+CREATE TABLE IF NOT EXISTS experiment (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _json_or_none(value):
+    if value is None:
+        return None
+    return serializer.dumps(value, pretty=False)
+
+
+def _prefix_fingerprint(path: Path, offset: int) -> str:
+    # SHA-256 of the first and of the last block of the first offset bytes of the file. A
+    # rewritten file differs there, e.g. by its first timestamps, without reading all the
+    # data already ingested.
+    sha256 = hashlib.sha256(str(offset).encode())
+    with path.open('rb') as f:
+        sha256.update(f.read(min(FINGERPRINT_BLOCK_SIZE, offset)))
+        tail_start = max(FINGERPRINT_BLOCK_SIZE, offset - FINGERPRINT_BLOCK_SIZE)
+        if tail_start < offset:
+            f.seek(tail_start)
+            sha256.update(f.read(offset - tail_start))
+    return sha256.hexdigest()
+
+
+class ExperimentIndex:
+    """
+    SQLite database indexing the files saved by CaptureManager in an experiment folder.
+
+    Ingestion is incremental: the offset of the data ingested from each file is saved along
+    with a fingerprint of the data before it. The append-only files of a running capture,
+    i.e. the NDJSON staging files and the TLS key log, are read from that offset when their
+    fingerprint still matches, only the new records are parsed. The other files are written
+    at once, they are skipped when unchanged. Otherwise, the file has been rewritten or
+    replaced, e.g. by the final JSON file at the end of the capture, and it is indexed again
+    from the beginning.
+    """
+    BATCH_SIZE = 5000
+
+    def __init__(self, experiment_dir: Path, db_path: Optional[Path] = None):
+        self.experiment_dir = Path(experiment_dir)
+        self.db_path = Path(db_path) if db_path else self.experiment_dir / INDEX_FILE_NAME
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self._check_schema()
+
+    def _check_schema(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            objects = self.connection.execute(
+                "SELECT type, name FROM sqlite_master WHERE type IN ('view', 'table') AND name NOT LIKE 'sqlite_%' "
+                "ORDER BY type DESC").fetchall()
+            if objects:
+                log.info(f'The index {self.db_path.name} has been created by another version, rebuilding it')
+            for object_type, name in objects:
+                self.connection.execute(f'DROP {object_type.upper()} {name}')
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _resolve_file(self, file_name: str) -> Optional[Path]:
+        # The NDJSON staging file is used while the capture is still running
+        path = self.experiment_dir / file_name
+        if final_path := find_evidence(path):
+            return final_path
+        staging_path = path.with_suffix('.ndjson')
+        if staging_path.exists():
+            return staging_path
+        return None
+
+    def _ingest_state(self, file_name: str, path: Path, appendable: bool, tables: tuple) -> tuple:
+        # Returns the offset and the number of the records already ingested, both 0 when the
+        # file has to be indexed from the beginning
+        row = self.connection.execute(
+            'SELECT source, records, offset, fingerprint FROM ingest_state WHERE file = ?', (file_name,)
+        ).fetchone()
+        if row is None:
+            return 0, 0
+        size = path.stat().st_size
+        if row['source'] == path.name and (size >= row['offset'] if appendable else size == row['offset']):
+            if _prefix_fingerprint(path, row['offset']) == row['fingerprint']:
+                return row['offset'], row['records']
+        # Rewritten, replaced or finalized: the records may differ or be in another order
+        log.info(f'{path.name} changed since the last ingestion, re-indexing it')
+        for table in tables:
+            self.connection.execute(f'DELETE FROM {table}')
+        return 0, 0
+
+    def _save_ingest_state(self, file_name: str, path: Path, offset: int, records: int):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO ingest_state (file, source, records, offset, fingerprint) VALUES (?, ?, ?, ?, ?)',
+            (file_name, path.name, records, offset, _prefix_fingerprint(path, offset))
+        )
+        self.connection.commit()
+
+    def _insert_records(self, records: Iterator, insert, table: str) -> int:
+        count = 0
+        batch = []
+        for record in records:
+            count += 1
+            row = insert(record)
+            if row is not None:
+                batch.append(row)
+            if len(batch) >= self.BATCH_SIZE:
+                self._flush(batch, table)
+                batch = []
+        self._flush(batch, table)
+        return count
+
+    def _ingest_lines(self, file_name: str, path: Path, parse, insert, tables: tuple) -> int:
+        # Append-only file, only the complete lines written after the ingested offset are read.
+        # The last line may still be being written, it is ingested once complete.
+        offset, ingested = self._ingest_state(file_name, path, True, tables)
+
+        def new_records():
+            nonlocal offset
+            with path.open('rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        return
+                    offset += len(line)
+                    if line.strip():
+                        yield parse(line)
+
+        new_count = self._insert_records(new_records(), insert, tables[0])
+        self._save_ingest_state(file_name, path, offset, ingested + new_count)
+        log.info(f'{path.name}: {new_count} new records indexed')
+        return new_count
+
+    def _ingest_file(self, file_name: str, path: Path, read_records, insert, tables: tuple) -> int:
+        # File written at once, e.g. a final JSON file, indexed again when it changes
+        size = path.stat().st_size
+        if self._ingest_state(file_name, path, False, tables)[0]:
+            return 0
+        with open_evidence(path) as f:
+            count = self._insert_records(read_records(f), insert, tables[0])
+        self._save_ingest_state(file_name, path, size, count)
+        log.info(f'{path.name}: {count} new records indexed')
+        return count
+
+    def _flush(self, rows: list, table: str):
+        if not rows:
+            return
+        placeholders = ', '.join('?' * len(rows[0]))
+        columns = ', '.join(rows[0].keys())
+        self.connection.executemany(
+            f'INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})',
+            [tuple(row.values()) for row in rows]
+        )
+
+    @staticmethod
+    def _socket_trace_row(trace: dict) -> Optional[dict]:
+        data = trace.get('data') or {}
+        try:
+            flow_data = compute_community_id(trace)
+        except (KeyError, TypeError):
+            return None
+        stack = data.get('stack')
+        return {
+            'timestamp': trace.get('timestamp'),
+            'pid': trace.get('pid'),
+            'process': trace.get('process'),
+            'community_id': flow_data.get('community_id'),
+            'socket_type': data.get('socket_type'),
+            'event_type': data.get('socket_event_type'),
+            'local_ip': flow_data.get('src_ip'),
+            'local_port': flow_data.get('src_port'),
+            'dest_ip': flow_data.get('dst_ip'),
+            'dest_port': flow_data.get('dst_port'),
+            'thread_id': data.get('thread_id'),
+            'stack_id': data.get('stack_id'),
+            'stack': _json_or_none(compact_stack(stack)) if stack else None,
+        }
+
+    @staticmethod
+    def _crypto_trace_row(trace: dict) -> dict:
+        data = trace.get('data') or {}
+        return {
+            'timestamp': trace.get('timestamp'),
+            'pid': trace.get('pid'),
+            'process': trace.get('process'),
+            'alg': data.get('alg'),
+            'key': data.get('key'),
+            'iv': data.get('iv'),
+            'input': data.get('in'),
+            'output': data.get('out'),
+        }
+
+    @staticmethod
+    def _dynamic_hook_row(hook: dict) -> dict:
+        data = hook.get('data') or {}
+        return {
+            'timestamp': data.get('timestamp', hook.get('timestamp')),
+            'pid': hook.get('pid'),
+            'process': hook.get('process'),
+            'taxonomy_id': data.get('taxonomy_id'),
+            'description': data.get('description'),
+            'class': data.get('class'),
+            'method': data.get('method'),
+            'arguments': _json_or_none(data.get('arguments')),
+            'returned_value': _json_or_none(data.get('returned_value')),
+            # Older captures embed the stack, it is resolved from the stacks table otherwise
+            'stacktrace_id': data.get('stacktrace_id'),
+            'stacktrace': _json_or_none(data.get('stacktrace')),
+        }
+
+    @staticmethod
+    def _sslkeylog_row(line: str) -> Optional[dict]:
+        parts = line.split()
+        if len(parts) != 3 or line.startswith('#'):
+            return None
+        return {'label': parts[0], 'client_random': parts[1], 'secret': parts[2]}
+
+    @staticmethod
+    def _is_appendable(path: Path) -> bool:
+        return path.suffix == '.ndjson' or path.suffix == '.txt'
+
+    def _ingest_json(self, file_name: str, row_builder, table: str) -> int:
+        path = self._resolve_file(file_name)
+        if path is None:
+            return 0
+        if self._is_appendable(path):
+            return self._ingest_lines(file_name, path, serializer.loads, row_builder, (table,))
+        return self._ingest_file(file_name, path, iter_json_records, row_builder, (table,))
+
+    def _ingest_stacks(self) -> int:
+        path = self._resolve_file('stacks.json')
+        if path is None:
+            return 0
+
+        def stack_row(stack):
+            return {'stack_id': stack[0], 'frames': _json_or_none(stack[1])}
+
+        if self._is_appendable(path):
+            # Each line is a [stack_id, frames] pair
+            return self._ingest_lines('stacks.json', path, serializer.loads, stack_row, ('stacks',))
+        return self._ingest_file(
+            'stacks.json', path, lambda f: iter(serializer.load(f).items()), stack_row, ('stacks',))
+
+    def _ingest_sslkeylog(self) -> int:
+        path = self._resolve_file('sslkeylog.txt')
+        if path is None:
+            return 0
+        if self._is_appendable(path):
+            return self._ingest_lines(
+                'sslkeylog.txt', path, lambda line: line.decode('utf-8').strip(), self._sslkeylog_row, ('sslkeylog',))
+        return self._ingest_file(
+            'sslkeylog.txt', path, lambda f: (line.strip() for line in f if line.strip()), self._sslkeylog_row,
+            ('sslkeylog',))
+
+    def _ingest_experiment(self):
+        path = self.experiment_dir / 'experiment.json'
+        if not path.exists():
+            return
+        with path.open('r') as f:
+            experiment = serializer.load(f)
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO experiment (key, value) VALUES (?, ?)',
+            [(key, _json_or_none(value)) for key, value in experiment.items()]
+        )
+        self.connection.commit()
+
+    def update(self) -> dict:
+        self._ingest_experiment()
+        return {
+            'stacks': self._ingest_stacks(),
+            'socket_traces': self._ingest_json('socket_trace.json', self._socket_trace_row, 'socket_traces'),
+            'crypto_traces': self._ingest_json('aes_info.json', self._crypto_trace_row, 'crypto_traces'),
+            'dynamic_hooks': self._ingest_json('dynamic_hook.json', self._dynamic_hook_row, 'dynamic_hooks'),
+            'sslkeylog': self._ingest_sslkeylog(),
+        }
+
+    def query(self, sql: str, parameters: tuple = ()) -> list:
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def stack_index(self) -> 'IndexedStackLookup':
+        return IndexedStackLookup(self)
+
+
+class IndexedStackLookup:
+    """
+    Same interface as traffic_join.StackIndex, backed by the experiment index.
+    """
+
+    def __init__(self, index: ExperimentIndex):
+        self.index = index
+        self._cache = {}
+
+    def __contains__(self, community_id):
+        return self.get(community_id) is not None
+
+    def get(self, community_id) -> Optional[dict]:
+        if community_id in self._cache:
+            return self._cache[community_id]
+        row = self.index.connection.execute(
+            'SELECT t.pid, t.process, t.timestamp, t.stack, s.frames FROM socket_traces t '
+            'LEFT JOIN stacks s ON s.stack_id = t.stack_id '
+            'WHERE t.community_id = ? ORDER BY t.timestamp LIMIT 1',
+            (community_id,)
+        ).fetchone()
+        entry = None
+        if row is not None:
+            if row['stack']:
+                stack = serializer.loads(row['stack'])
+            elif row['frames']:
+                stack = compact_stack(serializer.loads(row['frames']))
+            else:
+                stack = []
+            entry = {'pid': row['pid'], 'process': row['process'], 'timestamp': row['timestamp'], 'stack': stack}
+        self._cache[community_id] = entry
+        return entry
@@ -0,0 +1,71 @@
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+import communityid
+
+FLOW_CACHE_SIZE = 65536
+_TCP = 6
+_UDP = 17
+
+# A single instance is shared by all the computations
+_community_id = communityid.CommunityID()
+
+
+@lru_cache(maxsize=FLOW_CACHE_SIZE)
+def _clean_ip_address(ip):
+    if ip.startswith('::ffff:') and ip.count('.') == 3:
+        return ip.replace('::ffff:', '')
+    return ip
+
+
+def _protocol_number(proto) -> int:
+    if isinstance(proto, int):
+        return proto
+    return _TCP if 'tcp' in proto else _UDP
+
+
+@lru_cache(maxsize=FLOW_CACHE_SIZE)
+def flow_community_id(proto, src_ip, src_port, dst_ip, dst_port) -> str:
+    """
+    Compute the community ID of a flow, `proto` is either a protocol number or a socket type
+    such as tcp6. Results are memoized with a bounded LRU cache.
+    """
+    src_ip = _clean_ip_address(src_ip)
+    dst_ip = _clean_ip_address(dst_ip)
+    if _protocol_number(proto) == _TCP:
+        tpl = communityid.FlowTuple.make_tcp(src_ip, dst_ip, src_port, dst_port)
+    else:
+        tpl = communityid.FlowTuple.make_udp(src_ip, dst_ip, src_port, dst_port)
+    return _community_id.calc(tpl)
+
+
+def compute_community_ids(flows: Iterable[Tuple]) -> List[str]:
+    """
+    Compute the community IDs of an array of (proto, src_ip, src_port, dst_ip, dst_port)
+    tuples, each distinct tuple being computed only once.
+    """
+    flows = list(flows)
+    distinct = {flow: None for flow in flows}
+    for flow in distinct:
+        distinct[flow] = flow_community_id(*flow)
+    return [distinct[flow] for flow in flows]
+
+
+def compute_community_id(trace):
+    data = trace['data']
+    src_ip = _clean_ip_address(data['local_ip'])
+    src_port = data['local_port']
+    dst_ip = _clean_ip_address(data['dest_ip'])
+    dst_port = data['dest_port']
+
+    return {
+        'src_ip': src_ip,
+        'src_port': src_port,
+        'dst_ip': dst_ip,
+        'dst_port': dst_port,
+        'community_id': flow_community_id(data['socket_type'], src_ip, src_port, dst_ip, dst_port)
+    }
+
+
+def community_id_cache_info():
+    return flow_community_id.cache_info()
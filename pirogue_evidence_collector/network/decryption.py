@@ -0,0 +1,109 @@
+import io
+import logging
+import shutil
+import subprocess
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Iterator, List, Optional
+
+from pirogue_evidence_collector.network.traffic_join import iter_ek_packets
+from pirogue_evidence_collector.utils.compressed_io import is_compressed, open_evidence
+
+log = logging.getLogger(__name__)
+
+HTTP_DISPLAY_FILTER = 'http or http2 or http3'
+
+
+def _decompress(path: Path, suffix: str):
+    # Removed once closed
+    temporary_file = NamedTemporaryFile(mode='wb', suffix=suffix)
+    with open_evidence(path, 'rb') as compressed:
+        shutil.copyfileobj(compressed, temporary_file, 1024 * 1024)
+    temporary_file.flush()
+    return temporary_file
+
+
+class TsharkDecoder:
+    """
+    Decrypt a capture with its TLS key log and stream the dissected packets.
+
+    A single tshark process reads the pcap file, applies the key log directly and writes EK
+    records to a pipe which are parsed as they come. This avoids writing an intermediate
+    pcapng file with editcap and the full JSON export of the traffic.
+
+    Captures and key logs compressed with zstd are decompressed to temporary files first,
+    tshark cannot run its two-pass analysis (-2) on a capture read from a pipe.
+    """
+
+    def __init__(self, pcap_path: Path, keylog_path: Optional[Path] = None, display_filter: str = HTTP_DISPLAY_FILTER,
+                 tshark_path: str = 'tshark'):
+        self.pcap_path = Path(pcap_path)
+        self.keylog_path = Path(keylog_path) if keylog_path else None
+        self.display_filter = display_filter
+        self.tshark_path = tshark_path
+        self.process = None
+        self._capture_file = None
+        self._keylog_file = None
+
+    def command(self) -> List[str]:
+        cmd = [
+            self.tshark_path,
+            '-2',
+            '-T', 'ek',
+            '--enable-protocol', 'communityid',
+            '-Ndmn',
+            '-r', self._capture_file.name if self._capture_file else str(self.pcap_path),
+        ]
+        if self.keylog_path:
+            keylog_path = self._keylog_file.name if self._keylog_file else self.keylog_path
+            cmd.extend(['-o', f'tls.keylog_file:{keylog_path}'])
+        if self.display_filter:
+            cmd.extend(['-Y', self.display_filter])
+        return cmd
+
+    def iter_packets(self) -> Iterator[dict]:
+        yield from iter_ek_packets(self.iter_lines())
+
+    def check_inputs(self):
+        if shutil.which(self.tshark_path) is None:
+            raise FileNotFoundError(f'{self.tshark_path} is not installed, please install tshark')
+        if not self.pcap_path.exists():
+            raise FileNotFoundError(f'The capture file {self.pcap_path} does not exist')
+        if self.keylog_path and not self.keylog_path.exists():
+            log.warning(f'The TLS key log {self.keylog_path} does not exist, the traffic will not be decrypted')
+
+    def iter_lines(self) -> Iterator[str]:
+        self.check_inputs()
+        self.decompress_inputs()
+        cmd = self.command()
+        log.info(f'Running {" ".join(cmd)}')
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        try:
+            yield from io.TextIOWrapper(self.process.stdout, encoding='utf-8')
+            self.process.wait()
+        finally:
+            # Stop tshark if the consumer did not read all the packets
+            self.close()
+        if self.process.returncode != 0:
+            raise subprocess.CalledProcessError(self.process.returncode, cmd)
+
+    def decompress_inputs(self):
+        if is_compressed(self.pcap_path) and not self._capture_file:
+            log.info(f'Decompressing {self.pcap_path.name}')
+            self._capture_file = _decompress(self.pcap_path, '.pcap')
+        if self.keylog_path and self.keylog_path.exists() and is_compressed(self.keylog_path) and not self._keylog_file:
+            self._keylog_file = _decompress(self.keylog_path, '.txt')
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        for temporary_file in (self._capture_file, self._keylog_file):
+            if temporary_file:
+                temporary_file.close()
+        self._capture_file = None
+        self._keylog_file = None
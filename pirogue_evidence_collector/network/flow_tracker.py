@@ -0,0 +1,565 @@
+import itertools
+import logging
+import os
+import queue
+import socket
+import struct
+import textwrap
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Iterable, Optional
+
+from pirogue_evidence_collector.network.community_id import compute_community_id, flow_community_id
+from pirogue_evidence_collector.utils import serializer
+
+log = logging.getLogger(__name__)
+
+FLOWS_FILE_NAME = 'flows.json'
+FLUSH_INTERVAL = 10.0
+# Flows without any packet for this long are written out and removed from the table
+IDLE_TIMEOUT = 120.0
+MAX_DNS_ANSWERS = 65536
+# Packets handed over by the capture thread and not accounted yet, the next ones are dropped
+MAX_PENDING_PACKETS = 100000
+PACKET_BATCH_SIZE = 1024
+
+# Link layer types of the pcap format
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+TCP = 6
+UDP = 17
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# IPv6 extension headers preceding the transport header
+IPV6_HOP_BY_HOP = 0
+IPV6_ROUTING = 43
+IPV6_FRAGMENT = 44
+IPV6_AUTHENTICATION = 51
+IPV6_DESTINATION = 60
+IPV6_EXTENSION_HEADERS = (IPV6_HOP_BY_HOP, IPV6_ROUTING, IPV6_FRAGMENT, IPV6_AUTHENTICATION, IPV6_DESTINATION)
+
+_u16 = struct.Struct('!H')
+_ports = struct.Struct('!HH')
+_ipv4_header = struct.Struct('!BxHxxHBB2x4s4s')
+_ipv6_header = struct.Struct('!4xHBx16s16s')
+_dns_header = struct.Struct('!HHHHHH')
+_dns_answer = struct.Struct('!HHIH')
+
+
+def _network_layer(link_type: int, data: bytes) -> tuple:
+    """
+    Return the ether type and the offset of the network layer of a packet.
+    """
+    if link_type == LINKTYPE_ETHERNET:
+        offset = 14
+        ether_type = _u16.unpack_from(data, 12)[0]
+        while ether_type in ETHERTYPE_VLAN:
+            ether_type = _u16.unpack_from(data, offset + 2)[0]
+            offset += 4
+        return ether_type, offset
+    if link_type == LINKTYPE_LINUX_SLL:
+        return _u16.unpack_from(data, 14)[0], 16
+    if link_type == LINKTYPE_LINUX_SLL2:
+        return _u16.unpack_from(data, 0)[0], 20
+    if link_type == LINKTYPE_NULL:
+        family = data[0] or data[3]
+        return (ETHERTYPE_IPV4 if family == socket.AF_INET else ETHERTYPE_IPV6), 4
+    if link_type in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return (ETHERTYPE_IPV4 if data[0] >> 4 == 4 else ETHERTYPE_IPV6), 0
+    return None, 0
+
+
+def parse_packet(link_type: int, data: bytes) -> Optional[tuple]:
+    """
+    Parse the headers of a TCP or UDP packet and return
+    (proto, src_ip, src_port, dst_ip, dst_port, TCP flags, payload offset), IP addresses being
+    raw bytes.
+    """
+    try:
+        ether_type, offset = _network_layer(link_type, data)
+        if ether_type == ETHERTYPE_IPV4:
+            version_ihl, _, fragment, _, proto, src_ip, dst_ip = _ipv4_header.unpack_from(data, offset)
+            if fragment & 0x1fff:
+                # Only the first fragment has the transport header
+                return None
+            offset += (version_ihl & 0x0f) * 4
+        elif ether_type == ETHERTYPE_IPV6:
+            _, proto, src_ip, dst_ip = _ipv6_header.unpack_from(data, offset)
+            offset += 40
+            while proto in IPV6_EXTENSION_HEADERS:
+                if proto == IPV6_FRAGMENT:
+                    if _u16.unpack_from(data, offset + 2)[0] & 0xfff8:
+                        return None
+                    length = 8
+                elif proto == IPV6_AUTHENTICATION:
+                    length = (data[offset + 1] + 2) * 4
+                else:
+                    length = (data[offset + 1] + 1) * 8
+                proto = data[offset]
+                offset += length
+        else:
+            return None
+        if proto == TCP:
+            src_port, dst_port = _ports.unpack_from(data, offset)
+            flags = data[offset + 13]
+            payload_offset = offset + (data[offset + 12] >> 4) * 4
+        elif proto == UDP:
+            src_port, dst_port = _ports.unpack_from(data, offset)
+            flags = 0
+            payload_offset = offset + 8
+        else:
+            return None
+    except (struct.error, IndexError):
+        return None
+    return proto, src_ip, src_port, dst_ip, dst_port, flags, payload_offset
+
+
+def parse_tls_sni(data: bytes, offset: int) -> Optional[str]:
+    """
+    Extract the server name of a TLS ClientHello starting at offset, if the whole hello is
+    in this packet.
+    """
+    try:
+        # Handshake record, ClientHello message
+        if data[offset] != 0x16 or data[offset + 5] != 0x01:
+            return None
+        position = offset + 9 + 2 + 32
+        position += 1 + data[position]  # Session ID
+        position += 2 + _u16.unpack_from(data, position)[0]  # Cipher suites
+        position += 1 + data[position]  # Compression methods
+        extensions_end = position + 2 + _u16.unpack_from(data, position)[0]
+        position += 2
+        while position + 4 <= extensions_end:
+            extension_type, extension_length = _ports.unpack_from(data, position)
+            position += 4
+            if extension_type == 0:
+                # Server name list, the first entry is a host name
+                name_length = _u16.unpack_from(data, position + 3)[0]
+                return data[position + 5:position + 5 + name_length].decode('ascii', errors='replace')
+            position += extension_length
+    except (struct.error, IndexError):
+        pass
+    return None
+
+
+def _read_dns_name(data: bytes, position: int, start: int) -> tuple:
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[position]
+        if length & 0xc0 == 0xc0:
+            # Compression pointer, relative to the start of the DNS message
+            if end is None:
+                end = position + 2
+            position = start + (((length & 0x3f) << 8) | data[position + 1])
+            continue
+        if length == 0:
+            position += 1
+            break
+        labels.append(data[position + 1:position + 1 + length].decode('ascii', errors='replace'))
+        position += 1 + length
+    return '.'.join(labels), end if end is not None else position
+
+
+def parse_dns(data: bytes, offset: int) -> tuple:
+    """
+    Return the queried name of a DNS message and the addresses (raw bytes) it resolves to.
+    """
+    name = None
+    addresses = []
+    try:
+        _, flags, questions, answers, _, _ = _dns_header.unpack_from(data, offset)
+        if questions == 0:
+            return None, addresses
+        name, position = _read_dns_name(data, offset + 12, offset)
+        position += 4
+        for _ in range(questions - 1):
+            _, position = _read_dns_name(data, position, offset)
+            position += 4
+        if not flags & 0x8000:
+            return name, addresses
+        for _ in range(answers):
+            _, position = _read_dns_name(data, position, offset)
+            record_type, _, _, length = _dns_answer.unpack_from(data, position)
+            position += _dns_answer.size
+            if record_type in (1, 28):  # A, AAAA
+                addresses.append(data[position:position + length])
+            position += length
+    except (struct.error, IndexError, UnicodeDecodeError):
+        pass
+    return name, addresses
+
+
+def _ip_to_str(address: bytes) -> str:
+    return socket.inet_ntop(socket.AF_INET if len(address) == 4 else socket.AF_INET6, address)
+
+
+def _dump_flows(processes: dict, flows: Iterable[dict], out):
+    # Produces the same layout as serializer.dump({'processes': processes, 'flows': flows}, out)
+    if serializer.is_compact_output():
+        out.write(f'{{"processes":{serializer.dumps(processes, pretty=False)},"flows":[')
+        first = True
+        for flow in flows:
+            if not first:
+                out.write(',')
+            out.write(serializer.dumps(flow, pretty=False))
+            first = False
+        out.write(']}')
+        return
+    out.write('{\n  "processes": ')
+    out.write(textwrap.indent(serializer.dumps(processes, pretty=True), '  ')[2:])
+    out.write(',\n  "flows": [')
+    first = True
+    for flow in flows:
+        out.write('\n' if first else ',\n')
+        out.write(textwrap.indent(serializer.dumps(flow, pretty=True), '    '))
+        first = False
+    out.write(']\n}' if first else '\n  ]\n}')
+
+
+class FlowTracker:
+    """
+    Per-flow accounting of the captured traffic, fed with the packets read by TcpDump.
+
+    The packets are handed over to a worker thread which parses them in batches, the capture
+    thread only queues them. Flows are stored in a table made of arrays, one row per flow, and both directions of a
+    flow share the same row. The host name of a flow is taken from the TLS ClientHello or
+    from the DNS answers seen before the flow started. A 5-tuple seen again after being idle,
+    or a TCP connection opened again on the same ports, starts a new flow.
+
+    A background thread attributes the flows to the processes reported by the socket
+    traces and appends the idle flows to flows.ndjson as they are moved out of the table.
+    It periodically writes flows.json with the summary of all the flows and the flows still
+    in the table. Once stopped, flows.json lists all the flows and flows.ndjson is removed.
+    """
+
+    def __init__(self, output_dir, flush_interval: float = FLUSH_INTERVAL, idle_timeout: float = IDLE_TIMEOUT):
+        self.output_path = Path(output_dir) / FLOWS_FILE_NAME
+        self.staging_path = self.output_path.with_suffix('.ndjson')
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self._rows = {}
+        self._keys = []
+        self._first_seen = array('d')
+        self._last_seen = array('d')
+        self._bytes = array('Q')
+        self._packets = array('Q')
+        self._protocols = array('B')
+        self._ended = array('B')
+        self._endpoints = []
+        self._community_ids = []
+        self._names = []
+        self._owners = []
+        self._by_community_id = {}
+        self._dns_answers = {}
+        # Processes reported by the socket traces before their flow is seen
+        self._pending_owners = {}
+        self._traces = queue.SimpleQueue()
+        self._pending_packets = queue.Queue(MAX_PENDING_PACKETS)
+        self._dropped_packets = 0
+        # Most recent packet timestamp, the idle flows are found with the capture clock
+        self._latest = 0.0
+        self._closed = 0
+        self._closed_processes = {}
+        self._staging = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._packet_thread = None
+
+    def __len__(self):
+        return len(self._community_ids) + self._closed
+
+    def start(self):
+        self.staging_path.unlink(missing_ok=True)
+        self._packet_thread = threading.Thread(target=self._run_packets, daemon=True)
+        self._packet_thread.start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background threads and write all the flows to flows.json.
+        """
+        self._stopped.set()
+        if self._packet_thread:
+            # The packets queued before are accounted first
+            self._pending_packets.put(None)
+            self._packet_thread.join()
+        if self._thread:
+            self._thread.join()
+        if self._dropped_packets:
+            log.warning(f'{self._dropped_packets} packets were captured but not accounted in {FLOWS_FILE_NAME}')
+        self._attribute_traces()
+        self._write_flows(self.flows(), self._closed_flows())
+        if self._staging:
+            self._staging.close()
+            self._staging = None
+        self.staging_path.unlink(missing_ok=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self._attribute_traces()
+                self._evict_idle_flows()
+                self.flush()
+            except Exception as e:
+                log.error(f'Flow accounting failed: {e}')
+
+    def _add_flow(self, key: tuple) -> int:
+        proto, src_ip, src_port, dst_ip, dst_port = key
+        row = len(self._community_ids)
+        self._rows[key] = row
+        self._rows[(proto, dst_ip, dst_port, src_ip, src_port)] = row
+        src = _ip_to_str(src_ip)
+        dst = _ip_to_str(dst_ip)
+        community_id = flow_community_id(proto, src, src_port, dst, dst_port)
+        self._keys.append(key)
+        self._first_seen.append(0.0)
+        self._last_seen.append(0.0)
+        self._bytes.append(0)
+        self._packets.append(0)
+        self._protocols.append(proto)
+        self._ended.append(0)
+        self._endpoints.append((src, src_port, dst, dst_port))
+        self._community_ids.append(community_id)
+        self._names.append(self._dns_answers.get(dst_ip))
+        owner = self._pending_owners.pop(community_id, None)
+        self._owners.append(owner[:2] if owner else None)
+        self._by_community_id[community_id] = row
+        return row
+
+    def _is_new_flow(self, row: int, timestamp: float, flags: int) -> bool:
+        if timestamp - self._last_seen[row] > self.idle_timeout:
+            return True
+        # Connection opened again on the same ports once the previous one ended
+        return bool(self._ended[row] and flags & TCP_SYN and not flags & TCP_ACK)
+
+    def on_packet(self, timestamp: float, link_type: int, data: bytes):
+        """
+        Queue a packet read by the capture thread, it is accounted by the worker thread.
+        """
+        try:
+            self._pending_packets.put_nowait((timestamp, link_type, data))
+        except queue.Full:
+            # Never slow down the draining of the capture
+            self._dropped_packets += 1
+
+    def _run_packets(self):
+        while True:
+            batch = [self._pending_packets.get()]
+            try:
+                while len(batch) < PACKET_BATCH_SIZE:
+                    batch.append(self._pending_packets.get_nowait())
+            except queue.Empty:
+                pass
+            stopped = batch[-1] is None
+            try:
+                self.process_packets(batch[:-1] if stopped else batch)
+            except Exception as e:
+                log.error(f'Flow accounting failed: {e}')
+            if stopped:
+                return
+
+    @staticmethod
+    def _parse(link_type: int, data: bytes) -> Optional[tuple]:
+        headers = parse_packet(link_type, data)
+        if headers is None:
+            return None
+        proto, src_ip, src_port, dst_ip, dst_port, flags, payload_offset = headers
+        name, dns = None, None
+        if payload_offset < len(data):
+            if proto == TCP:
+                name = parse_tls_sni(data, payload_offset)
+            elif proto == UDP and 53 in (src_port, dst_port):
+                dns = parse_dns(data, payload_offset)
+        return (proto, src_ip, src_port, dst_ip, dst_port), flags, len(data), name, dns
+
+    def process_packets(self, packets: Iterable[tuple]):
+        """
+        Account a batch of (timestamp, link type, packet data), the packets are parsed before
+        taking the lock of the table.
+        """
+        parsed = [(timestamp, self._parse(link_type, data)) for timestamp, link_type, data in packets]
+        with self._lock:
+            for timestamp, headers in parsed:
+                if headers is not None:
+                    self._account(timestamp, *headers)
+
+    def _account(self, timestamp: float, key: tuple, flags: int, length: int, name: Optional[str],
+                 dns: Optional[tuple]):
+        self._latest = max(self._latest, timestamp)
+        row = self._rows.get(key)
+        if row is None or self._is_new_flow(row, timestamp, flags):
+            # The previous flow of this 5-tuple is left to the eviction
+            row = self._add_flow(key)
+            self._first_seen[row] = timestamp
+        self._last_seen[row] = timestamp
+        self._bytes[row] += length
+        self._packets[row] += 1
+        if flags & (TCP_FIN | TCP_RST):
+            self._ended[row] = 1
+        if name is not None and self._names[row] is None:
+            self._names[row] = name
+        elif dns is not None:
+            self._on_dns(row, *dns)
+
+    def _on_dns(self, row: int, name: Optional[str], addresses: list):
+        if name is None:
+            return
+        if self._names[row] is None:
+            self._names[row] = name
+        if len(self._dns_answers) > MAX_DNS_ANSWERS:
+            self._dns_answers.clear()
+        for address in addresses:
+            self._dns_answers[address] = name
+
+    def attribute(self, trace: dict):
+        """
+        Queue a socket trace, its flow is attributed to its process by the background thread.
+        """
+        self._traces.put(trace)
+
+    def _attribute_traces(self):
+        now = time.monotonic()
+        while True:
+            try:
+                trace = self._traces.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                community_id = compute_community_id(trace).get('community_id')
+            except (KeyError, TypeError):
+                continue
+            owner = (trace.get('pid'), trace.get('process'))
+            with self._lock:
+                row = self._by_community_id.get(community_id)
+                if row is None:
+                    self._pending_owners.setdefault(community_id, owner + (now,))
+                elif self._owners[row] is None:
+                    self._owners[row] = owner
+
+    def _flow(self, row: int) -> dict:
+        src_ip, src_port, dst_ip, dst_port = self._endpoints[row]
+        pid, process = self._owners[row] or (None, None)
+        return {
+            'community_id': self._community_ids[row],
+            'proto': 'tcp' if self._protocols[row] == TCP else 'udp',
+            'src_ip': src_ip,
+            'src_port': src_port,
+            'dst_ip': dst_ip,
+            'dst_port': dst_port,
+            'name': self._names[row],
+            'packets': self._packets[row],
+            'bytes': self._bytes[row],
+            'first_seen': self._first_seen[row],
+            'last_seen': self._last_seen[row],
+            'pid': pid,
+            'process': process,
+        }
+
+    def _is_idle(self, row: int) -> bool:
+        key = self._keys[row]
+        # Replaced by a new flow of the same 5-tuple
+        if self._rows.get(key) != row:
+            return True
+        return self._latest - self._last_seen[row] > self.idle_timeout
+
+    def _evict_idle_flows(self):
+        with self._lock:
+            # Processes reported for flows never seen
+            expired = time.monotonic() - self.idle_timeout
+            self._pending_owners = {
+                community_id: owner for community_id, owner in self._pending_owners.items() if owner[2] >= expired
+            }
+            kept = [row for row in range(len(self._community_ids)) if not self._is_idle(row)]
+            if len(kept) == len(self._community_ids):
+                return
+            new_rows = {row: new_row for new_row, row in enumerate(kept)}
+            evicted = [self._flow(row) for row in range(len(self._community_ids)) if row not in new_rows]
+            # Compact the table, the rows are renumbered
+            self._rows = {key: new_rows[row] for key, row in self._rows.items() if row in new_rows}
+            self._by_community_id = {
+                community_id: new_rows[row] for community_id, row in self._by_community_id.items() if row in new_rows
+            }
+            for name in ('_first_seen', '_last_seen', '_bytes', '_packets', '_protocols', '_ended'):
+                column = getattr(self, name)
+                setattr(self, name, array(column.typecode, (column[row] for row in kept)))
+            for name in ('_keys', '_endpoints', '_community_ids', '_names', '_owners'):
+                column = getattr(self, name)
+                setattr(self, name, [column[row] for row in kept])
+        if self._staging is None:
+            self._staging = self.staging_path.open('a', encoding='utf-8')
+        for flow in evicted:
+            self._staging.write(serializer.dumps(flow, pretty=False))
+            self._staging.write('\n')
+        self._staging.flush()
+        self._closed += len(evicted)
+        self.summarize(evicted, self._closed_processes)
+
+    def flows(self) -> list:
+        """
+        Return the flows of the table, the idle flows already written out are not included.
+        """
+        with self._lock:
+            return [self._flow(row) for row in range(len(self._community_ids))]
+
+    def _closed_flows(self):
+        if self._staging is None:
+            return
+        self._staging.flush()
+        with self.staging_path.open('r', encoding='utf-8') as staging:
+            for line in staging:
+                if line.strip():
+                    yield serializer.loads(line)
+
+    @staticmethod
+    def summarize(flows: list, processes: Optional[dict] = None) -> dict:
+        processes = {} if processes is None else processes
+        for flow in flows:
+            summary = processes.setdefault(flow.get('process') or 'unknown', {
+                'flows': 0, 'packets': 0, 'bytes': 0, 'names': set()
+            })
+            summary['flows'] += 1
+            summary['packets'] += flow.get('packets')
+            summary['bytes'] += flow.get('bytes')
+            if flow.get('name'):
+                summary['names'].add(flow.get('name'))
+        return processes
+
+    def flush(self):
+        """
+        Write flows.json with the summary of all the flows and the flows still in the table,
+        the closed flows are only appended to flows.ndjson.
+        """
+        self._write_flows(self.flows())
+
+    def _write_flows(self, flows: list, closed_flows: Iterable[dict] = ()):
+        processes = self.summarize(flows, {
+            process: dict(summary, names=set(summary['names'])) for process, summary in self._closed_processes.items()
+        })
+        for summary in processes.values():
+            summary['names'] = sorted(summary['names'])
+        tmp_path = self.output_path.with_suffix('.json.tmp')
+        try:
+            with tmp_path.open('w', encoding='utf-8') as out:
+                _dump_flows(processes, itertools.chain(closed_flows, flows), out)
+            # Readers never see a partially written file
+            os.replace(tmp_path, self.output_path)
+        except OSError as e:
+            log.error(f'Unable to write {self.output_path}: {e}')
@@ -0,0 +1,295 @@
+import binascii
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+from pirogue_evidence_collector.utils import serializer
+
+LARGE_BODY_THRESHOLD = 1024 * 1024
+_blob_dir: Optional[Path] = None
+
+
+def set_blob_dir(blob_dir: Optional[Path]):
+    """
+    Bodies larger than LARGE_BODY_THRESHOLD are written to this folder, named after their
+    SHA-256, instead of being kept in memory. They are kept in memory when not set.
+    """
+    global _blob_dir
+    _blob_dir = Path(blob_dir) if blob_dir else None
+
+
+class HttpBody:
+    """
+    Body of an HTTP message, kept as bytes or spilled to a blob file.
+
+    Decoding as text and pretty-printing are only done when the body is displayed.
+    """
+    __slots__ = ('_data', 'size', 'sha256', 'blob_path')
+
+    def __init__(self, data: Optional[bytes] = None, size: int = 0, sha256: Optional[str] = None,
+                 blob_path: Optional[str] = None):
+        self._data = data
+        self.size = size
+        self.sha256 = sha256
+        self.blob_path = blob_path
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, bytearray]) -> 'HttpBody':
+        if _blob_dir is None or len(data) < LARGE_BODY_THRESHOLD:
+            return cls(data=data, size=len(data))
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob_path = _blob_dir / f'{sha256}.bin'
+        if not blob_path.exists():
+            _blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(f'{blob_path.name}.{os.getpid()}.tmp')
+            with tmp_path.open('wb') as f:
+                f.write(data)
+            tmp_path.replace(blob_path)
+        return cls(size=len(data), sha256=sha256, blob_path=str(blob_path))
+
+    @classmethod
+    def from_text(cls, text: str) -> 'HttpBody':
+        return cls.from_bytes(text.encode('utf-8'))
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self.text()
+
+    @property
+    def is_spilled(self) -> bool:
+        return self.blob_path is not None
+
+    def read(self) -> Union[bytes, bytearray]:
+        if self._data is not None:
+            return self._data
+        with open(self.blob_path, 'rb') as f:
+            return f.read()
+
+    def text(self) -> str:
+        # Same behaviour as before: the body as text, or hex encoded if it is not UTF-8
+        data = self.read()
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data.hex()
+
+    def pretty(self) -> str:
+        if self.is_spilled:
+            return f'<{self.size} bytes stored in {self.blob_path}>'
+        text = self.text()
+        try:
+            return serializer.dumps(serializer.loads(text), pretty=True)
+        except Exception:
+            return text
+
+    def to_json(self):
+        if self.is_spilled:
+            return {'size': self.size, 'sha256': self.sha256, 'blob': self.blob_path}
+        return self.text()
+
+
+def serializable_record(record: dict) -> dict:
+    data = record.get('data')
+    if isinstance(data, HttpBody):
+        record = record.copy()
+        record['data'] = data.to_json()
+    return record
+
+
+def parse_ip_layer(ip_layer: dict):
+    try:
+        return {
+                   'ip': ip_layer.get('ip_ip_src'),
+                   'host': ip_layer.get('ip_ip_src_host')
+               }, {
+                   'ip': ip_layer.get('ip_ip_dst'),
+                   'host': ip_layer.get('ip_ip_dst_host'),
+               }
+    except Exception as e:
+        return None
+
+
+def parse_eth_layer(eth_layer: dict):
+    return {
+               'mac': eth_layer.get('eth_eth_src')
+           }, {
+               'mac': eth_layer.get('eth_eth_dst'),
+           }
+
+
+def parse_sll_layer(sll_layer: dict):
+    return {
+               'mac': sll_layer.get('sll_sll_src_eth')
+           }, {
+               'mac': None,
+           }
+
+
+def decode_colon_hex(value) -> bytes:
+    """
+    Decode the colon-separated hexadecimal form used by tshark EK output, either a single
+    string or a list of fragments, into bytes.
+    """
+    if isinstance(value, str):
+        return binascii.unhexlify(value.encode('ascii').translate(None, b':'))
+    # The hex digits of all the fragments are gathered in a single preallocated buffer,
+    # decoded at once
+    sizes = [(len(f) + 1) // 3 * 2 if ':' in f else len(f) for f in value]
+    digits = bytearray(sum(sizes))
+    view = memoryview(digits)
+    offset = 0
+    for fragment, size in zip(value, sizes):
+        view[offset:offset + size] = fragment.encode('ascii').translate(None, b':')
+        offset += size
+    return binascii.unhexlify(view)
+
+
+def parse_single_http2_layer(http2_layer: dict):
+    data, headers = None, None
+    if 'http2_http2_body_reassembled_data' in http2_layer:
+        data = HttpBody.from_bytes(decode_colon_hex(http2_layer.get('http2_http2_body_reassembled_data', '')))
+    elif 'http2_http2_data_data' in http2_layer:
+        data = HttpBody.from_bytes(decode_colon_hex(http2_layer.get('http2_http2_data_data', '')))
+    if 'http2_http2_headers' in http2_layer:
+        header_name = http2_layer.get('http2_http2_header_name')
+        header_value = http2_layer.get('http2_http2_header_value')
+        if len(header_name) != len(header_value):
+            print('ERROR http2 unmatched header names with values')
+            return headers, data
+        headers = dict([x for x in zip(header_name, header_value)])
+    return headers, data
+
+
+def parse_http2(layers: dict, layer_names: list):
+    to_return = []
+    http2_layer = layers.get('http2')
+    if type(http2_layer) is list:
+        for l in http2_layer:
+            headers, data = parse_single_http2_layer(l)
+            to_return.append({
+                'headers': headers,
+                'data': data
+            })
+    else:
+        headers, data = parse_single_http2_layer(http2_layer)
+        to_return.append({
+            'headers': headers,
+            'data': data
+        })
+    return to_return
+
+
+def parse_http3(layers: dict, layer_names: list):
+    headers, data = None, None
+    http3_layer = layers.get('http3')
+    # if type(http_layer) is list:
+    #    for l in http_layer:
+    #        parse_single_http_layer(l)
+    # else:
+    #    parse_single_http2_layer(http2_layer)
+    return headers, data
+
+
+def parse_http(layers: dict, layer_names: list):
+    headers, data = None, None
+    http_layer = layers.get('http')
+    if http_layer and type(http_layer) is list: # list in case of websocket communication
+        http_layer = http_layer[0]
+    data = HttpBody.from_text(http_layer.get('http_http_file_data', ''))
+    raw_headers = None
+    if 'http_http_response_line' in http_layer:
+        raw_headers = http_layer.get('http_http_response_line')
+    if 'http_http_request_line' in http_layer:
+        raw_headers = http_layer.get('http_http_request_line')
+    headers = {}
+    for line in raw_headers:
+        i = line.find(': ')
+        name = line[:i].strip()
+        value = line[i + 1:].strip()
+        headers[name] = value
+    if 'http_http_response_for_uri' in http_layer:
+        headers['uri'] = http_layer.get('http_http_response_for_uri')
+    elif 'http_http_request_full_uri' in http_layer:
+        headers['uri'] = http_layer.get('http_http_request_full_uri')
+    headers['is_request'] = 'http_http_request' in http_layer
+    return [{'headers': headers, 'data': data}]
+
+    # 'http_http_request_line' // request headers
+    # 'http_http_request_method'
+    # 'http_http_request_full_uri'
+    # 'http_http_file_data' // data if sent
+
+    # 'http_http_response_code' (+ 'http_http_response_code_desc' pour lisibilité)
+    # 'http_http_response_line' // response headers
+    # 'http_http_response_for_uri' // uri which replies
+    # 'http_http_file_data'
+
+    # if type(http_layer) is list:
+    #    for l in http_layer:
+    #        parse_single_http_layer(l)
+    # else:
+    #    parse_single_http2_layer(http2_layer)
+
+
+def get_top_most_layers(packet, protocol, protocol_stack):
+    i = protocol_stack.find(f':{protocol}')
+    top_most_layer_names = protocol_stack[i + 1:].split(':')
+    top_most_layers = {k: packet.get('layers').get(k) for k in top_most_layer_names}
+    return top_most_layers, top_most_layer_names
+
+
+def dispatch(packet):
+    protocol_stack = packet.get('layers').get('frame').get('frame_frame_protocols')
+    packets = []
+    packet_description = {
+        'src': {},
+        'dst': {},
+        'timestamp': packet.get('timestamp'),
+        'community_id': packet.get('layers').get('communityid_communityid'),
+        'headers': None,
+        'data': None,
+        'protocol_stack': protocol_stack
+    }
+    if 'ip' not in packet.get('layers'):
+        return None
+
+    src_ip, dst_ip = parse_ip_layer(packet.get('layers').get('ip'))
+    if protocol_stack.startswith('eth:'):
+        src_eth, dst_eth = parse_eth_layer(packet.get('layers').get('eth'))
+    if protocol_stack.startswith('sll:'):
+        src_eth, dst_eth = parse_sll_layer(packet.get('layers').get('sll'))
+    packet_description['src'].update(src_ip)
+    packet_description['src'].update(src_eth)
+    packet_description['dst'].update(dst_ip)
+    packet_description['dst'].update(dst_eth)
+
+    if ':http3' in protocol_stack:
+        top_most_layers, top_most_layer_names = get_top_most_layers(packet, 'http3', protocol_stack)
+        parse_http3(top_most_layers, top_most_layer_names)
+        return
+    elif ':http2' in protocol_stack:
+        top_most_layers, top_most_layer_names = get_top_most_layers(packet, 'http2', protocol_stack)
+        ret = parse_http2(top_most_layers, top_most_layer_names)
+        for r in ret:
+            pd = packet_description.copy()
+            if r['headers'] or r['data']:
+                pd['headers'] = r['headers']
+                pd['data'] = r['data']
+                packets.append(pd)
+        return packets
+    elif ':http' in protocol_stack:
+        top_most_layers, top_most_layer_names = get_top_most_layers(packet, 'http', protocol_stack)
+        ret = parse_http(top_most_layers, top_most_layer_names)
+        for r in ret:
+            pd = packet_description.copy()
+            if r['headers'] or r['data']:
+                pd['headers'] = r['headers']
+                pd['data'] = r['data']
+                packets.append(pd)
+        return packets
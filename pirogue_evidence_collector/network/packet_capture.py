@@ -1,39 +1,284 @@
 import logging
 import os
+import shlex
 import signal
+import struct
 import subprocess
+import threading
 import time
-from typing import Optional
+from pathlib import Path
+from typing import Callable, Optional
+
+from pirogue_evidence_collector.utils.compressed_io import open_hashing_writer
 
 log = logging.getLogger(__name__)
 
+PCAP_GLOBAL_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+# Magic number of the pcap format, with microsecond or nanosecond resolution
+PCAP_MAGIC_NUMBERS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+SEGMENT_FLUSH_INTERVAL = 1.0
+# Hardware type of the Ethernet interfaces in /sys/class/net/<interface>/type
+ARPHRD_ETHER = 1
+
+
+def build_host_filter(addresses: list, mac_addresses: list = ()) -> Optional[str]:
+    primitives = [f'host {address}' for address in addresses]
+    primitives.extend(f'ether host {address}' for address in mac_addresses)
+    if not primitives:
+        return None
+    return ' or '.join(primitives)
+
+
+def is_ethernet_interface(interface: str) -> bool:
+    # Filters on MAC addresses only compile for the interfaces having Ethernet headers,
+    # e.g. not for a VPN tunnel
+    try:
+        return Path(f'/sys/class/net/{interface}/type').read_text().strip() == str(ARPHRD_ETHER)
+    except OSError:
+        return False
+
+
+class PcapSegment:
+    __slots__ = (
+        'path',
+        'file',
+        'writer',
+        'start_time',
+        'end_time',
+        'packets',
+        'size',
+    )
+
+    def __init__(self, path: Path, header: bytes, compress: bool = False):
+        self.writer = None
+        if compress:
+            self.file, self.writer = open_hashing_writer(path, compress=True, text=False)
+            self.path = self.writer.path
+        else:
+            self.path = path
+            self.file = path.open('wb')
+        self.file.write(header)
+        self.start_time = time.time() * 1000
+        self.end_time = None
+        self.packets = 0
+        self.size = len(header)
+
+    def write(self, record: bytes):
+        self.file.write(record)
+        self.packets += 1
+        self.size += len(record)
+
+    def flush(self):
+        self.file.flush()
+        if self.writer:
+            self.writer.flush()
+
+    def close(self):
+        self.file.close()
+        self.end_time = time.time() * 1000
+
+    def to_dict(self) -> dict:
+        segment = {
+            'file': self.path.name,
+            'start_capture_time': self.start_time,
+            'end_capture_time': self.end_time,
+            'packets': self.packets,
+            'size': self.size,
+        }
+        if self.writer:
+            segment['digests'] = self.writer.digests()
+        return segment
+
 
 class TcpDump:
+    """
+    Runs tcpdump, or the command given by the user, and reads the pcap stream it writes on
+    its standard output.
+
+    The stream is written to traffic.pcap, or to segments named traffic-00001.pcap,
+    traffic-00002.pcap... when a maximum size or duration per file is given. Each packet is
+    also passed to the registered listeners as (timestamp, link type, packet data) while
+    the capture is running.
+    """
     __slots__ = (
         'interface',
         'capture_cmd',
         'pcap_file_name',
         'output_dir',
         'process',
-        'has_user_provided_cmd'
+        'has_user_provided_cmd',
+        'bpf_filter',
+        'snaplen',
+        'rotate_size',
+        'rotate_seconds',
+        'compress',
+        'listeners',
+        'segments',
+        'link_type',
+        '_reader',
+        '_ready',
+        '_header',
+        '_segment',
+        '_lock',
+        '_ticker',
+        '_stopped',
     )
 
-    def __init__(self, interface: str, output_dir: str, pcap_file_name: str, capture_cmd: Optional[str]):
+    def __init__(self, interface: str, output_dir: str, pcap_file_name: str, capture_cmd: Optional[str],
+                 rotate_size: Optional[int] = None, rotate_seconds: Optional[float] = None,
+                 bpf_filter: Optional[str] = None, snaplen: Optional[int] = None, compress: bool = False):
+        self.compress = compress
+        self.bpf_filter = bpf_filter
+        self.snaplen = snaplen
         if capture_cmd:
             self.capture_cmd = capture_cmd
             self.has_user_provided_cmd = True
+            if bpf_filter or snaplen:
+                log.warning('The filter and the snapshot length are ignored with a user provided capture command')
+                self.bpf_filter = None
+                self.snaplen = None
         else:
             self.interface = interface
             self.capture_cmd = f'tcpdump -U -w - -i {self.interface}'
+            if self.snaplen:
+                self.capture_cmd += f' -s {int(self.snaplen)}'
+            if self.bpf_filter:
+                self.capture_cmd += f' {shlex.quote(self.bpf_filter)}'
             self.has_user_provided_cmd = False
         self.pcap_file_name = pcap_file_name
         if not self.pcap_file_name.endswith('.pcap'):
             self.pcap_file_name += '.pcap'
         self.output_dir = output_dir
         self.process = None
+        self.rotate_size = rotate_size
+        self.rotate_seconds = rotate_seconds
+        self.listeners = []
+        self.segments = []
+        self.link_type = None
+        self._reader = None
+        # Set once the capture process wrote its header, or exited
+        self._ready = threading.Event()
+        self._header = None
+        # Segment being written, shared by the reader and the ticker threads
+        self._segment = None
+        self._lock = threading.Lock()
+        self._ticker = None
+        self._stopped = threading.Event()
+
+    @property
+    def rotation_enabled(self) -> bool:
+        return bool(self.rotate_size or self.rotate_seconds)
+
+    def add_listener(self, listener: Callable[[float, int, bytes], None]):
+        self.listeners.append(listener)
+
+    def _segment_path(self) -> Path:
+        if not self.rotation_enabled:
+            return Path(self.output_dir) / self.pcap_file_name
+        stem = Path(self.pcap_file_name).stem
+        return Path(self.output_dir) / f'{stem}-{len(self.segments) + 1:05d}.pcap'
+
+    def _new_segment(self, header: bytes) -> PcapSegment:
+        segment = PcapSegment(self._segment_path(), header, compress=self.compress)
+        self.segments.append(segment)
+        log.info(f'Writing the network traffic to {segment.path.name}')
+        return segment
+
+    def _needs_rotation(self, segment: PcapSegment) -> bool:
+        if not self.rotation_enabled or segment.packets == 0:
+            return False
+        if self.rotate_size and segment.size >= self.rotate_size:
+            return True
+        if self.rotate_seconds and time.time() * 1000 - segment.start_time >= self.rotate_seconds * 1000:
+            return True
+        return False
+
+    def _rotate_if_needed(self):
+        if self._needs_rotation(self._segment):
+            self._segment.close()
+            self._segment = self._new_segment(self._header)
+
+    def _tick(self):
+        # Rotate and flush the segment even when no packet is received
+        while not self._stopped.wait(SEGMENT_FLUSH_INTERVAL):
+            with self._lock:
+                if self._segment is None:
+                    continue
+                try:
+                    self._rotate_if_needed()
+                    # Make the packets available to the readers of the segment
+                    self._segment.flush()
+                except Exception as e:
+                    log.error(f'Failed to flush the capture file: {e}')
+
+    def _notify_listeners(self, timestamp: float, data: bytes):
+        for listener in self.listeners:
+            try:
+                listener(timestamp, self.link_type, data)
+            except Exception as e:
+                log.error(f'Packet listener failed: {e}')
+
+    def _copy_raw_stream(self, stream, header: bytes):
+        # Not a pcap stream (e.g. pcapng written by a user provided command), store it as is
+        log.warning('The capture is not in the pcap format, rotation and live analysis are disabled')
+        segment = PcapSegment(Path(self.output_dir) / self.pcap_file_name, header, compress=self.compress)
+        self.segments.append(segment)
+        self._ready.set()
+        try:
+            while chunk := stream.read1(65536):
+                segment.file.write(chunk)
+                segment.size += len(chunk)
+        finally:
+            segment.close()
+
+    def _read_stream(self, stream):
+        header = stream.read(PCAP_GLOBAL_HEADER_LENGTH)
+        if len(header) < PCAP_GLOBAL_HEADER_LENGTH:
+            self._ready.set()
+            log.error('The capture process did not write any data')
+            return
+        if header[:4] not in PCAP_MAGIC_NUMBERS:
+            self._copy_raw_stream(stream, header)
+            return
+        byte_order, resolution = PCAP_MAGIC_NUMBERS[header[:4]]
+        record_header = struct.Struct(f'{byte_order}IIII')
+        self.link_type = struct.unpack(f'{byte_order}I', header[20:24])[0]
+        self._header = header
+        with self._lock:
+            self._segment = self._new_segment(header)
+        self._ready.set()
+        self._ticker = threading.Thread(target=self._tick, daemon=True)
+        self._ticker.start()
+        try:
+            while True:
+                packet_header = stream.read(PCAP_RECORD_HEADER_LENGTH)
+                if len(packet_header) < PCAP_RECORD_HEADER_LENGTH:
+                    break
+                ts_sec, ts_frac, captured_length, _ = record_header.unpack(packet_header)
+                data = stream.read(captured_length)
+                if len(data) < captured_length:
+                    log.warning('The capture stream ended with a truncated packet')
+                    break
+                with self._lock:
+                    self._rotate_if_needed()
+                    self._segment.write(packet_header + data)
+                if self.listeners:
+                    self._notify_listeners(ts_sec + ts_frac * resolution, data)
+        finally:
+            self._stopped.set()
+            self._ticker.join()
+            with self._lock:
+                self._segment.close()
+                self._segment = None
 
     @staticmethod
-    def __check_user_rights():
+    def check_user_rights():
         try:
             subprocess.check_call(
                 'tcpdump -c 1',
@@ -49,21 +294,29 @@ class TcpDump:
         except Exception:
             pass
 
-    def start_capture(self):
+    def start_capture(self, check_user_rights: bool = True):
         log.info(f'Starting network interception...')
-        if not self.has_user_provided_cmd:
-            TcpDump.__check_user_rights()
+        if self.bpf_filter:
+            log.info(f'Capture filter: {self.bpf_filter}')
+        if check_user_rights and not self.has_user_provided_cmd:
+            TcpDump.check_user_rights()
         try:
             self.process = subprocess.Popen(
                 self.capture_cmd,
                 shell=True,
-                stdout=open(f'{self.output_dir}/{self.pcap_file_name}', 'w'),
+                stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
             )
+            self._reader = threading.Thread(target=self._read_stream, args=(self.process.stdout,), daemon=True)
+            self._reader.start()
         except Exception as e:
             self.stop_capture()
             raise e
 
+    def wait_until_ready(self, timeout: float) -> bool:
+        # tcpdump writes the pcap header once the interface is open and the filter is set
+        return self._ready.wait(timeout) and bool(self.segments)
+
     def stop_capture(self):
         log.info(f'Stopping network interception...')
         try:
@@ -73,3 +326,9 @@ class TcpDump:
             self.process.kill()
         except:
             pass
+        # The reader stops once the remaining packets of the pipe have been written
+        if self._reader:
+            self._reader.join(timeout=10)
+
+    def get_segments(self) -> list:
+        return [segment.to_dict() for segment in self.segments]
@@ -0,0 +1,214 @@
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from pirogue_evidence_collector.network.community_id import compute_community_id
+from pirogue_evidence_collector.network.http_dissector import dispatch, set_blob_dir
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.compressed_io import find_evidence, open_evidence
+from pirogue_evidence_collector.utils.json_stream import iter_json_records
+
+log = logging.getLogger(__name__)
+
+EK_PACKET_PREFIX = '{"timestamp":'
+STACK_INDEX_SUFFIX = '.cid_index.json'
+DISSECTION_CHUNK_SIZE = 256
+
+
+def iter_ek_packets(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Lazily parse the packets of a file generated by tshark -T ek, skipping the index lines.
+    """
+    for line in lines:
+        if line.startswith(EK_PACKET_PREFIX):
+            yield serializer.loads(line)
+
+
+def compact_stack(stack: list) -> list:
+    # Keep the distinct classes of the stack, in call order
+    clean_stack = []
+    for call in stack:
+        clazz = call.get('class') if isinstance(call, dict) else call
+        if clazz not in clean_stack:
+            clean_stack.append(clazz)
+    return clean_stack
+
+
+def resolve_stack(data: dict, stacks: dict = None) -> Optional[list]:
+    # Frames embedded in the record or interned by the agent, socket traces use stack and
+    # stack_id while dynamic hook logs use stacktrace and stacktrace_id
+    for inline_key, id_key in (('stack', 'stack_id'), ('stacktrace', 'stacktrace_id')):
+        stack = data.get(inline_key)
+        if stack is None and stacks:
+            stack = stacks.get(data.get(id_key))
+        if stack is not None:
+            return stack
+    return None
+
+
+def load_stacks(stacks_path: Optional[Path]) -> dict:
+    stacks_path = find_evidence(stacks_path) if stacks_path else None
+    if not stacks_path:
+        return {}
+    with open_evidence(stacks_path) as stacks_file:
+        return serializer.load(stacks_file)
+
+
+def _file_signature(path: Optional[Path]) -> Optional[dict]:
+    if not path or not Path(path).exists():
+        return None
+    stat = Path(path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class StackIndex:
+    """
+    Maps community IDs to the process and compacted stack trace of the first socket operation
+    seen for the flow.
+
+    The index is built by streaming the socket traces and can be persisted as a sidecar file
+    next to them to avoid reprocessing the traces.
+    """
+    VERSION = 1
+
+    def __init__(self, entries: dict = None):
+        self.entries = entries or {}
+
+    def __contains__(self, community_id):
+        return community_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, community_id) -> Optional[dict]:
+        return self.entries.get(community_id)
+
+    def add(self, trace: dict, stacks: dict = None):
+        try:
+            flow_data = compute_community_id(trace)
+        except (KeyError, TypeError):
+            return
+        community_id = flow_data.get('community_id')
+        if community_id in self.entries:
+            return
+        stack = resolve_stack(trace['data'], stacks)
+        self.entries[community_id] = {
+            'pid': trace.get('pid'),
+            'process': trace.get('process'),
+            'timestamp': trace.get('timestamp'),
+            'stack': compact_stack(stack or []),
+        }
+
+    @classmethod
+    def build(cls, socket_traces: Iterable[dict], stacks: dict = None) -> 'StackIndex':
+        index = cls()
+        for trace in socket_traces:
+            index.add(trace, stacks)
+        return index
+
+    @classmethod
+    def from_socket_trace_file(cls, socket_trace_path: Path, stacks_path: Optional[Path] = None,
+                               use_sidecar: bool = True) -> 'StackIndex':
+        socket_trace_path = Path(socket_trace_path)
+        if stacks_path is None:
+            stacks_path = socket_trace_path.parent / 'stacks.json'
+        stacks_path = find_evidence(stacks_path)
+        sidecar_path = socket_trace_path.with_name(socket_trace_path.name + STACK_INDEX_SUFFIX)
+        sources = {
+            'socket_traces': _file_signature(socket_trace_path),
+            'stacks': _file_signature(stacks_path),
+        }
+        if use_sidecar and sidecar_path.exists():
+            try:
+                index = cls.load(sidecar_path, sources)
+                if index is not None:
+                    log.info(f'Reusing the community ID index {sidecar_path.name}')
+                    return index
+            except Exception as e:
+                log.warning(f'Unable to load {sidecar_path}: {e}')
+        stacks = load_stacks(stacks_path)
+        with open_evidence(socket_trace_path) as socket_traces:
+            index = cls.build(iter_json_records(socket_traces), stacks)
+        if use_sidecar:
+            try:
+                index.save(sidecar_path, sources)
+            except OSError as e:
+                log.warning(f'Unable to save {sidecar_path}: {e}')
+        return index
+
+    @classmethod
+    def load(cls, path: Path, sources: dict = None) -> Optional['StackIndex']:
+        with Path(path).open('r') as f:
+            content = serializer.load(f)
+        if content.get('version') != cls.VERSION:
+            return None
+        if sources is not None and content.get('sources') != sources:
+            # The traces changed since the index has been generated
+            return None
+        return cls(content.get('entries'))
+
+    def save(self, path: Path, sources: dict = None):
+        with Path(path).open('w', encoding='utf-8') as f:
+            serializer.dump({'version': self.VERSION, 'sources': sources, 'entries': self.entries}, f, pretty=False)
+
+
+def dissect_packets(packets: Iterable[dict], only_with_data: bool = True) -> Iterator[dict]:
+    for packet in packets:
+        records = dispatch(packet)
+        if not records:
+            continue
+        for record in records:
+            if only_with_data and not record.get('data'):
+                continue
+            yield record
+
+
+def _dissect_lines(lines: list) -> list:
+    return list(dissect_packets(iter_ek_packets(lines)))
+
+
+def dissect_ek_lines(lines: Iterable[str], jobs: int = 1, chunk_size: int = DISSECTION_CHUNK_SIZE,
+                     blob_dir: Optional[Path] = None) -> Iterator[dict]:
+    """
+    Parse and dissect the lines of a tshark EK output.
+
+    With more than one job, chunks of lines are dissected by a pool of processes and the
+    records are yielded in the order of the input, i.e. in capture order. The number of
+    chunks in flight is bounded so memory does not depend on the size of the input.
+
+    Large bodies are written to blob_dir, see http_dissector.set_blob_dir().
+    """
+    set_blob_dir(blob_dir)
+    if jobs <= 1:
+        yield from dissect_packets(iter_ek_packets(lines))
+        return
+    packet_lines = (line for line in lines if line.startswith(EK_PACKET_PREFIX))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=set_blob_dir, initargs=(blob_dir,)) as executor:
+        pending = deque()
+        while chunk := list(islice(packet_lines, chunk_size)):
+            pending.append(executor.submit(_dissect_lines, chunk))
+            if len(pending) >= jobs * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def attach_stacks(records: Iterable[dict], stack_index: Optional[StackIndex] = None) -> Iterator[dict]:
+    for record in records:
+        entry = stack_index.get(record.get('community_id')) if stack_index else None
+        record['pid'] = entry.get('pid') if entry else None
+        record['process'] = entry.get('process') if entry else None
+        record['stack'] = entry.get('stack') if entry else None
+        yield record
+
+
+def join_traffic(packets: Iterable[dict], stack_index: Optional[StackIndex] = None,
+                 only_with_data: bool = True) -> Iterator[dict]:
+    """
+    Dissect the HTTP packets and attach the process and the stack trace having opened the
+    corresponding flow, one record at a time.
+    """
+    yield from attach_stacks(dissect_packets(packets, only_with_data), stack_index)
@@ -0,0 +1,173 @@
+"""
+Evidence files optionally compressed with zstd.
+
+Files are written through HashingWriter, which computes the SHA-256 and SHA-512 digests of
+the data and, when compressed, of the zstd stream actually stored on disk in the same pass.
+open_evidence() and find_evidence() let the analysis tools read compressed and
+uncompressed files alike.
+
+Compression requires the zstandard package.
+"""
+import hashlib
+import io
+from pathlib import Path
+from typing import IO, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_SUFFIX = '.zst'
+DIGEST_ALGORITHMS = ('sha256', 'sha512')
+DEFAULT_COMPRESSION_LEVEL = 3
+
+
+def is_compression_available() -> bool:
+    return zstandard is not None
+
+
+def check_compression_available():
+    if zstandard is None:
+        raise Exception('The zstandard Python package is required to compress the evidence files, '
+                        'install it with: sudo apt install python3-zstandard')
+
+
+class _Digests:
+    __slots__ = ('hashes', 'size')
+
+    def __init__(self):
+        self.hashes = [hashlib.new(algorithm) for algorithm in DIGEST_ALGORITHMS]
+        self.size = 0
+
+    def update(self, data):
+        for h in self.hashes:
+            h.update(data)
+        self.size += len(data)
+
+    def to_dict(self) -> dict:
+        digests = {h.name: h.hexdigest() for h in self.hashes}
+        digests['size'] = self.size
+        return digests
+
+
+class _DigestingFile:
+    """
+    Computes the digests of the bytes written to the underlying file.
+    """
+
+    def __init__(self, fp: IO[bytes]):
+        self.fp = fp
+        self.digests = _Digests()
+
+    def write(self, data) -> int:
+        self.digests.update(data)
+        return self.fp.write(data)
+
+    def flush(self):
+        self.fp.flush()
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    Binary writer computing the digests of the data written and, with compression enabled,
+    writing it as a zstd stream to ``path.zst`` along with the digests of the compressed
+    stream.
+
+    Wrap it in io.BufferedWriter and io.TextIOWrapper to write text. Flushing the wrappers
+    does not flush the writer itself, call its flush() method as well.
+    """
+
+    def __init__(self, path: Path, compress: bool = False, level: int = DEFAULT_COMPRESSION_LEVEL):
+        super().__init__()
+        self.compressed = compress
+        self.path = Path(f'{path}{COMPRESSED_SUFFIX}') if compress else Path(path)
+        self._file = self.path.open('wb')
+        self._digests = _Digests()
+        self._compressed_file = None
+        if compress:
+            check_compression_available()
+            self._compressed_file = _DigestingFile(self._file)
+            self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._compressed_file, closefd=False)
+        else:
+            self._stream = self._file
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._digests.update(data)
+        self._stream.write(data)
+        return len(data)
+
+    def flush(self):
+        if self.closed:
+            return
+        # Ends the current zstd block so the data written so far can be decompressed
+        self._stream.flush()
+        self._file.flush()
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self._compressed_file is not None:
+            self._stream.close()
+        self._file.close()
+
+    def digests(self) -> dict:
+        digests = self._digests.to_dict()
+        if self._compressed_file is not None:
+            digests['compression'] = 'zstd'
+            digests['compressed'] = self._compressed_file.digests.to_dict()
+        return digests
+
+
+def open_hashing_writer(path: Path, compress: bool = False, text: bool = True,
+                        buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> tuple:
+    """
+    Return a buffered file object writing to a HashingWriter, along with the writer.
+    """
+    writer = HashingWriter(path, compress=compress)
+    fp = io.BufferedWriter(writer, buffer_size=buffer_size)
+    if text:
+        fp = io.TextIOWrapper(fp, encoding='utf-8')
+    return fp, writer
+
+
+def find_evidence(path: Path) -> Optional[Path]:
+    """
+    Return the path of a file or of its compressed version, whichever exists.
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    compressed_path = Path(f'{path}{COMPRESSED_SUFFIX}')
+    if compressed_path.exists():
+        return compressed_path
+    return None
+
+
+def is_compressed(path: Path) -> bool:
+    return Path(path).name.endswith(COMPRESSED_SUFFIX)
+
+
+def open_evidence(path: Path, mode: str = 'r') -> IO:
+    """
+    Open a file for reading, transparently decompressing it if it ends with .zst.
+    """
+    path = Path(path)
+    if not is_compressed(path):
+        if 'b' in mode:
+            return path.open(mode)
+        return path.open(mode, encoding='utf-8')
+    check_compression_available()
+    fp = path.open('rb')
+    reader = zstandard.ZstdDecompressor().stream_reader(fp, closefd=True, read_across_frames=True)
+    reader = io.BufferedReader(reader)
+    if 'b' in mode:
+        return reader
+    return io.TextIOWrapper(reader, encoding='utf-8')
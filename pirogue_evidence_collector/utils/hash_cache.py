@@ -0,0 +1,121 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Sequence
+
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.hashing import DEFAULT_ALGORITHMS, hash_files
+
+log = logging.getLogger(__name__)
+
+HASH_CACHE_FILE_NAME = '.pirogue-hash-cache.json'
+
+
+def _file_key(path: Path) -> dict:
+    stat = path.stat()
+    return {'dev': stat.st_dev, 'inode': stat.st_ino, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class HashCache:
+    """
+    Digests of the files of an evidence folder, saved in a sidecar file of the folder.
+
+    A cached digest is reused as long as the device, inode, size and modification time of
+    the file did not change. The digests saved in experiment.json while the files were
+    written are also reused for the files not modified since.
+
+    With ``verify``, every file is hashed again and a warning is logged for each file whose
+    content changed although its key did not.
+    """
+    VERSION = 1
+
+    def __init__(self, folder: Path, verify: bool = False):
+        self.folder = Path(folder)
+        self.path = self.folder / HASH_CACHE_FILE_NAME
+        self.verify = verify
+        self.entries = {}
+        self.mismatches = []
+        self._load()
+        self._experiment_digests = self._load_experiment_digests()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with self.path.open('r') as f:
+                content = serializer.load(f)
+            if content.get('version') == self.VERSION:
+                self.entries = content.get('entries', {})
+        except Exception as e:
+            log.warning(f'Unable to load the hash cache {self.path}: {e}')
+
+    def _load_experiment_digests(self) -> dict:
+        experiment_path = self.folder / 'experiment.json'
+        if not experiment_path.exists():
+            return {}
+        try:
+            with experiment_path.open('r') as f:
+                digests = serializer.load(f).get('digests') or {}
+        except Exception:
+            return {}
+        written_ns = experiment_path.stat().st_mtime_ns
+        return {name: (file_digests, written_ns) for name, file_digests in digests.items()}
+
+    def _from_experiment(self, path: Path, key: dict) -> dict:
+        file_digests, written_ns = self._experiment_digests.get(path.name, (None, None))
+        if not file_digests or key['mtime_ns'] > written_ns:
+            return {}
+        # Digests of compressed files are those of the file on disk, not of its content
+        if file_digests.get('compressed'):
+            file_digests = file_digests.get('compressed')
+        if file_digests.get('size') != key['size']:
+            return {}
+        return {algorithm: file_digests.get(algorithm) for algorithm in ('sha256', 'sha512') if algorithm in file_digests}
+
+    def _cached(self, path: Path, key: dict) -> dict:
+        entry = self.entries.get(path.name)
+        if entry and entry.get('key') == key:
+            return entry.get('digests', {})
+        return self._from_experiment(path, key)
+
+    def get(self, path: Path, algorithms: Sequence[str] = DEFAULT_ALGORITHMS) -> Dict[str, str]:
+        return self.get_many([path], algorithms)[Path(path)]
+
+    def get_many(self, paths: Iterable[Path], algorithms: Sequence[str] = DEFAULT_ALGORITHMS) -> Dict[Path, Dict[str, str]]:
+        results = {}
+        keys = {}
+        to_hash = []
+        for path in paths:
+            path = Path(path)
+            keys[path] = _file_key(path)
+            cached = self._cached(path, keys[path])
+            if not self.verify and all(algorithm in cached for algorithm in algorithms):
+                results[path] = {algorithm: cached[algorithm] for algorithm in algorithms}
+            else:
+                to_hash.append(path)
+        if not to_hash:
+            return results
+        log.info(f'Hashing {len(to_hash)} files')
+        for path, digests in hash_files(to_hash, algorithms).items():
+            cached = self._cached(path, keys[path])
+            for algorithm, digest in digests.items():
+                if cached.get(algorithm) not in (None, digest):
+                    log.warning(f'The {algorithm} digest of {path.name} does not match the cached one')
+                    self.mismatches.append((path.name, algorithm))
+            entry = self.entries.get(path.name)
+            if not entry or entry.get('key') != keys[path]:
+                entry = {'key': keys[path], 'digests': {}}
+                self.entries[path.name] = entry
+            entry['digests'].update(digests)
+            results[path] = digests
+        return results
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with tmp_path.open('w', encoding='utf-8') as f:
+                serializer.dump({'version': self.VERSION, 'entries': self.entries}, f, pretty=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f'Unable to save the hash cache {self.path}: {e}')
+
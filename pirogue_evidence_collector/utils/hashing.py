@@ -0,0 +1,81 @@
+"""
+Compute several digests of files in a single pass.
+
+Files are read in large chunks, or memory mapped when they are big, and each digest is
+updated by its own thread: hashlib releases the GIL while hashing so the digests are
+computed in parallel. Several files can be hashed concurrently with hash_files().
+"""
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence
+
+DEFAULT_ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512')
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_FILE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+@contextmanager
+def _open_chunks(path: Path, size: int, chunk_size: int):
+    with path.open('rb') as fp:
+        if size < MMAP_THRESHOLD:
+            yield iter(partial(fp.read, chunk_size), b'')
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Chunks are views of the mapping, they are released before it is closed
+            view = memoryview(mapped)
+            chunks = []
+
+            def iter_views():
+                for offset in range(0, size, chunk_size):
+                    chunks.append(view[offset:offset + chunk_size])
+                    yield chunks[-1]
+
+            try:
+                yield iter_views()
+            finally:
+                for chunk in chunks:
+                    chunk.release()
+                view.release()
+
+
+def hash_file(path: Path, algorithms: Sequence[str] = DEFAULT_ALGORITHMS,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Return the hexadecimal digests of a file, by algorithm name.
+    """
+    path = Path(path)
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    size = path.stat().st_size
+    with _open_chunks(path, size, chunk_size) as chunks:
+        if len(hashes) == 1 or size <= chunk_size:
+            for chunk in chunks:
+                for h in hashes:
+                    h.update(chunk)
+        else:
+            with ThreadPoolExecutor(max_workers=len(hashes), thread_name_prefix='hash') as executor:
+                pending = []
+                for chunk in chunks:
+                    # The next chunk is read while the previous one is being hashed
+                    for future in pending:
+                        future.result()
+                    pending = [executor.submit(h.update, chunk) for h in hashes]
+                for future in pending:
+                    future.result()
+    return {algorithm: h.hexdigest() for algorithm, h in zip(algorithms, hashes)}
+
+
+def hash_files(paths: Iterable[Path], algorithms: Sequence[str] = DEFAULT_ALGORITHMS,
+               max_workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[Path, Dict[str, str]]:
+    """
+    Hash several files concurrently, at most max_workers files at a time.
+    """
+    paths = [Path(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_FILE_WORKERS, thread_name_prefix='hash-file') as executor:
+        digests = executor.map(lambda path: hash_file(path, algorithms, chunk_size), paths)
+        return dict(zip(paths, digests))
@@ -0,0 +1,52 @@
+import json
+import logging
+from typing import IO, Iterator
+
+log = logging.getLogger(__name__)
+
+_SKIPPED_CHARS = ' \t\r\n,'
+
+
+def iter_json_records(fp: IO[str], chunk_size: int = 1024 * 1024) -> Iterator:
+    """
+    Lazily yield the elements of a JSON array, or the values of a NDJSON file, without
+    loading the whole file in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = None
+    while True:
+        while pos < len(buffer) and buffer[pos] in _SKIPPED_CHARS:
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                return
+            buffer = fp.read(chunk_size)
+            pos = 0
+            eof = len(buffer) < chunk_size
+            continue
+        if in_array is None:
+            in_array = buffer[pos] == '['
+            if in_array:
+                pos += 1
+            continue
+        if in_array and buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+            # A value ending the buffer might be truncated, e.g. a number
+            if end < len(buffer) or eof:
+                yield value
+                pos = end
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                log.warning('Truncated JSON input, ignoring the last record')
+                return
+        # Incomplete value, read more data
+        chunk = fp.read(chunk_size)
+        eof = len(chunk) < chunk_size
+        buffer = buffer[pos:] + chunk
+        pos = 0
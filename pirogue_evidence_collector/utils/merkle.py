@@ -0,0 +1,93 @@
+"""
+Merkle tree of the files of an evidence folder, as defined by RFC 6962.
+
+Leaves are kept in the order files were added, so new files extend the tree without
+changing the position of the existing ones. The audit path of a leaf is enough to prove
+that a file is part of a tree whose root has been timestamped, without the other files.
+"""
+import hashlib
+from typing import List, Sequence
+
+MERKLE_ALGORITHM = 'sha512'
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def _hash(data: bytes) -> bytes:
+    return hashlib.new(MERKLE_ALGORITHM, data).digest()
+
+
+def leaf_hash(name: str, digest: bytes) -> bytes:
+    # The leaf binds the name of the file to its content
+    return _hash(LEAF_PREFIX + name.encode('utf-8') + b'\x00' + digest)
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return _hash(NODE_PREFIX + left + right)
+
+
+def _split(size: int) -> int:
+    # Largest power of 2 smaller than size
+    k = 1
+    while k << 1 < size:
+        k <<= 1
+    return k
+
+
+class MerkleTree:
+    def __init__(self, leaves: Sequence[bytes] = ()):
+        self.leaves: List[bytes] = list(leaves)
+
+    @property
+    def size(self) -> int:
+        return len(self.leaves)
+
+    def append(self, leaf: bytes):
+        self.leaves.append(leaf)
+
+    def _subtree(self, lo: int, hi: int, paths=None) -> bytes:
+        if hi - lo == 1:
+            return self.leaves[lo]
+        k = _split(hi - lo)
+        left = self._subtree(lo, lo + k, paths)
+        right = self._subtree(lo + k, hi, paths)
+        if paths is not None:
+            for i in range(lo, lo + k):
+                paths[i].append(right)
+            for i in range(lo + k, hi):
+                paths[i].append(left)
+        return node_hash(left, right)
+
+    def root(self) -> bytes:
+        if not self.leaves:
+            return _hash(b'')
+        return self._subtree(0, self.size)
+
+    def audit_paths(self) -> List[List[bytes]]:
+        """
+        Return the audit path of every leaf, from the leaf up to the root.
+        """
+        paths = [[] for _ in self.leaves]
+        if self.leaves:
+            self._subtree(0, self.size, paths)
+        return paths
+
+
+def verify_inclusion(leaf: bytes, index: int, tree_size: int, audit_path: Sequence[bytes], root: bytes) -> bool:
+    if index >= tree_size:
+        return False
+    fn, sn = index, tree_size - 1
+    r = leaf
+    for p in audit_path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            r = node_hash(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r == root
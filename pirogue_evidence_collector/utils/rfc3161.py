@@ -1,11 +1,16 @@
-import hashlib
+import logging
 import os
 import enum
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional
 
+from asn1crypto import cms, core, tsp
 from pirogue_colander_connector.collectors.ignore import ColanderIgnoreFile
 from pyasn1.codec.der import encoder
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 try:
@@ -15,6 +20,19 @@ except ImportError:
     force_use_openssl = True
 import subprocess
 
+from pirogue_evidence_collector.utils import serializer
+from pirogue_evidence_collector.utils.hash_cache import HASH_CACHE_FILE_NAME, HashCache
+from pirogue_evidence_collector.utils.hashing import hash_file
+from pirogue_evidence_collector.utils.merkle import MERKLE_ALGORITHM, MerkleTree, leaf_hash, verify_inclusion
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMESTAMP_WORKERS = 8
+DEFAULT_TIMESTAMP_TIMEOUT = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MERKLE_FILE_NAME = 'merkle.json'
+PROOF_SUFFIX = '.proof.json'
+
 
 class TimestampServer(enum.Enum):
     FREETSA = {
@@ -23,7 +41,9 @@ class TimestampServer(enum.Enum):
         'ca_url': 'https://freetsa.org/files/cacert.pem',
         'ca_name': 'freetsa.org_cacert.pem',
         'tsa_url': 'https://freetsa.org/files/tsa.crt',
-        'tsa_name': 'freetsa.org_tsa.crt'
+        'tsa_name': 'freetsa.org_tsa.crt',
+        'retries': 5,
+        'backoff': 1.0
     }
     KAKWALAB = {
         'home_url': 'https://uts-server.kakwalab.ovh/',
@@ -31,44 +51,175 @@ class TimestampServer(enum.Enum):
         'ca_url': 'https://uts-server.kakwalab.ovh/ca.pem',
         'ca_name': 'kakwalab.ovh_ca.pem',
         'tsa_url': 'https://uts-server.kakwalab.ovh/tsa_cert.pem',
-        'tsa_name': 'kakwalab.ovh_tsa_cert.pem'
+        'tsa_name': 'kakwalab.ovh_tsa_cert.pem',
+        'retries': 3,
+        'backoff': 0.5
     }
 
-    def download_ca(self, output_dir: Path):
+    def create_session(self, pool_size: int = DEFAULT_TIMESTAMP_WORKERS) -> requests.Session:
+        retry = Retry(
+            total=self.value['retries'],
+            backoff_factor=self.value['backoff'],
+            status_forcelist=RETRY_STATUSES,
+            # Sending the same timestamp query again is harmless
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def download_ca(self, output_dir: Path, session=requests):
         output_file_path = output_dir / self.value['ca_name']
         if output_file_path.exists():
             return output_file_path
-        response = requests.get(self.value['ca_url'], allow_redirects=True)
+        response = session.get(self.value['ca_url'], allow_redirects=True)
         if response.status_code == 200:
             with output_file_path.open('wb') as f:
                 f.write(response.content)
         return output_file_path
 
-    def download_tsa(self, output_dir: Path):
+    def download_tsa(self, output_dir: Path, session=requests):
         output_file_path = output_dir / self.value['tsa_name']
         if output_file_path.exists():
             return output_file_path
-        response = requests.get(self.value['tsa_url'], allow_redirects=True)
+        response = session.get(self.value['tsa_url'], allow_redirects=True)
         if response.status_code == 200:
             with output_file_path.open('wb') as f:
                 f.write(response.content)
         return output_file_path
 
 
+class TimeStampResp(core.Sequence):
+    # The token is absent from the replies rejecting the request (RFC 3161 section 2.4.2),
+    # asn1crypto does not parse them
+    _fields = [
+        ('status', tsp.PKIStatusInfo),
+        ('time_stamp_token', cms.ContentInfo, {'optional': True}),
+    ]
+
+
+def build_timestamp_query(digest: bytes, hashname: str = 'sha512') -> bytes:
+    # Same query as openssl ts -query -digest <digest> -no_nonce -cert
+    return tsp.TimeStampReq({
+        'version': 'v1',
+        'message_imprint': {
+            'hash_algorithm': {'algorithm': hashname},
+            'hashed_message': digest,
+        },
+        'cert_req': True,
+    }).dump()
+
+
+def check_timestamp_reply(content: bytes, digest: bytes, hashname: str = 'sha512'):
+    reply = TimeStampResp.load(content)
+    status = reply['status']['status'].native
+    if status not in ('granted', 'granted_with_mods'):
+        raise Exception(f'The timestamp request has been rejected by the server: {status}.')
+    token_info = reply['time_stamp_token']['content']['encap_content_info']['content'].parsed
+    message_imprint = token_info['message_imprint']
+    if (message_imprint['hash_algorithm']['algorithm'].native != hashname
+            or message_imprint['hashed_message'].native != digest):
+        raise Exception('The timestamp reply does not match the timestamp request.')
+
+
+class TimestampBatch:
+    """
+    Timestamps many files with a single pooled HTTP session.
+
+    The timestamp queries are built in-process from the SHA-512 digests of the files and
+    sent concurrently, at most max_workers at a time. The server certificates are fetched
+    once for the whole batch and the failed requests are retried with the backoff of the
+    server.
+    """
+
+    def __init__(self, output_dir: Path, server: TimestampServer = TimestampServer.FREETSA,
+                 max_workers: int = DEFAULT_TIMESTAMP_WORKERS, timeout: float = DEFAULT_TIMESTAMP_TIMEOUT):
+        self.server = server
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = server.create_session(max_workers)
+        self.ca = server.download_ca(Path(output_dir), self.session)
+        self.tsa = server.download_tsa(Path(output_dir), self.session)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def timestamp_file(self, file_path: Path, digest: str):
+        self.timestamp_digest(
+            digest,
+            file_path.with_name(file_path.name + '.tsq'),
+            file_path.with_name(file_path.name + '.tsr')
+        )
+
+    def timestamp_digest(self, digest: str, tsq_path: Path, tsr_path: Path):
+        digest = bytes.fromhex(digest)
+        query = build_timestamp_query(digest)
+        tsq_path.write_bytes(query)
+        response = self.session.post(
+            self.server.value['base_url'],
+            headers={'Content-Type': 'application/timestamp-query'},
+            data=query,
+            timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise Exception(f'Unable to send the timestamp request to the server: HTTP {response.status_code}.')
+        check_timestamp_reply(response.content, digest)
+        tsr_path.write_bytes(response.content)
+
+    def timestamp_files(self, digests: Dict[Path, str]) -> Dict[Path, Exception]:
+        """
+        Timestamp the files given with their hexadecimal SHA-512 digest, return the failures by file.
+        """
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='timestamp') as executor:
+            futures = {
+                executor.submit(self.timestamp_file, file_path, digest): file_path
+                for file_path, digest in digests.items()
+            }
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error(f'Unable to timestamp {file_path.name}: {e}')
+                    failures[file_path] = e
+        return failures
+
+
 class Timestamper:
     def __init__(self, input_path: Path):
         self.input_path = Path(input_path)
         self.colander_ignore = ColanderIgnoreFile(self.input_path)
-        for p in ['*.tsq', '*.tsr', '*.metadata.json', '*.crt', '*.pem', '*.md']:
+        for p in ['*.tsq', '*.tsr', '*.metadata.json', '*.crt', '*.pem', '*.md', HASH_CACHE_FILE_NAME, MERKLE_FILE_NAME,
+                  f'*{PROOF_SUFFIX}']:
             self.colander_ignore.add_ignored_pattern(p)
         self.colander_ignore.save_ignore_file()
 
 
 class FolderTimestamper(Timestamper):
-    def __init__(self, input_path, use_openssl=True, server: TimestampServer = TimestampServer.FREETSA):
+    def __init__(self, input_path, use_openssl=True, server: TimestampServer = TimestampServer.FREETSA,
+                 verify: bool = False, max_workers: int = DEFAULT_TIMESTAMP_WORKERS):
         super().__init__(input_path)
         self.use_openssl = use_openssl or force_use_openssl
         self.server = server
+        self.max_workers = max_workers
+        # Files already hashed, e.g. when their metadata were exported, are not hashed again unless verify is set
+        self.hash_cache = HashCache(self.input_path, verify=verify)
+
+    def _files_to_timestamp(self):
+        return [
+            file for file in self.input_path.glob('*')
+            if file.is_file() and not self._ignore_file(file.name)
+        ]
 
     def _ignore_file(self, filename):
         if filename.startswith('.'):
@@ -76,18 +227,10 @@ class FolderTimestamper(Timestamper):
         return self.colander_ignore.is_ignored(Path(filename))
 
     def _combine_timestamp(self):
-        hashes = []
         # Compute the hash of the files contained in the folder
-        for file in self.input_path.glob('*'):
-            if not file.is_file():
-                continue
-            if self._ignore_file(file.name):
-                continue
-            sha512_hash = hashlib.sha512()
-            with file.open('rb') as f:
-                for chunk in iter(lambda: f.read(4096), b''):
-                    sha512_hash.update(chunk)
-            hashes.append((file, sha512_hash.hexdigest()))
+        digests = self.hash_cache.get_many(self._files_to_timestamp(), ('sha512',))
+        self.hash_cache.save()
+        hashes = [(file, file_digests.get('sha512')) for file, file_digests in digests.items()]
 
         # Write the hashes to a file
         with open(os.path.join(self.input_path, 'hashes.txt'), 'w') as hashes_file:
@@ -108,24 +251,157 @@ class FolderTimestamper(Timestamper):
             readme_file.write('## Verification commands\n')
             readme_file.write(f'{ft.verification_commands()}\n')
 
-    def timestamp_all(self, combine=False):
-        if combine:
+    def _merkle_timestamp(self):
+        manifest_path = self.input_path / MERKLE_FILE_NAME
+        manifest = {'version': 1, 'algorithm': MERKLE_ALGORITHM, 'leaves': [], 'roots': []}
+        if manifest_path.exists():
+            with manifest_path.open('r') as f:
+                manifest = serializer.load(f)
+        known_leaves = {leaf['name']: leaf for leaf in manifest['leaves']}
+
+        # Files already in the tree are not hashed again unless their cache entry is stale
+        digests = self.hash_cache.get_many(self._files_to_timestamp(), (MERKLE_ALGORITHM,))
+        self.hash_cache.save()
+        added = 0
+        for file in sorted(digests, key=lambda f: f.name):
+            digest = digests[file][MERKLE_ALGORITHM]
+            if file.name in known_leaves:
+                if known_leaves[file.name][MERKLE_ALGORITHM] != digest:
+                    log.warning(f'{file.name} changed since it was added to the Merkle tree, it is not added again')
+                continue
+            manifest['leaves'].append({'name': file.name, MERKLE_ALGORITHM: digest})
+            added += 1
+        if not added and manifest['roots']:
+            log.info('No new file, the current Merkle root is already timestamped')
+            return
+        log.info(f'Adding {added} files to the Merkle tree')
+
+        tree = MerkleTree(
+            leaf_hash(leaf['name'], bytes.fromhex(leaf[MERKLE_ALGORITHM])) for leaf in manifest['leaves'])
+        root = tree.root().hex()
+        # Each root is stamped once, the timestamps of the previous roots remain valid
+        stamp_name = f'merkle-{tree.size:06d}'
+        with TimestampBatch(self.input_path, server=self.server) as batch:
+            batch.timestamp_digest(
+                root, self.input_path / f'{stamp_name}.tsq', self.input_path / f'{stamp_name}.tsr')
+            ca, tsa = batch.ca, batch.tsa
+        manifest['roots'].append({
+            'tree_size': tree.size,
+            'root': root,
+            'tsq': f'{stamp_name}.tsq',
+            'tsr': f'{stamp_name}.tsr',
+        })
+        with manifest_path.open('w', encoding='utf-8') as f:
+            serializer.dump(manifest, f)
+
+        # The proofs of all the files are updated to the new root, they only depend on the leaf hashes
+        for index, (leaf, audit_path) in enumerate(zip(manifest['leaves'], tree.audit_paths())):
+            proof = {
+                'version': 1,
+                'algorithm': MERKLE_ALGORITHM,
+                'file': leaf['name'],
+                MERKLE_ALGORITHM: leaf[MERKLE_ALGORITHM],
+                'leaf_index': index,
+                'tree_size': tree.size,
+                'audit_path': [node.hex() for node in audit_path],
+                'root': root,
+                'tsq': f'{stamp_name}.tsq',
+                'tsr': f'{stamp_name}.tsr',
+                'ca': ca.name,
+                'tsa': tsa.name,
+            }
+            with (self.input_path / f'{leaf["name"]}{PROOF_SUFFIX}').open('w', encoding='utf-8') as f:
+                serializer.dump(proof, f)
+
+        # Write the verification instructions to a README file
+        with open(os.path.join(self.input_path, 'README.md'), 'w') as readme_file:
+            server_home_url = self.server.value['home_url']
+            readme_file.write('# Timestamp verification instructions\n')
+            readme_file.write(
+                f"The files of this folder are the leaves of a Merkle tree described in `{MERKLE_FILE_NAME}`. "
+                f"The root of the tree has been timestamped by {server_home_url}. "
+                f"Each file comes with a `{PROOF_SUFFIX}` file proving it is part of the tree.\n\n")
+            readme_file.write('## Verification commands\n')
+            readme_file.write('Check the proof of a single file  \n```pirogue-timestamp --check-proof <file>```\n\n')
+            readme_file.write(
+                f'Verify the timestamp of the root  \n'
+                f'```openssl ts -verify -digest {root} -in {stamp_name}.tsr -CAfile {ca.name} -untrusted {tsa.name}```\n')
+
+    def timestamp_all(self, combine=False, merkle=False):
+        if merkle:
+            self._merkle_timestamp()
+        elif combine:
             self._combine_timestamp()
         else:
-            for file in self.input_path.glob('*'):
-                if not file.is_file():
-                    continue
-                if self._ignore_file(file.name):
-                    continue
-                ft = FileTimestamper(file, use_openssl=self.use_openssl, server=self.server)
-                ft.timestamp()
+            digests = self.hash_cache.get_many(self._files_to_timestamp(), ('sha512',))
+            self.hash_cache.save()
+            with TimestampBatch(self.input_path, server=self.server, max_workers=self.max_workers) as batch:
+                failures = batch.timestamp_files(
+                    {file: file_digests['sha512'] for file, file_digests in digests.items()})
+            if failures:
+                raise Exception(f'Unable to timestamp {len(failures)} of {len(digests)} files.')
+
+
+def _plain_file_name(name) -> str:
+    # The names of a proof end up on the command line of openssl, only plain file names are accepted
+    if not isinstance(name, str) or name in ('', '.', '..') or Path(name).name != name or name.startswith('-'):
+        raise ValueError(f'Invalid file name in the proof: {name!r}')
+    return name
+
+
+def _proof_file(folder: Path, name) -> Path:
+    path = folder / _plain_file_name(name)
+    if path.is_symlink() or not path.is_file():
+        raise ValueError(f'{name} is not a file of {folder}')
+    return path
+
+
+def check_inclusion_proof(file_path: Path) -> dict:
+    """
+    Check that a file is part of the timestamped Merkle tree described by its proof.
+
+    Only the file, its proof and the timestamp reply of the root are read. The signature of
+    the timestamp reply is verified by proof_verification_command().
+    """
+    file_path = Path(file_path)
+    with file_path.with_name(file_path.name + PROOF_SUFFIX).open('r') as f:
+        proof = serializer.load(f)
+    if proof['file'] != file_path.name:
+        raise Exception(f'The proof of {file_path.name} is the proof of {proof["file"]}.')
+    for key in ('tsr', 'ca', 'tsa'):
+        _proof_file(file_path.parent, proof[key])
+    digest = hash_file(file_path, (proof['algorithm'],))[proof['algorithm']]
+    if digest != proof[proof['algorithm']]:
+        raise Exception(f'The content of {file_path.name} does not match its proof.')
+    root = bytes.fromhex(proof['root'])
+    audit_path = [bytes.fromhex(node) for node in proof['audit_path']]
+    leaf = leaf_hash(proof['file'], bytes.fromhex(digest))
+    if not verify_inclusion(leaf, proof['leaf_index'], proof['tree_size'], audit_path, root):
+        raise Exception(f'{file_path.name} is not part of the Merkle tree of its proof.')
+    check_timestamp_reply(file_path.with_name(proof['tsr']).read_bytes(), root)
+    return proof
+
+
+def proof_verification_command(proof: dict) -> List[str]:
+    """
+    Return the openssl command verifying the timestamp of the root of a proof, to run without a
+    shell from the folder of the proof.
+    """
+    return [
+        'openssl', 'ts', '-verify',
+        '-digest', bytes.fromhex(proof['root']).hex(),
+        '-in', _plain_file_name(proof['tsr']),
+        '-CAfile', _plain_file_name(proof['ca']),
+        '-untrusted', _plain_file_name(proof['tsa']),
+    ]
 
 
 class FileTimestamper(Timestamper):
     def __init__(self, input_path: Path, use_openssl=True,
-                 server: TimestampServer = TimestampServer.FREETSA):
+                 server: TimestampServer = TimestampServer.FREETSA, hash_cache: Optional[HashCache] = None):
         super().__init__(input_path)
         self.file_path = Path(input_path)
+        self.hash_cache = hash_cache
         self.use_openssl = use_openssl or force_use_openssl
         self.output_dir = Path(os.path.dirname(input_path))
         self.output_tsr = self.output_dir / (self.file_path.name + '.tsr')
@@ -142,7 +418,14 @@ class FileTimestamper(Timestamper):
             hashname='sha512'
         )
 
+    def _cached_digest(self) -> Optional[str]:
+        if not self.hash_cache:
+            return None
+        return self.hash_cache.get(self.file_path, ('sha512',)).get('sha512')
+
     def _openssl_ts_request_command(self):
+        if digest := self._cached_digest():
+            return f'openssl ts -query -digest {digest} -no_nonce -sha512 -cert -out {self.output_tsq}'
         return f'openssl ts -query -data {self.file_path} -no_nonce -sha512 -cert -out {self.output_tsq}'
 
     def _send_openssl_ts_request(self):
@@ -182,7 +465,10 @@ Verify the timestamp
             subprocess.check_call(cmd, shell=True)
             self._send_openssl_ts_request()
         else:
-            with open(self.file_path, 'rb') as f:
-                tsr = self.timestamper(f.read(), return_tsr=True)
+            if digest := self._cached_digest():
+                tsr = self.timestamper(digest=bytes.fromhex(digest), return_tsr=True)
+            else:
+                with open(self.file_path, 'rb') as f:
+                    tsr = self.timestamper(f.read(), return_tsr=True)
             with open(f'{self.file_path}.tsr', 'wb') as f:
                 f.write(encoder.encode(tsr))
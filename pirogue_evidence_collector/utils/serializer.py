@@ -0,0 +1,102 @@
+"""
+JSON serialization backed by the fastest library available.
+
+orjson is used when installed, then msgspec, and the standard json module otherwise. Values
+not supported by the fast backends (e.g. integers larger than 64 bits) fall back to the
+standard json module.
+
+All the backends produce the same output: non-ASCII characters are written as UTF-8 instead
+of being escaped, and NaN and infinite floats, which are not valid JSON, are written as null.
+
+Pretty-printed output (2 spaces indentation) is the default. Compact output can be enabled
+with set_compact_output() or by setting the PIROGUE_COMPACT_JSON environment variable to 1,
+it is noticeably faster to write and smaller on disk.
+"""
+import json
+import math
+import os
+from typing import IO, Any, Optional, Union
+
+try:
+    import orjson
+    BACKEND = 'orjson'
+except ImportError:
+    orjson = None
+    try:
+        import msgspec
+        BACKEND = 'msgspec'
+    except ImportError:
+        msgspec = None
+        BACKEND = 'json'
+
+_compact_output = os.environ.get('PIROGUE_COMPACT_JSON', '0') == '1'
+
+if BACKEND == 'msgspec':
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+def set_compact_output(compact: bool = True):
+    global _compact_output
+    _compact_output = compact
+
+
+def is_compact_output() -> bool:
+    return _compact_output
+
+
+def _finite(obj: Any) -> Any:
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _stdlib_dumps(obj: Any, pretty: bool) -> str:
+    options = {'indent': 2} if pretty else {'separators': (',', ':')}
+    try:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, **options)
+    except ValueError as e:
+        if 'Out of range float' not in str(e):
+            raise
+    # Written as null like the fast backends, only done when such a value is present
+    return json.dumps(_finite(obj), ensure_ascii=False, allow_nan=False, **options)
+
+
+def dumps(obj: Any, pretty: Optional[bool] = None) -> str:
+    if pretty is None:
+        pretty = not _compact_output
+    try:
+        if BACKEND == 'orjson':
+            option = orjson.OPT_INDENT_2 if pretty else 0
+            return orjson.dumps(obj, option=option | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        if BACKEND == 'msgspec':
+            data = _msgspec_encoder.encode(obj)
+            if pretty:
+                data = msgspec.json.format(data, indent=2)
+            return data.decode('utf-8')
+    except Exception:
+        pass
+    return _stdlib_dumps(obj, pretty)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    if BACKEND == 'msgspec':
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return json.loads(data)
+
+
+def dump(obj: Any, fp: IO[str], pretty: Optional[bool] = None):
+    fp.write(dumps(obj, pretty=pretty))
+
+
+def load(fp: IO) -> Any:
+    return loads(fp.read())
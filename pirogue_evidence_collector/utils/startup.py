@@ -0,0 +1,72 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Sequence
+
+log = logging.getLogger(__name__)
+
+# Each phase waits for its dependencies in its own thread
+MAX_PHASES = 16
+DEFAULT_POLL_INTERVAL = 0.1
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float, interval: float = DEFAULT_POLL_INTERVAL) -> bool:
+    """
+    Poll the predicate until it is true or the timeout expires, return its last value.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if predicate():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+class StartupPhases:
+    """
+    Runs the phases of a startup sequence concurrently.
+
+    A phase starts as soon as the phases it runs after are done. The time at which each
+    phase started and how long it took are recorded and can be logged once all the phases
+    are done.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timings = {}
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PHASES, thread_name_prefix='startup')
+        self._start = time.perf_counter()
+
+    def run(self, name: str, func: Callable, *args, after: Sequence[Future] = ()) -> Future:
+        def phase():
+            for dependency in after:
+                if dependency is not None:
+                    dependency.result()
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.timings[name] = (start - self._start, time.perf_counter() - start)
+
+        future = self._executor.submit(phase)
+        self._futures.append(future)
+        return future
+
+    def wait(self):
+        # All the phases are done before the first failure is raised
+        try:
+            for future in self._futures:
+                future.exception()
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.log_timings()
+
+    def log_timings(self):
+        total = time.perf_counter() - self._start
+        log.info(f'{self.name} took {total:.2f} s')
+        for name, (offset, duration) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            log.info(f'  {name:<24} +{offset:6.2f} s  {duration:6.2f} s')
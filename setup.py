@@ -19,11 +19,13 @@ setup(
             "pirogue-intercept-tls = pirogue_evidence_collector.entrypoints.intercept_gated:start_interception",
             "pirogue-intercept-single = pirogue_evidence_collector.entrypoints.intercept_single:start_interception",
             "pirogue-intercept-gated = pirogue_evidence_collector.entrypoints.intercept_gated:start_interception",
+            "pirogue-intercept-pool = pirogue_evidence_collector.entrypoints.intercept_pool:main",
             "pirogue-view-tls = pirogue_evidence_collector.entrypoints.view_tls:view_decrypted_traffic",
             "pirogue-android = pirogue_evidence_collector.entrypoints.pirogue_android:main",
             "pirogue-file-drop = pirogue_evidence_collector.entrypoints.pirogue_file_drop:main",
             "pirogue-save-metadata = pirogue_evidence_collector.entrypoints.pirogue_save_metadata:main",
-            "pirogue-timestamp = pirogue_evidence_collector.entrypoints.pirogue_timestamp:main"
+            "pirogue-timestamp = pirogue_evidence_collector.entrypoints.pirogue_timestamp:main",
+            "pirogue-index = pirogue_evidence_collector.entrypoints.pirogue_index:main"
         ],
     },
     classifiers=[
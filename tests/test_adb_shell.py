@@ -0,0 +1,145 @@
+import subprocess
+import sys
+
+import pytest
+
+from pirogue_evidence_collector.android.device import AndroidDevice
+from pirogue_evidence_collector.android.shell import AdbShellSession, AdbShellSessionError
+
+# Stands in for adb, the device shell is a local shell
+FAKE_ADB = '''#!/bin/sh
+[ "$1" = "-s" ] && shift 2
+[ "$1" = "shell" ] || exit 1
+shift
+if [ $# -eq 0 ]; then
+    FAKE_ADB_SESSION=1 exec sh
+fi
+exec sh -c "$*"
+'''
+# Command hanging in the persistent session only
+HANGING_COMMAND = '''#!/bin/sh
+[ -n "$FAKE_ADB_SESSION" ] && sleep 5
+echo done
+'''
+
+
+@pytest.fixture(autouse=True)
+def fake_adb(tmp_path, monkeypatch):
+    if sys.platform == 'win32':
+        pytest.skip('The fake adb is a shell script')
+    path = tmp_path / 'bin' / 'adb'
+    path.parent.mkdir()
+    path.write_text(FAKE_ADB)
+    path.chmod(0o755)
+    hanging = path.parent / 'hang-in-session'
+    hanging.write_text(HANGING_COMMAND)
+    hanging.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{path.parent}:/usr/bin:/bin')
+    return path
+
+
+@pytest.fixture
+def session():
+    session = AdbShellSession(serial='emulator-5554', timeout=5)
+    yield session
+    session.close()
+
+
+def test_commands_share_one_shell(session):
+    assert session.run('echo first') == 'first\n'
+    pid = session.process.pid
+    assert session.run('printf "a\\nb"') == 'a\nb'
+    assert session.run('true') == ''
+    # Shell state is kept between the commands
+    session.run('VALUE=42')
+    assert session.run('echo $VALUE') == '42\n'
+    assert session.process.pid == pid
+
+
+def test_failed_command(session):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        session.run('echo partial; ls /nonexistent')
+    assert e.value.returncode != 0
+    assert e.value.output == 'partial\n'
+    assert session.run('echo alive') == 'alive\n'
+
+
+def test_output_looking_like_a_sentinel(session):
+    assert session.run('echo __pirogue_0__ 0') == '__pirogue_0__ 0\n'
+
+
+def test_commands_do_not_read_the_session_input(session):
+    assert session.run('cat') == ''
+    assert session.run('echo next') == 'next\n'
+
+
+def test_timeout_restarts_the_session(session):
+    session.run('true')
+    pid = session.process.pid
+    with pytest.raises(subprocess.TimeoutExpired):
+        session.run('sleep 5', timeout=0.2)
+    assert session.process is None
+    assert session.run('echo restarted') == 'restarted\n'
+    assert session.process.pid != pid
+
+
+def test_session_closed_by_the_device(session):
+    with pytest.raises(AdbShellSessionError):
+        session.run('kill $$')
+
+
+def test_session_without_su(fake_adb):
+    # The local shell has no su, the session cannot become root
+    session = AdbShellSession(su=True, timeout=2)
+    with pytest.raises(AdbShellSessionError):
+        session.run('id -u')
+    session.close()
+
+
+def device(timeout: float = 5) -> AndroidDevice:
+    # Not connected, only the shell commands are used
+    device = AndroidDevice.__new__(AndroidDevice)
+    device.serial = 'emulator-5554'
+    device.adb = 'adb -s emulator-5554'
+    device.requires_su = False
+    device.persistent_shell = True
+    device.shell_session = AdbShellSession(serial=device.serial, timeout=timeout)
+    return device
+
+
+def test_device_shell():
+    android = device()
+    try:
+        assert android.adb_shell('echo hello') == 'hello\n'
+        with pytest.raises(subprocess.CalledProcessError):
+            android.adb_shell('exit 1')
+    finally:
+        android.close()
+
+
+def test_device_shell_timeout_falls_back_to_a_subprocess():
+    android = device(timeout=0.5)
+    try:
+        # Only hangs in the persistent session
+        assert android.adb_shell('hang-in-session') == 'done\n'
+        assert android.persistent_shell
+        assert android.adb_shell('echo session') == 'session\n'
+    finally:
+        android.close()
+
+
+def test_device_shell_timeout_is_a_failed_command():
+    android = device(timeout=0.2)
+    try:
+        with pytest.raises(subprocess.CalledProcessError):
+            android.adb_shell('sleep 5')
+    finally:
+        android.close()
+
+
+def test_device_shell_without_session():
+    android = device()
+    android.persistent_shell = False
+    android.shell_session = None
+    assert android.adb_shell('hang-in-session') == 'done\n'
+    assert android.shell_session is None
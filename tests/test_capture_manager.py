@@ -0,0 +1,165 @@
+import pytest
+
+from pirogue_evidence_collector.frida import capture_manager
+from pirogue_evidence_collector.frida.capture_manager import CaptureManager
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('all', {'mode': 'all'}),
+    ('first-per-flow', {'mode': 'first-per-flow'}),
+    ('every-n', {'mode': 'every-n', 'n': 10}),
+    ('token-bucket', {'mode': 'token-bucket', 'rate': 5.0, 'burst': 20}),
+])
+def test_build_socket_sampling_policy(mode, expected):
+    assert CaptureManager.build_socket_sampling_policy(mode, n=10, rate=5.0, burst=20) == expected
+
+
+def test_build_socket_sampling_policy_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        CaptureManager.build_socket_sampling_policy('some')
+
+
+def test_applied_socket_sampling_is_recorded(tmp_path):
+    policy = CaptureManager.build_socket_sampling_policy('every-n', n=10)
+    manager = CaptureManager(tmp_path, socket_sampling=policy)
+    manager.captured_data = {'socket_traces': {'file': 'socket_trace.json', 'sampling': policy}}
+    manager.set_applied_socket_sampling(policy)
+    assert manager.captured_data['socket_traces']['sampling'] == policy
+    # An agent without sampling support traces every event
+    manager.set_applied_socket_sampling(None)
+    assert manager.captured_data['socket_traces']['sampling'] == {'mode': 'all'}
+
+
+def test_analysis_hints_name_the_capture_file(tmp_path):
+    manager = CaptureManager(tmp_path)
+    manager.captured_data = {
+        'network': {'file': 'traffic.pcap', 'segments': [{'file': 'traffic.pcap'}]},
+        'sslkeylog': {'file': 'sslkeylog.txt'},
+    }
+    assert manager.analysis_hints() == [
+        'View the decrypted traffic: pirogue-view-tls -r traffic.pcap -k sslkeylog.txt',
+        'Or generate a PCAPNG file: editcap --inject-secrets tls,sslkeylog.txt traffic.pcap decrypted.pcapng',
+    ]
+
+
+def test_analysis_hints_merge_the_compressed_segments(tmp_path):
+    manager = CaptureManager(tmp_path)
+    manager.captured_data = {
+        'network': {
+            'file': 'traffic-00001.pcap.zst',
+            'segments': [{'file': 'traffic-00001.pcap.zst'}, {'file': 'traffic-00002.pcap.zst'}],
+        },
+        'sslkeylog': {'file': 'sslkeylog.txt.zst'},
+    }
+    assert manager.analysis_hints() == [
+        'Decompress the files first: zstd -d traffic-*.pcap.zst sslkeylog.txt.zst',
+        'Merge the capture segments: mergecap -w traffic.pcap traffic-*.pcap',
+        'View the decrypted traffic: pirogue-view-tls -r traffic.pcap -k sslkeylog.txt',
+        'Or generate a PCAPNG file: editcap --inject-secrets tls,sslkeylog.txt traffic.pcap decrypted.pcapng',
+    ]
+
+
+class FakeTcpDump:
+    process = object()
+
+    def __init__(self):
+        self.stopped = False
+
+    def stop_capture(self):
+        self.stopped = True
+
+
+class FakeDevice:
+    def __init__(self):
+        self.calls = []
+
+    def stop_frida_server(self):
+        self.calls.append('stop_frida_server')
+
+    def close(self):
+        self.calls.append('close')
+
+
+def test_started_phases_are_stopped_when_startup_fails(tmp_path, monkeypatch):
+    manager = CaptureManager(tmp_path, record_screen=False)
+    device = FakeDevice()
+    tcp_dump = FakeTcpDump()
+
+    def start_network_capture(capture_cmd, capture_filter):
+        manager.tcp_dump = tcp_dump
+
+    def start_frida_server():
+        raise RuntimeError('frida-server did not start')
+
+    monkeypatch.setattr(manager, '_connect_device', lambda: setattr(manager, 'device', device))
+    monkeypatch.setattr(manager, 'save_device_properties', lambda: None)
+    monkeypatch.setattr(manager, 'build_capture_filter', lambda: None)
+    monkeypatch.setattr(manager, '_start_network_capture', start_network_capture)
+    monkeypatch.setattr(manager, '_start_frida_server', start_frida_server)
+    with pytest.raises(RuntimeError):
+        manager.start_capture(capture_cmd='cat capture.pcap')
+    assert tcp_dump.stopped
+    assert device.calls == ['stop_frida_server', 'close']
+    assert not manager.writer._thread.is_alive()
+    # Saving the data of the aborted capture does nothing
+    manager.stop_capture()
+    assert not (tmp_path / 'experiment.json').exists()
+
+
+class AddressesDevice:
+    def get_ip_addresses(self):
+        return ['192.168.1.23', '2001:db8::1']
+
+    def get_mac_addresses(self):
+        return ['0a:1b:2c:3d:4e:5f']
+
+
+@pytest.mark.parametrize('ethernet, expected', [
+    (True, 'host 192.168.1.23 or host 2001:db8::1 or ether host 0a:1b:2c:3d:4e:5f'),
+    (False, 'host 192.168.1.23 or host 2001:db8::1'),
+])
+def test_capture_filter_matches_the_device_addresses(tmp_path, monkeypatch, ethernet, expected):
+    monkeypatch.setattr(capture_manager, 'is_ethernet_interface', lambda interface: ethernet)
+    manager = CaptureManager(tmp_path)
+    manager.device = AddressesDevice()
+    assert manager.build_capture_filter() == expected
+    assert manager.device_mac_addresses == (['0a:1b:2c:3d:4e:5f'] if ethernet else [])
+
+
+def test_capture_filter_given_by_the_user(tmp_path):
+    manager = CaptureManager(tmp_path, bpf_filter='port 443')
+    manager.device = AddressesDevice()
+    assert manager.build_capture_filter() == 'port 443'
+
+
+class PropertiesDevice:
+    def __init__(self, api_level):
+        self.api_level = api_level
+        self.properties = {}
+
+    def get_property(self, key):
+        return self.api_level if key == 'ro.build.version.sdk' else ''
+
+    def set_property(self, key, value):
+        self.properties[key] = value
+
+    def start_frida_server(self):
+        pass
+
+    def wait_for_frida_server(self):
+        pass
+
+
+@pytest.mark.parametrize('api_level, usap_disabled', [
+    ('33\n', True),
+    ('29', True),
+    ('28', False),
+    # Missing property
+    ('', True),
+])
+def test_start_frida_server_disables_the_usap_pool(tmp_path, api_level, usap_disabled):
+    manager = CaptureManager(tmp_path)
+    manager.device = PropertiesDevice(api_level)
+    manager._start_frida_server()
+    usap_pool = manager.device.properties.get('persist.device_config.runtime_native.usap_pool_enabled')
+    assert usap_pool == ('false' if usap_disabled else None)
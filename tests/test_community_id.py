@@ -0,0 +1,36 @@
+from pirogue_evidence_collector.network.community_id import (compute_community_id, compute_community_ids,
+                                                             flow_community_id)
+
+# Example of the Community ID specification
+SPEC_FLOW = ('128.232.110.120', 34855, '66.35.250.204', 80)
+SPEC_COMMUNITY_ID = '1:LQU9qZlK+B5F3KDmev6m5PMibrg='
+
+
+def test_flow_community_id_matches_the_specification():
+    src_ip, src_port, dst_ip, dst_port = SPEC_FLOW
+    assert flow_community_id('tcp', src_ip, src_port, dst_ip, dst_port) == SPEC_COMMUNITY_ID
+    assert flow_community_id(6, src_ip, src_port, dst_ip, dst_port) == SPEC_COMMUNITY_ID
+    # Both directions of a flow share the same ID
+    assert flow_community_id('tcp6', dst_ip, dst_port, src_ip, src_port) == SPEC_COMMUNITY_ID
+
+
+def test_udp_and_tcp_flows_differ():
+    src_ip, src_port, dst_ip, dst_port = SPEC_FLOW
+    assert flow_community_id('udp', src_ip, src_port, dst_ip, dst_port) != SPEC_COMMUNITY_ID
+
+
+def test_compute_community_id_cleans_ipv4_mapped_addresses():
+    src_ip, src_port, dst_ip, dst_port = SPEC_FLOW
+    trace = {'data': {'local_ip': f'::ffff:{src_ip}', 'local_port': src_port, 'dest_ip': f'::ffff:{dst_ip}',
+                      'dest_port': dst_port, 'socket_type': 'tcp6'}}
+    flow = compute_community_id(trace)
+    assert flow['src_ip'] == src_ip
+    assert flow['dst_ip'] == dst_ip
+    assert flow['community_id'] == SPEC_COMMUNITY_ID
+
+
+def test_compute_community_ids_keeps_the_input_order():
+    flows = [('tcp',) + SPEC_FLOW, ('udp',) + SPEC_FLOW, ('tcp',) + SPEC_FLOW]
+    ids = compute_community_ids(flows)
+    assert ids[0] == ids[2] == SPEC_COMMUNITY_ID
+    assert ids[1] != SPEC_COMMUNITY_ID
@@ -0,0 +1,57 @@
+import hashlib
+
+import pytest
+
+from pirogue_evidence_collector.utils.compressed_io import (find_evidence, is_compressed, open_evidence,
+                                                            open_hashing_writer)
+
+zstandard = pytest.importorskip('zstandard')
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_text_round_trip(tmp_path, compress):
+    out, writer = open_hashing_writer(tmp_path / 'sslkeylog.txt', compress=compress)
+    with out:
+        out.write('CLIENT_RANDOM aa bb\n')
+        out.write('é\n')
+    assert writer.path.name == ('sslkeylog.txt.zst' if compress else 'sslkeylog.txt')
+    assert is_compressed(writer.path) == compress
+    assert find_evidence(tmp_path / 'sslkeylog.txt') == writer.path
+    with open_evidence(writer.path) as f:
+        assert f.read() == 'CLIENT_RANDOM aa bb\né\n'
+
+
+def test_digests_of_the_data_and_of_the_stored_stream(tmp_path):
+    data = b'\x00\x01' * 100000
+    out, writer = open_hashing_writer(tmp_path / 'traffic.pcap', compress=True, text=False)
+    with out:
+        out.write(data)
+    digests = writer.digests()
+    stored = writer.path.read_bytes()
+    assert digests['sha256'] == hashlib.sha256(data).hexdigest()
+    assert digests['sha512'] == hashlib.sha512(data).hexdigest()
+    assert digests['size'] == len(data)
+    assert digests['compression'] == 'zstd'
+    assert digests['compressed']['sha256'] == hashlib.sha256(stored).hexdigest()
+    assert digests['compressed']['size'] == len(stored) < len(data)
+
+
+def test_flushed_data_can_be_read_before_close(tmp_path):
+    out, writer = open_hashing_writer(tmp_path / 'traffic.pcap', compress=True, text=False)
+    out.write(b'first')
+    out.flush()
+    writer.flush()
+    with open_evidence(writer.path, 'rb') as f:
+        assert f.read() == b'first'
+    out.write(b'second')
+    out.close()
+    with open_evidence(writer.path, 'rb') as f:
+        assert f.read() == b'firstsecond'
+
+
+def test_multiple_frames_are_read(tmp_path):
+    path = tmp_path / 'traffic.pcap.zst'
+    compressor = zstandard.ZstdCompressor()
+    path.write_bytes(compressor.compress(b'one') + compressor.compress(b'two'))
+    with open_evidence(path, 'rb') as f:
+        assert f.read() == b'onetwo'
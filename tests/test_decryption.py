@@ -0,0 +1,141 @@
+import shutil
+import struct
+import subprocess
+import sys
+
+import pytest
+
+from pirogue_evidence_collector.entrypoints import view_tls
+from pirogue_evidence_collector.network.decryption import HTTP_DISPLAY_FILTER, TsharkDecoder
+
+PCAP = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 101)
+
+# Stands in for tshark, prints the capture and key log it was given as EK records
+FAKE_TSHARK = f'''#!{sys.executable}
+import json, os, stat, sys
+args = sys.argv[1:]
+capture = args[args.index('-r') + 1]
+keylog = [arg.split(':', 1)[1] for arg in args if arg.startswith('tls.keylog_file:')]
+assert '-2' in args and stat.S_ISREG(os.stat(capture).st_mode)
+print(json.dumps({{'index': {{}}}}))
+print(json.dumps({{'timestamp': '0', 'layers': {{
+    'capture': open(capture, 'rb').read().hex(),
+    'keylog': open(keylog[0]).read() if keylog else None,
+}}}}))
+'''
+
+
+@pytest.fixture
+def compressed_capture(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    compressor = zstandard.ZstdCompressor()
+    (tmp_path / 'traffic.pcap.zst').write_bytes(compressor.compress(PCAP))
+    (tmp_path / 'sslkeylog.txt.zst').write_bytes(compressor.compress(b'CLIENT_RANDOM aa bb\n'))
+    return tmp_path / 'traffic.pcap.zst', tmp_path / 'sslkeylog.txt.zst'
+
+
+@pytest.fixture
+def fake_tshark(tmp_path):
+    path = tmp_path / 'tshark'
+    path.write_text(FAKE_TSHARK)
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_command(tmp_path):
+    decoder = TsharkDecoder(tmp_path / 'traffic.pcap', tmp_path / 'sslkeylog.txt', tshark_path='/usr/bin/tshark')
+    assert decoder.command() == [
+        '/usr/bin/tshark', '-2', '-T', 'ek', '--enable-protocol', 'communityid', '-Ndmn',
+        '-r', str(tmp_path / 'traffic.pcap'),
+        '-o', f'tls.keylog_file:{tmp_path / "sslkeylog.txt"}',
+        '-Y', HTTP_DISPLAY_FILTER,
+    ]
+
+
+def test_command_without_keylog_nor_filter(tmp_path):
+    cmd = TsharkDecoder(tmp_path / 'traffic.pcap', display_filter=None).command()
+    assert cmd[-2:] == ['-r', str(tmp_path / 'traffic.pcap')]
+    assert '-o' not in cmd and '-Y' not in cmd
+
+
+def test_keylog_path_is_passed_as_is(tmp_path):
+    keylog_path = tmp_path / 'keys with spaces.txt'
+    keylog_path.write_text('CLIENT_RANDOM aa bb\n')
+    (tmp_path / 'traffic.pcap').write_bytes(PCAP)
+    decoder = TsharkDecoder(tmp_path / 'traffic.pcap', str(keylog_path))
+    decoder.decompress_inputs()
+    # An uncompressed key log is given to tshark directly, in a single argument
+    assert f'tls.keylog_file:{keylog_path}' in decoder.command()
+    assert decoder._keylog_file is None
+
+
+def test_missing_tshark_is_reported(tmp_path):
+    (tmp_path / 'traffic.pcap').write_bytes(PCAP)
+    decoder = TsharkDecoder(tmp_path / 'traffic.pcap', tshark_path=str(tmp_path / 'missing-tshark'))
+    with pytest.raises(FileNotFoundError, match='not installed'):
+        decoder.check_inputs()
+    with pytest.raises(FileNotFoundError):
+        list(decoder.iter_lines())
+    assert decoder.process is None
+
+
+def test_missing_capture_is_reported(tmp_path, fake_tshark):
+    decoder = TsharkDecoder(tmp_path / 'traffic.pcap', tshark_path=fake_tshark)
+    with pytest.raises(FileNotFoundError, match='does not exist'):
+        decoder.check_inputs()
+
+
+def test_view_tls_without_tshark(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'traffic.pcap').write_bytes(PCAP)
+    monkeypatch.setenv('PATH', str(tmp_path / 'bin'))
+    monkeypatch.setattr(sys, 'argv', ['pirogue-view-tls', '-r', str(tmp_path / 'traffic.pcap')])
+    view_tls.view_decrypted_traffic()
+    assert 'tshark is not installed' in capsys.readouterr().out
+
+
+def test_compressed_inputs_are_decompressed_to_files(compressed_capture):
+    pcap_path, keylog_path = compressed_capture
+    decoder = TsharkDecoder(pcap_path, keylog_path)
+    decoder.decompress_inputs()
+    cmd = decoder.command()
+    # tshark cannot run the two-pass analysis on a pipe
+    assert '-2' in cmd
+    capture = cmd[cmd.index('-r') + 1]
+    assert capture != '-'
+    with open(capture, 'rb') as f:
+        assert f.read() == PCAP
+    assert f'tls.keylog_file:{decoder._keylog_file.name}' in cmd
+    decoder.close()
+    assert not decoder._capture_file and not decoder._keylog_file
+    with pytest.raises(FileNotFoundError):
+        open(capture, 'rb')
+
+
+def test_uncompressed_capture_is_read_directly(tmp_path):
+    (tmp_path / 'traffic.pcap').write_bytes(PCAP)
+    decoder = TsharkDecoder(tmp_path / 'traffic.pcap')
+    decoder.decompress_inputs()
+    cmd = decoder.command()
+    assert cmd[cmd.index('-r') + 1] == str(tmp_path / 'traffic.pcap')
+
+
+def test_decode_compressed_capture(compressed_capture, fake_tshark):
+    pcap_path, keylog_path = compressed_capture
+    decoder = TsharkDecoder(pcap_path, keylog_path, tshark_path=fake_tshark)
+    packet, = decoder.iter_packets()
+    assert packet['layers'] == {'capture': PCAP.hex(), 'keylog': 'CLIENT_RANDOM aa bb\n'}
+    assert decoder._capture_file is None
+
+
+def test_tshark_failure_is_raised(compressed_capture, tmp_path):
+    failing = tmp_path / 'failing-tshark'
+    failing.write_text('#!/bin/sh\nexit 2\n')
+    failing.chmod(0o755)
+    decoder = TsharkDecoder(compressed_capture[0], tshark_path=str(failing))
+    with pytest.raises(subprocess.CalledProcessError):
+        list(decoder.iter_packets())
+
+
+@pytest.mark.skipif(shutil.which('tshark') is None, reason='tshark is not installed')
+def test_tshark_reads_compressed_capture(compressed_capture):
+    assert list(TsharkDecoder(compressed_capture[0], display_filter=None).iter_packets()) == []
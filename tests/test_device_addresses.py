@@ -0,0 +1,38 @@
+from pirogue_evidence_collector.android.device import parse_ip_addresses, parse_mac_addresses
+
+IP_ADDR_SHOW = '''\
+1: lo    inet 127.0.0.1/8 scope host lo\\       valid_lft forever preferred_lft forever
+1: lo    inet6 ::1/128 scope host \\       valid_lft forever preferred_lft forever
+3: wlan0    inet 192.168.1.23/24 brd 192.168.1.255 scope global wlan0\\       valid_lft forever preferred_lft forever
+3: wlan0    inet6 2001:db8::1c2d:3e4f/64 scope global dynamic mngtmpaddr \\       valid_lft 86390sec preferred_lft 14390sec
+3: wlan0    inet6 2001:db8::aaaa:bbbb/64 scope global temporary dynamic \\       valid_lft 86390sec preferred_lft 14390sec
+3: wlan0    inet6 fe80::1c2d:3e4f/64 scope link \\       valid_lft forever preferred_lft forever
+5: rmnet_data0    inet 169.254.3.4/16 scope link rmnet_data0\\       valid_lft forever preferred_lft forever
+5: rmnet_data0    inet 100.64.0.7/30 scope global rmnet_data0\\       valid_lft forever preferred_lft forever
+6: wlan1    inet 192.168.1.23/24 scope global wlan1\\       valid_lft forever preferred_lft forever
+'''
+
+IP_LINK_SHOW = '''\
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN mode DEFAULT group default qlen 1000\\    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
+3: wlan0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP mode DORMANT group default qlen 3000\\    link/ether 0A:1B:2C:3D:4E:5F brd ff:ff:ff:ff:ff:ff
+4: p2p0: <BROADCAST,MULTICAST> mtu 1500 qdisc noop state DOWN mode DEFAULT group default qlen 3000\\    link/ether 0e:1b:2c:3d:4e:5f brd ff:ff:ff:ff:ff:ff
+5: rmnet_data0: <UP,LOWER_UP> mtu 1500 qdisc mq state UNKNOWN mode DEFAULT group default qlen 1000\\    link/[530]
+7: wlan1: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP mode DEFAULT group default qlen 3000\\    link/ether 02:00:00:00:00:00 brd ff:ff:ff:ff:ff:ff
+'''
+
+
+def test_parse_ip_addresses():
+    # Loopback and link-local addresses are excluded, IPv6 privacy addresses are kept
+    assert parse_ip_addresses(IP_ADDR_SHOW) == [
+        '192.168.1.23', '2001:db8::1c2d:3e4f', '2001:db8::aaaa:bbbb', '100.64.0.7']
+
+
+def test_parse_ip_addresses_ignores_unexpected_lines():
+    assert parse_ip_addresses('') == []
+    assert parse_ip_addresses('3: wlan0    inet not-an-address scope global\nerror: permission denied') == []
+
+
+def test_parse_mac_addresses():
+    # Interfaces down, without Ethernet header or with a hidden address are excluded
+    assert parse_mac_addresses(IP_LINK_SHOW) == ['0a:1b:2c:3d:4e:5f']
+    assert parse_mac_addresses('') == []
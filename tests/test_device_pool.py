@@ -0,0 +1,154 @@
+import os
+import signal
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import pytest
+
+from pirogue_evidence_collector.frida import device_pool
+from pirogue_evidence_collector.frida.device_pool import (
+    DevicePool,
+    _directory_size,
+    _tree_cpu_seconds,
+)
+from pirogue_evidence_collector.utils import serializer
+
+# Stands in for an interception entrypoint, records the signals it receives in the output directory
+FAKE_CAPTURE = textwrap.dedent('''
+    import os
+    import signal
+    import sys
+    import time
+
+    output_dir = sys.argv[sys.argv.index('-o') + 1]
+    behavior = os.environ.get('FAKE_CAPTURE_BEHAVIOR', 'save')
+
+    def record(name):
+        with open(os.path.join(output_dir, 'signals'), 'a') as f:
+            f.write(name + '\\n')
+
+    def on_interrupt(signum, frame):
+        record('SIGINT')
+        if behavior == 'save':
+            time.sleep(0.2)
+            sys.exit(0)
+
+    def on_terminate(signum, frame):
+        record('SIGTERM')
+        if behavior != 'stubborn':
+            sys.exit(1)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    signal.signal(signal.SIGTERM, on_terminate)
+    open(os.path.join(output_dir, 'ready'), 'w').close()
+    while True:
+        time.sleep(0.05)
+''')
+
+
+@pytest.fixture
+def fake_capture(tmp_path, monkeypatch):
+    module_dir = tmp_path / 'modules'
+    module_dir.mkdir()
+    (module_dir / 'fake_capture.py').write_text(FAKE_CAPTURE)
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([str(module_dir), *sys.path]))
+    monkeypatch.setitem(device_pool.POOL_MODES, 'fake', 'fake_capture')
+
+
+def _start_pool(tmp_path, serials):
+    pool = DevicePool(tmp_path / 'out', serials=serials, mode='fake', report_interval=0.1)
+    pool.start()
+    deadline = time.monotonic() + 10
+    while not all((capture.output_dir / 'ready').exists() for capture in pool.captures):
+        assert time.monotonic() < deadline, 'the fake captures did not start'
+        time.sleep(0.02)
+    return pool
+
+
+def _signals(capture):
+    path = capture.output_dir / 'signals'
+    return path.read_text().split() if path.exists() else []
+
+
+def test_build_command_with_interface_and_filter(tmp_path):
+    pool = DevicePool(tmp_path, mode='single', ifaces={'A': 'wlan1'},
+                      bpf_filters={'A': 'host 10.0.0.2'}, extra_args=['-d'])
+    command = pool._build_command('A', tmp_path / 'A')
+    assert command == [
+        sys.executable, '-m', 'pirogue_evidence_collector.entrypoints.intercept_single',
+        '-o', str(tmp_path / 'A'), '-D', 'A', '-i', 'wlan1', '--bpf-filter', 'host 10.0.0.2', '-d',
+    ]
+    assert pool._build_command('B', tmp_path / 'B')[-3:] == ['-D', 'B', '-d']
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DevicePool(tmp_path, mode='unknown')
+
+
+def test_stop_interrupts_each_capture_once(tmp_path, fake_capture):
+    pool = _start_pool(tmp_path, ['A', 'B'])
+    pool.stop()
+    pool.stop()
+    for capture in pool.captures:
+        assert capture.process.returncode == 0
+        assert _signals(capture) == ['SIGINT']
+
+
+def test_interrupted_run_does_not_interrupt_the_captures_again(tmp_path, fake_capture, monkeypatch):
+    pool = _start_pool(tmp_path, ['A', 'B'])
+    monkeypatch.setattr(pool, 'start', lambda: None)
+
+    def interrupt():
+        # Ctrl-C in the terminal reaches the whole process group
+        for capture in pool.captures:
+            capture.process.send_signal(signal.SIGINT)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pool, 'report', interrupt)
+    pool.run()
+    for capture in pool.captures:
+        assert capture.process.returncode == 0
+        assert _signals(capture) == ['SIGINT']
+    report = serializer.loads((tmp_path / 'out' / device_pool.POOL_FILE_NAME).read_bytes())
+    assert report['mode'] == 'fake'
+    assert [device['serial'] for device in report['devices']] == ['A', 'B']
+    assert all(device['returncode'] == 0 for device in report['devices'])
+
+
+def test_stop_terminates_a_capture_ignoring_the_interruption(tmp_path, fake_capture, monkeypatch):
+    monkeypatch.setenv('FAKE_CAPTURE_BEHAVIOR', 'hang')
+    monkeypatch.setattr(device_pool, 'STOP_TIMEOUT', 0.5)
+    pool = _start_pool(tmp_path, ['A'])
+    pool.stop()
+    capture = pool.captures[0]
+    assert capture.process.returncode == 1
+    assert _signals(capture) == ['SIGINT', 'SIGTERM']
+
+
+def test_stop_kills_a_capture_ignoring_the_termination(tmp_path, fake_capture, monkeypatch):
+    monkeypatch.setenv('FAKE_CAPTURE_BEHAVIOR', 'stubborn')
+    monkeypatch.setattr(device_pool, 'STOP_TIMEOUT', 0.5)
+    monkeypatch.setattr(device_pool, 'TERMINATE_TIMEOUT', 0.5)
+    pool = _start_pool(tmp_path, ['A'])
+    pool.stop()
+    capture = pool.captures[0]
+    assert capture.process.returncode == -signal.SIGKILL
+    assert _signals(capture) == ['SIGINT', 'SIGTERM']
+
+
+def test_tree_cpu_seconds_includes_the_descendants():
+    stats = {10: (1, 1.0), 11: (10, 2.0), 12: (11, 0.5), 20: (1, 4.0)}
+    assert _tree_cpu_seconds(10, stats) == 3.5
+    assert _tree_cpu_seconds(20, stats) == 4.0
+    assert _tree_cpu_seconds(30, stats) == 0.0
+
+
+def test_directory_size_is_recursive(tmp_path):
+    (tmp_path / 'a').write_bytes(b'x' * 10)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b').write_bytes(b'y' * 5)
+    (tmp_path / 'link').symlink_to(tmp_path / 'a')
+    assert _directory_size(Path(tmp_path)) == 15
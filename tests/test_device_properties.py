@@ -0,0 +1,106 @@
+import threading
+import time
+
+from pirogue_evidence_collector.android.properties import DevicePropertiesCache, parse_getprop
+
+GETPROP = '''[ro.build.version.sdk]: [33]
+[ro.product.model]: [Pixel 7]
+[empty.value]: []
+[persist.sys.multiline]: [first line
+second line]
+[ro.with.brackets]: [a [b] c]
+'''
+
+
+def test_parse_getprop():
+    assert parse_getprop(GETPROP) == {
+        'ro.build.version.sdk': '33',
+        'ro.product.model': 'Pixel 7',
+        'empty.value': '',
+        'persist.sys.multiline': 'first line\nsecond line',
+        'ro.with.brackets': 'a [b] c',
+    }
+
+
+def test_parse_empty_getprop():
+    assert parse_getprop('') == {}
+
+
+def test_snapshot_is_reused_until_invalidated():
+    cache = DevicePropertiesCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'count': str(len(calls))}
+
+    assert cache.get('a', fetch) == {'count': '1'}
+    assert cache.get('a', fetch) == {'count': '1'}
+    assert cache.get('b', fetch) == {'count': '2'}
+    cache.invalidate('a')
+    assert cache.get('a', fetch) == {'count': '3'}
+    cache.clear()
+    assert cache.get('b', fetch) == {'count': '4'}
+
+
+def test_snapshot_expires():
+    cache = DevicePropertiesCache(ttl=0)
+    values = iter(['1', '2'])
+    assert cache.get(None, lambda: {'v': next(values)}) == {'v': '1'}
+    assert cache.get(None, lambda: {'v': next(values)}) == {'v': '2'}
+
+
+def test_devices_are_fetched_concurrently():
+    cache = DevicePropertiesCache()
+    slow_started = threading.Event()
+    release = threading.Event()
+
+    def slow_fetch():
+        slow_started.set()
+        release.wait(5)
+        return {'device': 'slow'}
+
+    thread = threading.Thread(target=cache.get, args=('slow', slow_fetch))
+    thread.start()
+    assert slow_started.wait(5)
+    # Not blocked by the fetch of the other device
+    started = time.monotonic()
+    assert cache.get('fast', lambda: {'device': 'fast'}) == {'device': 'fast'}
+    assert time.monotonic() - started < 1
+    release.set()
+    thread.join(5)
+    assert cache.get('slow', lambda: {}) == {'device': 'slow'}
+
+
+def test_concurrent_lookups_share_a_fetch():
+    cache = DevicePropertiesCache()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'v': '1'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a', fetch))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [{'v': '1'}] * 4
+    assert len(calls) == 1
+
+
+def test_invalidation_during_a_fetch():
+    cache = DevicePropertiesCache()
+
+    def fetch():
+        # A property is set while getprop is running
+        cache.invalidate('a')
+        return {'v': 'old'}
+
+    assert cache.get('a', fetch) == {'v': 'old'}
+    assert cache.get('a', lambda: {'v': 'new'}) == {'v': 'new'}
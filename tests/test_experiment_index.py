@@ -0,0 +1,144 @@
+import json
+import sqlite3
+
+from pirogue_evidence_collector.index import experiment_index
+from pirogue_evidence_collector.index.experiment_index import SCHEMA_VERSION, ExperimentIndex
+
+
+def _trace(port, **data):
+    trace_data = {'local_ip': '10.0.0.2', 'local_port': port, 'dest_ip': '1.1.1.1', 'dest_port': 443,
+                  'socket_type': 'tcp', 'socket_event_type': 'connect', 'thread_id': 1}
+    trace_data.update(data)
+    return {'type': 'socket_traces', 'pid': 42, 'process': 'com.example', 'timestamp': port, 'data': trace_data}
+
+
+def _write_ndjson(path, records, mode='w'):
+    with path.open(mode) as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def _ports(index):
+    return sorted(row['local_port'] for row in index.query('SELECT local_port FROM socket_traces'))
+
+
+def test_staging_file_is_ingested_incrementally(tmp_path):
+    staging = tmp_path / 'socket_trace.ndjson'
+    _write_ndjson(staging, [_trace(1000), _trace(1001)])
+    with ExperimentIndex(tmp_path) as index:
+        assert index.update()['socket_traces'] == 2
+        _write_ndjson(staging, [_trace(1002)], mode='a')
+        assert index.update()['socket_traces'] == 1
+        assert index.update()['socket_traces'] == 0
+        assert _ports(index) == [1000, 1001, 1002]
+
+
+def test_ingested_records_are_not_parsed_again(tmp_path, monkeypatch):
+    staging = tmp_path / 'socket_trace.ndjson'
+    _write_ndjson(staging, [_trace(port) for port in range(1000, 1100)])
+    parsed = []
+    loads = experiment_index.serializer.loads
+
+    def counting_loads(data):
+        parsed.append(data)
+        return loads(data)
+
+    with ExperimentIndex(tmp_path) as index:
+        index.update()
+        monkeypatch.setattr(experiment_index.serializer, 'loads', counting_loads)
+        _write_ndjson(staging, [_trace(2000)], mode='a')
+        assert index.update()['socket_traces'] == 1
+        assert len(parsed) == 1
+        assert index.update()['socket_traces'] == 0
+        assert len(parsed) == 1
+        assert len(_ports(index)) == 101
+
+
+def test_unchanged_final_file_is_not_parsed_again(tmp_path, monkeypatch):
+    (tmp_path / 'socket_trace.json').write_text(json.dumps([_trace(1000), _trace(1001)]))
+    with ExperimentIndex(tmp_path) as index:
+        assert index.update()['socket_traces'] == 2
+        monkeypatch.setattr(experiment_index, 'iter_json_records', None)
+        assert index.update()['socket_traces'] == 0
+        assert _ports(index) == [1000, 1001]
+
+
+def test_rewritten_large_file_is_indexed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(experiment_index, 'FINGERPRINT_BLOCK_SIZE', 256)
+    staging = tmp_path / 'socket_trace.ndjson'
+    records = [_trace(port) for port in range(1000, 1100)]
+    _write_ndjson(staging, records)
+    with ExperimentIndex(tmp_path) as index:
+        index.update()
+        # Only the end of the data already ingested differs
+        records[-1] = _trace(1200)
+        _write_ndjson(staging, records + [_trace(1300)])
+        assert index.update()['socket_traces'] == 101
+        assert _ports(index)[-3:] == [1098, 1200, 1300]
+
+
+def test_rewritten_file_of_the_same_size_is_indexed_again(tmp_path):
+    staging = tmp_path / 'socket_trace.ndjson'
+    _write_ndjson(staging, [_trace(1000), _trace(1001)])
+    with ExperimentIndex(tmp_path) as index:
+        index.update()
+        size = staging.stat().st_size
+        _write_ndjson(staging, [_trace(2000), _trace(2001)])
+        assert staging.stat().st_size == size
+        assert index.update()['socket_traces'] == 2
+        assert _ports(index) == [2000, 2001]
+
+
+def test_final_file_replacing_the_staging_file_is_indexed_again(tmp_path):
+    _write_ndjson(tmp_path / 'socket_trace.ndjson', [_trace(1000), _trace(1001)])
+    with ExperimentIndex(tmp_path) as index:
+        index.update()
+        (tmp_path / 'socket_trace.ndjson').unlink()
+        # The final file does not have to keep the order of the staging file
+        (tmp_path / 'socket_trace.json').write_text(json.dumps([_trace(1002), _trace(1001), _trace(1000)]))
+        assert index.update()['socket_traces'] == 3
+        assert _ports(index) == [1000, 1001, 1002]
+
+
+def test_partial_last_line_is_ingested_once_complete(tmp_path):
+    keylog = tmp_path / 'sslkeylog.txt'
+    keylog.write_text('CLIENT_RANDOM 00 11\nCLIENT_RANDOM 22')
+    with ExperimentIndex(tmp_path) as index:
+        assert index.update()['sslkeylog'] == 1
+        with keylog.open('a') as f:
+            f.write(' 33\n')
+        assert index.update()['sslkeylog'] == 1
+        assert [row['secret'] for row in index.query('SELECT secret FROM sslkeylog ORDER BY id')] == ['11', '33']
+
+
+def test_stacks_and_dynamic_hooks(tmp_path):
+    (tmp_path / 'stacks.json').write_text(json.dumps({
+        's1': [{'class': 'okhttp3.Call'}],
+        's2': ['d.E.f(E.java:2)'],
+    }))
+    (tmp_path / 'socket_trace.json').write_text(json.dumps([_trace(1000, stack_id='s1')]))
+    (tmp_path / 'dynamic_hook.json').write_text(json.dumps([
+        {'pid': 42, 'process': 'com.example', 'data': {'taxonomy_id': 'T1', 'stacktrace': ['a.B.c(B.java:1)']}},
+        {'pid': 42, 'process': 'com.example', 'data': {'taxonomy_id': 'T2', 'stacktrace_id': 's2'}},
+    ]))
+    with ExperimentIndex(tmp_path) as index:
+        index.update()
+        hooks = index.query('SELECT taxonomy_id, stacktrace_id, stacktrace FROM dynamic_hook_stacktraces ORDER BY id')
+        assert [hook['taxonomy_id'] for hook in hooks] == ['T1', 'T2']
+        assert json.loads(hooks[0]['stacktrace']) == ['a.B.c(B.java:1)']
+        assert hooks[1]['stacktrace_id'] == 's2'
+        assert json.loads(hooks[1]['stacktrace']) == ['d.E.f(E.java:2)']
+        community_id = index.query('SELECT community_id FROM socket_traces')[0]['community_id']
+        assert index.stack_index().get(community_id)['stack'] == ['okhttp3.Call']
+
+
+def test_index_of_another_schema_version_is_rebuilt(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'experiment.sqlite')
+    connection.execute('CREATE TABLE ingest_state (file TEXT PRIMARY KEY, source TEXT, records INTEGER, size INTEGER)')
+    connection.execute('CREATE VIEW dynamic_hook_stacktraces AS SELECT file FROM ingest_state')
+    connection.commit()
+    connection.close()
+    _write_ndjson(tmp_path / 'socket_trace.ndjson', [_trace(1000)])
+    with ExperimentIndex(tmp_path) as index:
+        assert index.update()['socket_traces'] == 1
+        assert index.query('PRAGMA user_version')[0][0] == SCHEMA_VERSION
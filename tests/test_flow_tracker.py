@@ -0,0 +1,175 @@
+import socket
+import struct
+
+from pirogue_evidence_collector.network import flow_tracker
+from pirogue_evidence_collector.network.community_id import flow_community_id
+from pirogue_evidence_collector.network.flow_tracker import (LINKTYPE_ETHERNET, LINKTYPE_RAW, TCP, TCP_ACK, TCP_FIN,
+                                                             TCP_SYN, UDP, FlowTracker, parse_dns, parse_packet)
+from pirogue_evidence_collector.utils import serializer
+
+PHONE = '10.0.0.2'
+SERVER = '93.184.216.34'
+
+
+def tcp(flags: int = TCP_ACK, payload: bytes = b'') -> bytes:
+    return struct.pack('!HHIIBBHHH', 40000, 443, 0, 0, 5 << 4, flags, 0, 0, 0) + payload
+
+
+def ipv4(proto: int, transport: bytes, src: str = PHONE, dst: str = SERVER) -> bytes:
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(transport), 0, 0, 64, proto, 0,
+                       socket.inet_aton(src), socket.inet_aton(dst)) + transport
+
+
+def ipv6(next_header: int, payload: bytes, src: str = 'fe80::1', dst: str = 'fe80::2') -> bytes:
+    return struct.pack('!IHBB16s16s', 6 << 28, len(payload), next_header, 64,
+                       socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst)) + payload
+
+
+def trace(src_port: int = 40000) -> dict:
+    return {
+        'pid': 1234,
+        'process': 'com.example',
+        'data': {'socket_type': 'tcp', 'local_ip': PHONE, 'local_port': src_port,
+                 'dest_ip': SERVER, 'dest_port': 443},
+    }
+
+
+def test_parse_ipv4_tcp():
+    packet = ipv4(TCP, tcp(TCP_SYN, b'data'))
+    proto, src_ip, src_port, dst_ip, dst_port, flags, payload_offset = parse_packet(LINKTYPE_RAW, packet)
+    assert (proto, src_port, dst_port, flags) == (TCP, 40000, 443, TCP_SYN)
+    assert (src_ip, dst_ip) == (socket.inet_aton(PHONE), socket.inet_aton(SERVER))
+    assert packet[payload_offset:] == b'data'
+
+
+def test_parse_ethernet_vlan():
+    frame = bytes(12) + struct.pack('!HHH', 0x8100, 1, 0x0800) + ipv4(TCP, tcp())
+    assert parse_packet(LINKTYPE_ETHERNET, frame)[:1] == (TCP,)
+
+
+def test_parse_ipv6_extension_headers():
+    udp = struct.pack('!HHHH', 5353, 53, 8, 0)
+    hop_by_hop = bytes([60, 0]) + bytes(6)
+    destination = bytes([44, 1]) + bytes(14)
+    fragment = bytes([UDP, 0]) + struct.pack('!HI', 0, 1)
+    packet = ipv6(0, hop_by_hop + destination + fragment + udp)
+    proto, _, src_port, _, dst_port, _, payload_offset = parse_packet(LINKTYPE_RAW, packet)
+    assert (proto, src_port, dst_port, payload_offset) == (UDP, 5353, 53, len(packet))
+    # Fragments other than the first one do not have the transport header
+    fragment = bytes([UDP, 0]) + struct.pack('!HI', 8 << 3, 1)
+    assert parse_packet(LINKTYPE_RAW, ipv6(44, fragment + udp)) is None
+
+
+def test_parse_dns_answer():
+    question = b'\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+    answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 60, 4) + socket.inet_aton(SERVER)
+    message = struct.pack('!HHHHHH', 1, 0x8180, 1, 1, 0, 0) + question + answer
+    assert parse_dns(message, 0) == ('example.com', [socket.inet_aton(SERVER)])
+
+
+def test_both_directions_share_a_flow(tmp_path):
+    tracker = FlowTracker(tmp_path)
+    tracker.process_packets([(1.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    reply = ipv4(TCP, struct.pack('!HH', 443, 40000) + tcp()[4:], src=SERVER, dst=PHONE)
+    tracker.process_packets([(2.0, LINKTYPE_RAW, reply)])
+    flow, = tracker.flows()
+    assert flow['community_id'] == flow_community_id(TCP, PHONE, 40000, SERVER, 443)
+    assert (flow['packets'], flow['first_seen'], flow['last_seen']) == (2, 1.0, 2.0)
+
+
+def test_reused_5_tuple_starts_a_new_flow(tmp_path):
+    tracker = FlowTracker(tmp_path, idle_timeout=60)
+    tracker.process_packets([(1.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    tracker.process_packets([(2.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_FIN | TCP_ACK)))])
+    # Retransmitted SYN of the same connection, then a new connection on the same ports
+    tracker.process_packets([(3.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_ACK)))])
+    tracker.process_packets([(4.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    # Same 5-tuple after being idle
+    tracker.process_packets([(100.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_ACK)))])
+    assert [flow['packets'] for flow in tracker.flows()] == [3, 1, 1]
+
+
+def test_idle_flows_are_evicted_and_saved(tmp_path):
+    tracker = FlowTracker(tmp_path, idle_timeout=60)
+    tracker.start()
+    tracker.process_packets([(1.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    tracker.process_packets([(2.0, LINKTYPE_RAW, ipv4(UDP, struct.pack('!HHHH', 5000, 5001, 8, 0)))])
+    tracker.attribute(trace())
+    tracker._attribute_traces()
+    tracker.process_packets([(100.0, LINKTYPE_RAW, ipv4(UDP, struct.pack('!HHHH', 5000, 5001, 8, 0)))])
+    tracker._evict_idle_flows()
+    # The TCP flow and the first UDP flow have been moved out of the table
+    assert [flow['proto'] for flow in tracker.flows()] == ['udp']
+    assert len(tracker) == 3
+    assert tracker.staging_path.exists()
+    tracker.stop()
+    assert not tracker.staging_path.exists()
+    with tracker.output_path.open(encoding='utf-8') as f:
+        saved = serializer.load(f)
+    assert [(flow['proto'], flow['process']) for flow in saved['flows']] == [
+        ('tcp', 'com.example'), ('udp', None), ('udp', None)]
+    assert saved['processes']['com.example']['flows'] == 1
+    assert saved['processes']['unknown']['flows'] == 2
+
+
+def test_trace_received_before_the_flow(tmp_path):
+    tracker = FlowTracker(tmp_path)
+    tracker.attribute(trace())
+    tracker._attribute_traces()
+    tracker.process_packets([(1.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    assert tracker.flows()[0]['pid'] == 1234
+
+
+def test_flows_file_layout(tmp_path):
+    tracker = FlowTracker(tmp_path, idle_timeout=60)
+    tracker.process_packets([(1.0, LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))])
+    tracker.process_packets([(100.0, LINKTYPE_RAW, ipv4(UDP, struct.pack('!HHHH', 5000, 5001, 8, 0)))])
+    tracker._evict_idle_flows()
+    closed = [serializer.loads(line) for line in tracker.staging_path.read_text().splitlines()]
+    processes = {'unknown': {'flows': 2, 'packets': 2, 'bytes': 68, 'names': []}}
+    for compact in (False, True):
+        serializer.set_compact_output(compact)
+        try:
+            # The closed flows are only counted in the summary until the tracker is stopped
+            tracker.flush()
+            assert tracker.output_path.read_text(encoding='utf-8') == serializer.dumps(
+                {'processes': processes, 'flows': tracker.flows()})
+            tracker._write_flows(tracker.flows(), tracker._closed_flows())
+            assert tracker.output_path.read_text(encoding='utf-8') == serializer.dumps(
+                {'processes': processes, 'flows': closed + tracker.flows()})
+        finally:
+            serializer.set_compact_output(False)
+
+
+def test_closed_flows_are_appended_once(tmp_path):
+    tracker = FlowTracker(tmp_path, idle_timeout=60)
+    tracker.start()
+    for port in range(5000, 5010):
+        packet = ipv4(UDP, struct.pack('!HHHH', port, 53, 8, 0))
+        tracker.process_packets([(port - 5000, LINKTYPE_RAW, packet), (port - 5000 + 100, LINKTYPE_RAW, packet)])
+        tracker._evict_idle_flows()
+        tracker.flush()
+    assert len(tracker.staging_path.read_text().splitlines()) == 10
+    assert len(tracker) == 20
+    tracker.stop()
+    with tracker.output_path.open(encoding='utf-8') as f:
+        assert len(serializer.load(f)['flows']) == 20
+
+
+def test_queued_packets_are_accounted_by_the_worker(tmp_path):
+    tracker = FlowTracker(tmp_path)
+    tracker.start()
+    for i in range(3000):
+        tracker.on_packet(float(i), LINKTYPE_RAW, ipv4(UDP, struct.pack('!HHHH', 5000 + i % 3, 5001, 8, 0)))
+    tracker.stop()
+    with tracker.output_path.open(encoding='utf-8') as f:
+        saved = serializer.load(f)
+    assert [flow['packets'] for flow in saved['flows']] == [1000, 1000, 1000]
+
+
+def test_packets_are_dropped_when_the_worker_lags(tmp_path, monkeypatch):
+    monkeypatch.setattr(flow_tracker, 'MAX_PENDING_PACKETS', 2)
+    tracker = FlowTracker(tmp_path)
+    for i in range(5):
+        tracker.on_packet(float(i), LINKTYPE_RAW, ipv4(TCP, tcp(TCP_SYN)))
+    assert tracker._dropped_packets == 3
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import lzma
+import os
+import threading
+
+import pytest
+
+from pirogue_evidence_collector.frida import server
+from pirogue_evidence_collector.frida.server import FridaServerCache
+
+
+def binary(version: str, arch: str) -> bytes:
+    return f'frida-server {version} {arch}'.encode() * 1000
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror_dir = tmp_path / 'mirror'
+    mirror_dir.mkdir()
+    for version in ('16.1.4', '16.2.0'):
+        for arch in ('arm64', 'x86_64'):
+            name = FridaServerCache.artifact_name(version, 'android', arch)
+            (mirror_dir / f'{name}.xz').write_bytes(lzma.compress(binary(version, arch)))
+    return mirror_dir
+
+
+@pytest.fixture
+def cache(tmp_path, mirror):
+    return FridaServerCache(cache_dir=tmp_path / 'cache', mirror_dir=mirror)
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    names = []
+    hash_file = server.hash_file
+
+    def counting_hash_file(path, algorithms):
+        names.append(path.name)
+        return hash_file(path, algorithms)
+
+    monkeypatch.setattr(server, 'hash_file', counting_hash_file)
+    return names
+
+
+def manifest(cache: FridaServerCache) -> dict:
+    return json.loads(cache.manifest_path.read_text())
+
+
+def test_binary_is_extracted_from_the_mirror(cache):
+    entry = cache.get('16.1.4', 'android', 'arm64')
+    data = binary('16.1.4', 'arm64')
+    assert cache.path(entry).read_bytes() == data
+    assert entry['sha256'] == hashlib.sha256(data).hexdigest()
+    assert entry['size'] == len(data)
+    assert manifest(cache)['frida-server-16.1.4-android-arm64'] == entry
+    assert sorted(path.name for path in cache.cache_dir.iterdir()) == [
+        'frida-server-16.1.4-android-arm64', 'manifest.json', 'manifest.lock']
+
+
+def test_unchanged_binary_is_not_hashed_again(cache, hashed, mirror):
+    cache.get('16.1.4', 'android', 'arm64')
+    # The mirror is not read again either
+    (mirror / 'frida-server-16.1.4-android-arm64.xz').unlink()
+    assert cache.get('16.1.4', 'android', 'arm64')['version'] == '16.1.4'
+    assert hashed == []
+
+
+def test_touched_binary_is_hashed_once(cache, hashed):
+    entry = cache.get('16.1.4', 'android', 'arm64')
+    path = cache.path(entry)
+    os.utime(path, ns=(entry['mtime_ns'] + 10 ** 9, entry['mtime_ns'] + 10 ** 9))
+    assert cache.get('16.1.4', 'android', 'arm64')['sha256'] == entry['sha256']
+    assert cache.get('16.1.4', 'android', 'arm64')['sha256'] == entry['sha256']
+    assert hashed == [path.name]
+    assert manifest(cache)[path.name]['mtime_ns'] == entry['mtime_ns'] + 10 ** 9
+
+
+def test_corrupted_binary_is_fetched_again(cache, hashed):
+    entry = cache.get('16.1.4', 'android', 'arm64')
+    path = cache.path(entry)
+    path.write_bytes(b'x' * entry['size'])
+    assert cache.get('16.1.4', 'android', 'arm64')['sha256'] == entry['sha256']
+    assert path.read_bytes() == binary('16.1.4', 'arm64')
+
+
+def test_truncated_archive(cache, mirror):
+    archive = mirror / 'frida-server-16.1.4-android-arm64.xz'
+    archive.write_bytes(archive.read_bytes()[:100])
+    with pytest.raises(Exception, match='truncated'):
+        cache.get('16.1.4', 'android', 'arm64')
+    assert [path.name for path in cache.cache_dir.iterdir() if path.name.endswith('.tmp')] == []
+
+
+def test_latest_cached_version(cache):
+    assert cache.latest_cached_version('android', 'arm64') is None
+    cache.get('16.2.0', 'android', 'arm64')
+    cache.get('16.1.4', 'android', 'arm64')
+    cache.get('16.2.0', 'android', 'x86_64')
+    assert cache.latest_cached_version('android', 'arm64') == '16.2.0'
+
+
+def test_concurrent_stores_keep_every_entry(tmp_path, mirror):
+    # One cache object per capture, as with concurrent processes
+    errors = []
+
+    def store(version, arch):
+        try:
+            FridaServerCache(cache_dir=tmp_path / 'cache', mirror_dir=mirror).get(version, 'android', arch)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=store, args=(version, arch))
+        for version in ('16.1.4', '16.2.0') for arch in ('arm64', 'x86_64') for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    cache = FridaServerCache(cache_dir=tmp_path / 'cache')
+    assert len(manifest(cache)) == 4
+    for name, entry in manifest(cache).items():
+        assert hashlib.sha256(cache.path(entry).read_bytes()).hexdigest() == entry['sha256']
@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import pytest
+
+from pirogue_evidence_collector.utils import hash_cache, serializer
+from pirogue_evidence_collector.utils.hash_cache import HASH_CACHE_FILE_NAME, HashCache
+
+ALGORITHMS = ('sha256', 'sha512')
+
+
+def digests(data: bytes) -> dict:
+    return {algorithm: hashlib.new(algorithm, data).hexdigest() for algorithm in ALGORITHMS}
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    # Names of the files actually hashed
+    names = []
+    hash_files = hash_cache.hash_files
+
+    def counting_hash_files(paths, algorithms):
+        names.extend(path.name for path in paths)
+        return hash_files(paths, algorithms)
+
+    monkeypatch.setattr(hash_cache, 'hash_files', counting_hash_files)
+    return names
+
+
+def test_cached_digests_are_reused(tmp_path, hashed):
+    (tmp_path / 'a.json').write_bytes(b'a')
+    (tmp_path / 'b.json').write_bytes(b'b')
+    cache = HashCache(tmp_path)
+    results = cache.get_many([tmp_path / 'a.json', tmp_path / 'b.json'], ALGORITHMS)
+    assert results[tmp_path / 'a.json'] == digests(b'a')
+    cache.save()
+    assert (tmp_path / HASH_CACHE_FILE_NAME).exists()
+    # Another process, e.g. the timestamping, reuses the saved digests
+    assert HashCache(tmp_path).get(tmp_path / 'b.json', ALGORITHMS) == digests(b'b')
+    assert sorted(hashed) == ['a.json', 'b.json']
+
+
+def test_modified_file_is_hashed_again(tmp_path, hashed):
+    path = tmp_path / 'a.json'
+    path.write_bytes(b'a')
+    cache = HashCache(tmp_path)
+    cache.get(path, ALGORITHMS)
+    path.write_bytes(b'changed')
+    assert cache.get(path, ALGORITHMS) == digests(b'changed')
+    assert hashed == ['a.json', 'a.json']
+
+
+def test_missing_algorithm_is_computed(tmp_path, hashed):
+    path = tmp_path / 'a.json'
+    path.write_bytes(b'a')
+    cache = HashCache(tmp_path)
+    cache.get(path, ['sha256'])
+    assert cache.get(path, ALGORITHMS) == digests(b'a')
+    assert cache.entries['a.json']['digests'] == digests(b'a')
+
+
+def test_experiment_digests_are_reused(tmp_path, hashed):
+    (tmp_path / 'traffic.pcap.zst').write_bytes(b'compressed')
+    with (tmp_path / 'experiment.json').open('w', encoding='utf-8') as out:
+        serializer.dump({'digests': {
+            'traffic.pcap.zst': dict(digests(b'content'), size=7, compressed=dict(digests(b'compressed'), size=10)),
+        }}, out)
+    cache = HashCache(tmp_path)
+    # The digests of a compressed file are those of the file on disk
+    assert cache.get(tmp_path / 'traffic.pcap.zst', ALGORITHMS) == digests(b'compressed')
+    assert hashed == []
+
+
+def test_experiment_digests_of_a_modified_file_are_ignored(tmp_path, hashed):
+    path = tmp_path / 'sslkeylog.txt'
+    path.write_bytes(b'keys')
+    with (tmp_path / 'experiment.json').open('w', encoding='utf-8') as out:
+        serializer.dump({'digests': {'sslkeylog.txt': dict(digests(b'keys'), size=4)}}, out)
+    written_ns = (tmp_path / 'experiment.json').stat().st_mtime_ns
+    path.write_bytes(b'more')
+    os.utime(path, ns=(written_ns + 10 ** 9, written_ns + 10 ** 9))
+    assert HashCache(tmp_path).get(path, ALGORITHMS) == digests(b'more')
+    assert hashed == ['sslkeylog.txt']
+
+
+def test_verify_reports_the_changed_content(tmp_path, hashed):
+    path = tmp_path / 'a.json'
+    path.write_bytes(b'a')
+    cache = HashCache(tmp_path)
+    cache.get(path, ALGORITHMS)
+    cache.save()
+    stat = path.stat()
+    # Same size and modification time, different content
+    path.write_bytes(b'b')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert HashCache(tmp_path).get(path, ALGORITHMS) == digests(b'a')
+    cache = HashCache(tmp_path, verify=True)
+    assert cache.get(path, ALGORITHMS) == digests(b'b')
+    assert cache.mismatches == [('a.json', 'sha256'), ('a.json', 'sha512')]
+
+
+def test_cache_of_another_version_is_ignored(tmp_path):
+    with (tmp_path / HASH_CACHE_FILE_NAME).open('w', encoding='utf-8') as out:
+        serializer.dump({'version': 0, 'entries': {'a.json': {}}}, out)
+    assert HashCache(tmp_path).entries == {}
+    (tmp_path / HASH_CACHE_FILE_NAME).write_text('{')
+    assert HashCache(tmp_path).entries == {}
@@ -0,0 +1,50 @@
+import hashlib
+
+import pytest
+
+from pirogue_evidence_collector.utils import hashing
+from pirogue_evidence_collector.utils.hashing import DEFAULT_ALGORITHMS, hash_file, hash_files
+
+DATA = bytes(range(256)) * 1000
+
+
+def expected(data: bytes, algorithms=DEFAULT_ALGORITHMS) -> dict:
+    return {algorithm: hashlib.new(algorithm, data).hexdigest() for algorithm in algorithms}
+
+
+@pytest.mark.parametrize('chunk_size', [1000, 4096, len(DATA), len(DATA) * 2])
+def test_hash_file_chunks(tmp_path, chunk_size):
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+    assert hash_file(path, chunk_size=chunk_size) == expected(DATA)
+
+
+def test_hash_file_single_algorithm(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+    assert hash_file(path, ['sha256'], chunk_size=1000) == expected(DATA, ['sha256'])
+
+
+def test_hash_memory_mapped_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(hashing, 'MMAP_THRESHOLD', 1024)
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+    assert hash_file(path, chunk_size=3000) == expected(DATA)
+
+
+def test_hash_empty_file(tmp_path):
+    path = tmp_path / 'empty'
+    path.write_bytes(b'')
+    assert hash_file(path) == expected(b'')
+
+
+def test_hash_files(tmp_path):
+    paths = []
+    for index in range(6):
+        path = tmp_path / f'file-{index}'
+        path.write_bytes(DATA[:index * 1000])
+        paths.append(path)
+    digests = hash_files(paths, ['sha1', 'sha512'], max_workers=3, chunk_size=1024)
+    assert list(digests) == paths
+    for index, path in enumerate(paths):
+        assert digests[path] == expected(DATA[:index * 1000], ['sha1', 'sha512'])
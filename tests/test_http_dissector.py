@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from pirogue_evidence_collector.network import http_dissector
+from pirogue_evidence_collector.network.http_dissector import HttpBody, decode_colon_hex
+
+
+def _colon_hex(data: bytes) -> str:
+    return ':'.join(f'{b:02x}' for b in data)
+
+
+def test_decode_colon_hex_string():
+    data = os.urandom(1000)
+    assert decode_colon_hex(_colon_hex(data)) == data
+    assert decode_colon_hex('') == b''
+    assert decode_colon_hex('7f') == b'\x7f'
+
+
+def test_decode_colon_hex_fragments():
+    fragments = [os.urandom(n) for n in (1, 0, 17, 4096)]
+    encoded = [_colon_hex(f) for f in fragments]
+    # tshark may also give fragments without separators
+    encoded.append(b'plain'.hex())
+    assert decode_colon_hex(encoded) == b''.join(fragments) + b'plain'
+    assert decode_colon_hex([]) == b''
+
+
+def test_decode_colon_hex_rejects_invalid_input():
+    with pytest.raises(ValueError):
+        decode_colon_hex('zz:01')
+    with pytest.raises(ValueError):
+        decode_colon_hex(['01:0'])
+
+
+def test_http_body_text_and_pretty():
+    assert HttpBody.from_bytes(b'{"a": 1}').pretty() == '{\n  "a": 1\n}'
+    assert HttpBody.from_bytes(b'\xff\x00').text() == 'ff00'
+    assert not HttpBody.from_bytes(b'')
+
+
+def test_large_bodies_are_spilled_to_blob_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_dissector, 'LARGE_BODY_THRESHOLD', 16)
+    http_dissector.set_blob_dir(tmp_path)
+    try:
+        data = os.urandom(64)
+        body = HttpBody.from_bytes(data)
+        assert body.is_spilled
+        assert body.read() == data
+        assert body.to_json()['size'] == 64
+        assert HttpBody.from_bytes(b'small').to_json() == 'small'
+    finally:
+        http_dissector.set_blob_dir(None)
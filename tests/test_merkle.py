@@ -0,0 +1,49 @@
+import hashlib
+
+import pytest
+
+from pirogue_evidence_collector.utils.merkle import MerkleTree, leaf_hash, node_hash, verify_inclusion
+
+
+def leaves(count: int) -> list:
+    return [leaf_hash(f'file-{index}', hashlib.sha512(bytes([index])).digest()) for index in range(count)]
+
+
+def test_root_follows_rfc_6962():
+    a, b, c, d, e = leaves(5)
+    assert MerkleTree([a]).root() == a
+    assert MerkleTree([a, b, c]).root() == node_hash(node_hash(a, b), c)
+    assert MerkleTree([a, b, c, d, e]).root() == node_hash(node_hash(node_hash(a, b), node_hash(c, d)), e)
+    assert MerkleTree().root() == hashlib.sha512(b'').digest()
+
+
+def test_leaf_binds_the_file_name():
+    digest = hashlib.sha512(b'content').digest()
+    assert leaf_hash('a.json', digest) != leaf_hash('b.json', digest)
+
+
+@pytest.mark.parametrize('size', range(1, 18))
+def test_audit_paths_prove_inclusion(size):
+    tree = MerkleTree(leaves(size))
+    root = tree.root()
+    for index, (leaf, audit_path) in enumerate(zip(tree.leaves, tree.audit_paths())):
+        assert verify_inclusion(leaf, index, size, audit_path, root)
+        assert not verify_inclusion(leaf_hash('other', b''), index, size, audit_path, root)
+        if size > 1:
+            assert not verify_inclusion(leaf, (index + 1) % size, size, audit_path, root)
+            assert not verify_inclusion(leaf, index, size, audit_path[:-1], root)
+
+
+def test_appended_leaves_keep_the_older_roots_valid():
+    tree = MerkleTree(leaves(5))
+    old_root = tree.root()
+    proof = tree.audit_paths()[2]
+    tree.append(leaf_hash('new', b''))
+    assert tree.root() != old_root
+    # The proofs against the previous root remain valid
+    assert verify_inclusion(tree.leaves[2], 2, 5, proof, old_root)
+
+
+def test_index_out_of_the_tree():
+    tree = MerkleTree(leaves(2))
+    assert not verify_inclusion(tree.leaves[0], 2, 2, tree.audit_paths()[0], tree.root())
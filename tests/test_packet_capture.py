@@ -0,0 +1,114 @@
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from pirogue_evidence_collector.network import packet_capture
+from pirogue_evidence_collector.network.packet_capture import TcpDump, build_host_filter, is_ethernet_interface
+
+HEADER = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+
+
+def record(data: bytes, ts: int = 1) -> bytes:
+    return struct.pack('<IIII', ts, 0, len(data), len(data)) + data
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, 'rb') as stream, os.fdopen(write_fd, 'wb', buffering=0) as sink:
+        yield stream, sink
+
+
+def start_reader(capture, stream, sink, header=HEADER):
+    reader = threading.Thread(target=capture._read_stream, args=(stream,))
+    reader.start()
+    sink.write(header)
+    assert capture._ready.wait(5)
+    return reader
+
+
+def test_build_host_filter():
+    assert build_host_filter([]) is None
+    assert build_host_filter(['10.0.0.2', 'fe80::1']) == 'host 10.0.0.2 or host fe80::1'
+    assert build_host_filter(['10.0.0.2'], ['0a:1b:2c:3d:4e:5f']) == 'host 10.0.0.2 or ether host 0a:1b:2c:3d:4e:5f'
+    assert build_host_filter([], ['0a:1b:2c:3d:4e:5f']) == 'ether host 0a:1b:2c:3d:4e:5f'
+
+
+def test_is_ethernet_interface():
+    assert not is_ethernet_interface('lo')
+    assert not is_ethernet_interface('missing-interface')
+
+
+def test_packets_are_written_and_passed_to_listeners(tmp_path, pipe):
+    stream, sink = pipe
+    capture = TcpDump('wlan0', str(tmp_path), 'traffic', None)
+    packets = []
+    capture.add_listener(lambda ts, link_type, data: packets.append((ts, link_type, data)))
+    reader = start_reader(capture, stream, sink)
+    sink.write(record(b'first', ts=10) + record(b'second', ts=11))
+    sink.close()
+    reader.join(5)
+    assert packets == [(10, 1, b'first'), (11, 1, b'second')]
+    assert (tmp_path / 'traffic.pcap').read_bytes() == HEADER + record(b'first', ts=10) + record(b'second', ts=11)
+    segment, = capture.get_segments()
+    assert segment['file'] == 'traffic.pcap'
+    assert segment['packets'] == 2
+
+
+def test_rotation_by_size(tmp_path, pipe):
+    stream, sink = pipe
+    capture = TcpDump('wlan0', str(tmp_path), 'traffic.pcap', None, rotate_size=len(HEADER) + 1)
+    reader = start_reader(capture, stream, sink)
+    sink.write(record(b'a') + record(b'b') + record(b'c'))
+    sink.close()
+    reader.join(5)
+    assert [segment['file'] for segment in capture.get_segments()] == [
+        'traffic-00001.pcap', 'traffic-00002.pcap', 'traffic-00003.pcap']
+    assert (tmp_path / 'traffic-00002.pcap').read_bytes() == HEADER + record(b'b')
+
+
+def test_idle_capture_is_flushed_and_rotated(tmp_path, pipe, monkeypatch):
+    monkeypatch.setattr(packet_capture, 'SEGMENT_FLUSH_INTERVAL', 0.05)
+    stream, sink = pipe
+    capture = TcpDump('wlan0', str(tmp_path), 'traffic.pcap', None, rotate_seconds=0.2, compress=False)
+    reader = start_reader(capture, stream, sink)
+    sink.write(record(b'a'))
+    # No other packet arrives, the segment is flushed then rotated anyway
+    deadline = time.monotonic() + 5
+    while (tmp_path / 'traffic-00001.pcap').stat().st_size < len(HEADER + record(b'a')):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    while len(capture.segments) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert capture.segments[0].end_time is not None
+    sink.write(record(b'b'))
+    sink.close()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert [segment['packets'] for segment in capture.get_segments()] == [1, 1]
+    assert (tmp_path / 'traffic-00002.pcap').read_bytes() == HEADER + record(b'b')
+
+
+def test_empty_segment_is_not_rotated(tmp_path, pipe, monkeypatch):
+    monkeypatch.setattr(packet_capture, 'SEGMENT_FLUSH_INTERVAL', 0.01)
+    stream, sink = pipe
+    capture = TcpDump('wlan0', str(tmp_path), 'traffic.pcap', None, rotate_seconds=0.01)
+    reader = start_reader(capture, stream, sink)
+    time.sleep(0.1)
+    sink.close()
+    reader.join(5)
+    assert len(capture.segments) == 1
+
+
+def test_non_pcap_stream_is_copied(tmp_path, pipe):
+    stream, sink = pipe
+    capture = TcpDump('wlan0', str(tmp_path), 'traffic.pcap', None, rotate_size=10)
+    data = b'\x0a\x0d\x0d\x0a' + bytes(100)
+    reader = start_reader(capture, stream, sink, header=data)
+    sink.close()
+    reader.join(5)
+    assert (tmp_path / 'traffic.pcap').read_bytes() == data
@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+
+import pytest
+
+from pirogue_evidence_collector.frida.record_writer import (JsonRecordSink, PlainRecordSink, QueuedRecordWriter,
+                                                            RecordSink, RecordWriter, StackRecordSink,
+                                                            write_json_array)
+from pirogue_evidence_collector.utils import serializer
+
+
+def _record(i):
+    return {'type': 'socket_traces', 'dump': 'socket_trace.json', 'data_type': 'json', 'pid': 1,
+            'process': 'app', 'timestamp': i, 'data': {'socket_fd': i, 'dest_ip': '10.0.0.1'}}
+
+
+def test_record_sink_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        RecordSink(tmp_path / 'out.txt')
+
+
+def test_json_sink_streams_to_staging_file(tmp_path):
+    sink = JsonRecordSink(tmp_path / 'socket_trace.json', flush_interval=0)
+    for i in range(3):
+        sink.write(_record(i))
+    staging = tmp_path / 'socket_trace.ndjson'
+    assert [json.loads(line) for line in staging.read_text().splitlines()] == [_record(i) for i in range(3)]
+    assert not (tmp_path / 'socket_trace.json').exists()
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_json_sink_finalize_matches_serializer_layout(tmp_path, compact):
+    serializer.set_compact_output(compact)
+    try:
+        sink = JsonRecordSink(tmp_path / 'socket_trace.json')
+        records = [_record(i) for i in range(5)]
+        for record in records:
+            sink.write(record)
+        sink.finalize()
+        assert (tmp_path / 'socket_trace.json').read_text() == serializer.dumps(records)
+        assert not (tmp_path / 'socket_trace.ndjson').exists()
+    finally:
+        serializer.set_compact_output(False)
+
+
+def test_finalize_empty_and_truncated_staging_file(tmp_path):
+    staging = _write(tmp_path / 'aes_info.ndjson', '')
+    output, _ = write_json_array(staging, tmp_path / 'empty.json')
+    assert output.read_text() == '[]'
+    # A crash may leave a partially written last line
+    _write(staging, serializer.dumps(_record(1), pretty=False) + '\n{"type": "soc')
+    output, _ = write_json_array(staging, tmp_path / 'aes_info.json')
+    assert json.loads(output.read_text()) == [_record(1)]
+
+
+def _write(path, content):
+    path.write_text(content)
+    return path
+
+
+def test_stack_sink_deduplicates_stacks(tmp_path):
+    sink = StackRecordSink(tmp_path / 'stacks.json')
+    for stack_id in ('1', '2', '1'):
+        sink.write({'data': {'stack_id': stack_id, 'frames': [f'frame {stack_id}']}})
+    sink.finalize()
+    assert json.loads((tmp_path / 'stacks.json').read_text()) == {'1': ['frame 1'], '2': ['frame 2']}
+    assert sink.record_count == 2
+
+
+def test_record_writer_picks_sink_by_data_type(tmp_path):
+    writer = RecordWriter(tmp_path)
+    writer.write('sslkeylog.txt', {'data_type': 'plain', 'data': 'CLIENT_RANDOM 00 11'})
+    writer.write('socket_trace.json', _record(0))
+    assert isinstance(writer.sinks['sslkeylog.txt'], PlainRecordSink)
+    assert isinstance(writer.sinks['socket_trace.json'], JsonRecordSink)
+    writer.close()
+    assert (tmp_path / 'sslkeylog.txt').read_text() == 'CLIENT_RANDOM 00 11\n'
+    assert writer.outputs == {'sslkeylog.txt': 'sslkeylog.txt', 'socket_trace.json': 'socket_trace.json'}
+
+
+class _SlowWriter(RecordWriter):
+    def __init__(self, output_dir, release):
+        super().__init__(output_dir, flush_interval=0.05)
+        self.release = release
+
+    def write(self, filename, record):
+        self.release.wait()
+        super().write(filename, record)
+
+
+def test_queued_writer_writes_all_records(tmp_path):
+    queued = QueuedRecordWriter(RecordWriter(tmp_path), max_size=4, policy='block')
+    queued.start()
+    for i in range(50):
+        queued.put('socket_trace.json', _record(i))
+    queued.close()
+    stats = queued.stats()
+    assert stats['written'] == stats['enqueued'] == 50
+    assert stats['dropped'] == 0
+    assert len(json.loads((tmp_path / 'socket_trace.json').read_text())) == 50
+
+
+def test_queued_writer_drop_policy_counts_dropped_records(tmp_path):
+    release = threading.Event()
+    queued = QueuedRecordWriter(_SlowWriter(tmp_path, release), max_size=2, policy='drop')
+    queued.start()
+    for i in range(10):
+        queued.put('socket_trace.json', _record(i))
+    release.set()
+    queued.close()
+    stats = queued.stats()
+    assert stats['dropped'] > 0
+    assert stats['written'] + stats['dropped'] == 10
+
+
+def test_queued_writer_rejects_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        QueuedRecordWriter(RecordWriter(tmp_path), policy='spill')
+
+
+class _FailingFlushWriter(RecordWriter):
+    def flush(self, fsync=False):
+        raise OSError('No space left on device')
+
+
+def test_queued_writer_survives_flush_errors(tmp_path):
+    queued = QueuedRecordWriter(_FailingFlushWriter(tmp_path, flush_interval=0.01), policy='block')
+    queued.start()
+    time.sleep(0.1)
+    queued.put('socket_trace.json', _record(0))
+    queued.close()
+    stats = queued.stats()
+    assert stats['errors'] > 0
+    assert stats['written'] == 1
+
+
+class _BrokenWriter(RecordWriter):
+    @property
+    def flush_interval(self):
+        raise RuntimeError('broken')
+
+    @flush_interval.setter
+    def flush_interval(self, value):
+        pass
+
+
+def test_queued_writer_fails_fast_when_the_thread_is_dead(tmp_path):
+    queued = QueuedRecordWriter(_BrokenWriter(tmp_path), max_size=1, policy='block')
+    queued.start()
+    queued._thread.join(timeout=2)
+    done = threading.Event()
+
+    def put_records():
+        for i in range(3):
+            queued.put('socket_trace.json', _record(i))
+        done.set()
+
+    threading.Thread(target=put_records, daemon=True).start()
+    assert done.wait(timeout=2)
+    assert queued.stats()['dropped'] == 3
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from asn1crypto import cms, tsp
+
+pytest.importorskip('pirogue_colander_connector')
+
+from pirogue_evidence_collector.utils import serializer  # noqa: E402
+from pirogue_evidence_collector.utils.rfc3161 import (MERKLE_FILE_NAME, PROOF_SUFFIX,  # noqa: E402
+                                                      FolderTimestamper, TimestampBatch, TimestampServer,
+                                                      TimeStampResp, build_timestamp_query, check_inclusion_proof,
+                                                      check_timestamp_reply, proof_verification_command)
+
+
+def granted_reply(digest: bytes, hashname: str = 'sha512') -> bytes:
+    token_info = tsp.TSTInfo({
+        'version': 'v1',
+        'policy': '1.2.3.4',
+        'message_imprint': {'hash_algorithm': {'algorithm': hashname}, 'hashed_message': digest},
+        'serial_number': 1,
+        'gen_time': datetime.now(timezone.utc),
+    })
+    signed_data = cms.SignedData({
+        'version': 'v3',
+        'digest_algorithms': [],
+        'encap_content_info': {'content_type': 'tst_info', 'content': token_info},
+        'signer_infos': [],
+    })
+    return TimeStampResp({
+        'status': {'status': 'granted'},
+        'time_stamp_token': {'content_type': 'signed_data', 'content': signed_data},
+    }).dump()
+
+
+def rejected_reply() -> bytes:
+    return TimeStampResp({'status': {'status': 'rejection', 'status_string': ['bad request']}}).dump()
+
+
+class StandInTsa:
+    """
+    Local HTTP server answering the timestamp queries with canned replies.
+    """
+
+    def __init__(self):
+        # Replies by hashed message, each one is a list of (HTTP status, body) used in turn
+        self.replies = {}
+        self.requests = []
+        tsa = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._send(200, b'certificate')
+
+            def do_POST(self):
+                query = tsp.TimeStampReq.load(self.rfile.read(int(self.headers['Content-Length'])))
+                digest = query['message_imprint']['hashed_message'].native
+                tsa.requests.append(digest)
+                replies = tsa.replies.get(digest) or [(200, granted_reply(digest))]
+                self._send(*(replies.pop(0) if len(replies) > 1 else replies[0]))
+
+            def _send(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.value = dict(TimestampServer.FREETSA.value, base_url=f'{url}/tsr', ca_url=f'{url}/ca.pem',
+                          tsa_url=f'{url}/tsa.crt', retries=3, backoff=0.01)
+
+    # Same behavior as the servers of TimestampServer, against the local server
+    create_session = TimestampServer.create_session
+    download_ca = TimestampServer.download_ca
+    download_tsa = TimestampServer.download_tsa
+
+
+@pytest.fixture
+def tsa():
+    server = StandInTsa()
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def digest_of(data: bytes) -> bytes:
+    return hashlib.sha512(data).digest()
+
+
+def test_check_timestamp_reply():
+    digest = digest_of(b'data')
+    check_timestamp_reply(granted_reply(digest), digest)
+    with pytest.raises(Exception, match='rejected'):
+        check_timestamp_reply(rejected_reply(), digest)
+    with pytest.raises(Exception, match='does not match'):
+        check_timestamp_reply(granted_reply(digest_of(b'other')), digest)
+    # Same bytes, imprint computed with another algorithm
+    with pytest.raises(Exception, match='does not match'):
+        check_timestamp_reply(granted_reply(digest, hashname='sha256'), digest)
+
+
+def test_build_timestamp_query():
+    query = tsp.TimeStampReq.load(build_timestamp_query(digest_of(b'data')))
+    assert query['message_imprint']['hash_algorithm']['algorithm'].native == 'sha512'
+    assert query['message_imprint']['hashed_message'].native == digest_of(b'data')
+    assert query['cert_req'].native is True
+
+
+def test_granted(tsa, tmp_path):
+    path = tmp_path / 'traffic.pcap'
+    path.write_bytes(b'data')
+    with TimestampBatch(tmp_path, server=tsa) as batch:
+        assert batch.ca.read_bytes() == b'certificate'
+        batch.timestamp_file(path, digest_of(b'data').hex())
+    assert tsp.TimeStampReq.load((tmp_path / 'traffic.pcap.tsq').read_bytes())
+    check_timestamp_reply((tmp_path / 'traffic.pcap.tsr').read_bytes(), digest_of(b'data'))
+
+
+def test_retried_after_server_error(tsa, tmp_path):
+    digest = digest_of(b'data')
+    tsa.replies[digest] = [(503, b''), (503, b''), (200, granted_reply(digest))]
+    with TimestampBatch(tmp_path, server=tsa) as batch:
+        batch.timestamp_digest(digest.hex(), tmp_path / 'a.tsq', tmp_path / 'a.tsr')
+    assert tsa.requests == [digest] * 3
+    assert (tmp_path / 'a.tsr').exists()
+
+
+def test_retries_exhausted(tsa, tmp_path):
+    digest = digest_of(b'data')
+    tsa.replies[digest] = [(503, b'')]
+    with TimestampBatch(tmp_path, server=tsa) as batch:
+        with pytest.raises(Exception, match='HTTP 503'):
+            batch.timestamp_digest(digest.hex(), tmp_path / 'a.tsq', tmp_path / 'a.tsr')
+    # The first request and the retries of the server
+    assert len(tsa.requests) == tsa.value['retries'] + 1
+    assert not (tmp_path / 'a.tsr').exists()
+
+
+def test_timestamp_files_failures(tsa, tmp_path):
+    files = {}
+    for name in ('granted', 'rejected', 'mismatch'):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        files[path] = digest_of(name.encode()).hex()
+    tsa.replies[digest_of(b'rejected')] = [(200, rejected_reply())]
+    tsa.replies[digest_of(b'mismatch')] = [(200, granted_reply(digest_of(b'other')))]
+    with TimestampBatch(tmp_path, server=tsa, max_workers=3) as batch:
+        failures = batch.timestamp_files(files)
+    assert sorted(path.name for path in failures) == ['mismatch', 'rejected']
+    assert 'rejected' in str(failures[tmp_path / 'rejected'])
+    assert 'does not match' in str(failures[tmp_path / 'mismatch'])
+    assert (tmp_path / 'granted.tsr').exists()
+    assert not (tmp_path / 'rejected.tsr').exists()
+    assert not (tmp_path / 'mismatch.tsr').exists()
+
+
+def merkle_timestamp(folder, tsa):
+    FolderTimestamper(folder, server=tsa)._merkle_timestamp()
+    return serializer.loads((folder / MERKLE_FILE_NAME).read_bytes())
+
+
+def test_merkle_timestamp_appends_the_new_files(tsa, tmp_path):
+    for name in ('b.pcap', 'a.json'):
+        (tmp_path / name).write_bytes(name.encode())
+    manifest = merkle_timestamp(tmp_path, tsa)
+    assert [leaf['name'] for leaf in manifest['leaves']] == ['a.json', 'b.pcap']
+    assert [root['tree_size'] for root in manifest['roots']] == [2]
+    first_root = manifest['roots'][0]
+
+    (tmp_path / 'c.txt').write_bytes(b'c.txt')
+    manifest = merkle_timestamp(tmp_path, tsa)
+    # The existing leaves keep their index, the previous root and its timestamp are kept
+    assert [leaf['name'] for leaf in manifest['leaves']] == ['a.json', 'b.pcap', 'c.txt']
+    assert manifest['roots'][0] == first_root
+    assert [root['tree_size'] for root in manifest['roots']] == [2, 3]
+    assert (tmp_path / first_root['tsr']).exists()
+    for index, name in enumerate(('a.json', 'b.pcap', 'c.txt')):
+        proof = check_inclusion_proof(tmp_path / name)
+        assert (proof['leaf_index'], proof['tree_size']) == (index, 3)
+        assert proof['root'] == manifest['roots'][1]['root']
+
+    # Nothing new, the current root is not stamped again
+    requests = len(tsa.requests)
+    assert merkle_timestamp(tmp_path, tsa) == manifest
+    assert len(tsa.requests) == requests
+
+
+def test_check_inclusion_proof_rejects_a_modified_file_or_proof(tsa, tmp_path):
+    for name in ('a.json', 'b.pcap', 'c.txt'):
+        (tmp_path / name).write_bytes(name.encode())
+    merkle_timestamp(tmp_path, tsa)
+    (tmp_path / 'a.json').write_bytes(b'modified')
+    with pytest.raises(Exception, match='does not match'):
+        check_inclusion_proof(tmp_path / 'a.json')
+
+    proof_path = tmp_path / f'b.pcap{PROOF_SUFFIX}'
+    proof = json.loads(proof_path.read_text())
+    proof['leaf_index'] = 0
+    proof_path.write_text(json.dumps(proof))
+    with pytest.raises(Exception, match='not part of the Merkle tree'):
+        check_inclusion_proof(tmp_path / 'b.pcap')
+
+    # The proof of another file
+    (tmp_path / f'c.txt{PROOF_SUFFIX}').write_bytes((tmp_path / f'a.json{PROOF_SUFFIX}').read_bytes())
+    with pytest.raises(Exception, match='proof of a.json'):
+        check_inclusion_proof(tmp_path / 'c.txt')
+
+
+@pytest.mark.parametrize('key', ['tsr', 'ca', 'tsa'])
+@pytest.mark.parametrize('name', ['$(touch pwned).tsr', '../merkle-000001.tsr', '-in', 'missing.tsr', 'sub'])
+def test_proof_with_an_unsafe_file_name_is_rejected(tsa, tmp_path, key, name):
+    (tmp_path / 'a.json').write_bytes(b'a.json')
+    (tmp_path / 'sub').mkdir()
+    merkle_timestamp(tmp_path, tsa)
+    proof_path = tmp_path / f'a.json{PROOF_SUFFIX}'
+    proof = json.loads(proof_path.read_text())
+    proof[key] = name
+    proof_path.write_text(json.dumps(proof))
+    with pytest.raises(ValueError):
+        check_inclusion_proof(tmp_path / 'a.json')
+    # Without a shell, the other names are only missing files
+    if name in ('../merkle-000001.tsr', '-in'):
+        with pytest.raises(ValueError):
+            proof_verification_command(proof)
+    assert not (tmp_path / 'pwned').exists()
+
+
+def test_proof_verification_command(tsa, tmp_path):
+    (tmp_path / 'a.json').write_bytes(b'a.json')
+    manifest = merkle_timestamp(tmp_path, tsa)
+    proof = check_inclusion_proof(tmp_path / 'a.json')
+    root = manifest['roots'][0]
+    assert proof_verification_command(proof) == [
+        'openssl', 'ts', '-verify', '-digest', root['root'], '-in', root['tsr'],
+        '-CAfile', 'freetsa.org_cacert.pem', '-untrusted', 'freetsa.org_tsa.crt',
+    ]
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pirogue_colander_connector')
+
+from pirogue_evidence_collector.entrypoints import pirogue_save_metadata  # noqa: E402
+
+
+def _save_metadata(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['pirogue-save-metadata', *args])
+    pirogue_save_metadata.main()
+
+
+def test_metadata_are_written_with_the_json_module(tmp_path, monkeypatch):
+    (tmp_path / 'capture.pcap').write_bytes(b'packets')
+    # The metadata files are written next to the working directory
+    monkeypatch.chdir(tmp_path)
+    _save_metadata(monkeypatch, str(tmp_path))
+    content = (tmp_path / 'capture.pcap.metadata.json').read_text()
+    assert content == json.dumps(json.loads(content))
+
+
+def test_verify_reports_the_modified_files(tmp_path, monkeypatch):
+    (tmp_path / 'capture.pcap').write_bytes(b'packets')
+    monkeypatch.chdir(tmp_path)
+    _save_metadata(monkeypatch, str(tmp_path))
+    stat = (tmp_path / 'capture.pcap').stat()
+    # Same size and modification time, the cached digests are reused unless verified
+    (tmp_path / 'capture.pcap').write_bytes(b'PACKETS')
+    os.utime(tmp_path / 'capture.pcap', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    _save_metadata(monkeypatch, str(tmp_path))
+    with pytest.raises(SystemExit) as e:
+        _save_metadata(monkeypatch, '--verify', str(tmp_path))
+    assert e.value.code == 1
+
+
+def test_missing_folder_is_rejected(tmp_path, monkeypatch):
+    with pytest.raises(SystemExit) as e:
+        _save_metadata(monkeypatch, str(tmp_path / 'missing'))
+    assert e.value.code == 1
@@ -0,0 +1,38 @@
+import pytest
+
+from pirogue_evidence_collector.utils import serializer
+
+SAMPLES = [
+    {'process': 'com.example', 'pid': 1234, 'data': {'socket_fd': 12, 'dest_ip': '::ffff:10.0.0.1', 'ratio': 0.25}},
+    {'text': 'Zoë ☃ 日本', 'empty_list': [], 'empty_dict': {}, 'nested': [[1, 2], {'a': None, 'b': True}]},
+    {'nan': float('nan'), 'inf': [float('inf'), float('-inf')], 'finite': 1.5},
+    {1: 'integer key', 'big': 2 ** 70},
+    [],
+    'plain string',
+]
+
+
+@pytest.mark.parametrize('pretty', [True, False])
+@pytest.mark.parametrize('obj', SAMPLES)
+def test_backends_produce_the_same_output(obj, pretty):
+    assert serializer.dumps(obj, pretty=pretty) == serializer._stdlib_dumps(obj, pretty)
+
+
+def test_non_finite_floats_are_written_as_null():
+    assert serializer.loads(serializer.dumps({'nan': float('nan')}, pretty=False)) == {'nan': None}
+
+
+def test_compact_output_setting():
+    try:
+        serializer.set_compact_output(True)
+        assert serializer.dumps({'a': [1, 2]}) == '{"a":[1,2]}'
+        serializer.set_compact_output(False)
+        assert serializer.dumps({'a': [1]}) == '{\n  "a": [\n    1\n  ]\n}'
+    finally:
+        serializer.set_compact_output(False)
+
+
+def test_loads_round_trip():
+    obj = SAMPLES[1]
+    assert serializer.loads(serializer.dumps(obj)) == obj
+    assert serializer.loads(serializer.dumps(obj).encode('utf-8')) == obj
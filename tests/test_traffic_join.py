@@ -0,0 +1,109 @@
+import json
+from pathlib import Path
+
+from pirogue_evidence_collector.network.http_dissector import LARGE_BODY_THRESHOLD, serializable_record, set_blob_dir
+from pirogue_evidence_collector.network.traffic_join import (
+    StackIndex,
+    attach_stacks,
+    compact_stack,
+    dissect_ek_lines,
+    resolve_stack,
+)
+
+
+def _trace(local_port, **data):
+    trace_data = {'local_ip': '10.0.0.2', 'local_port': local_port, 'dest_ip': '1.1.1.1', 'dest_port': 443,
+                  'socket_type': 'tcp'}
+    trace_data.update(data)
+    return {'pid': 42, 'process': 'com.example', 'timestamp': local_port, 'data': trace_data}
+
+
+def test_compact_stack_keeps_distinct_classes_in_order():
+    stack = [{'class': 'a.B'}, {'class': 'c.D'}, {'class': 'a.B'}, 'e.F']
+    assert compact_stack(stack) == ['a.B', 'c.D', 'e.F']
+
+
+def test_stack_index_resolves_interned_stacks():
+    stacks = {'s1': [{'class': 'okhttp3.Call'}, {'class': 'com.example.Api'}]}
+    index = StackIndex.build([_trace(1000, stack_id='s1'), _trace(1000, stack_id='unknown'), _trace(1001)], stacks)
+    assert len(index) == 2
+    entries = list(index.entries.values())
+    # The first trace of a flow wins
+    assert entries[0]['stack'] == ['okhttp3.Call', 'com.example.Api']
+    assert entries[1]['stack'] == []
+
+
+def test_stack_index_reads_inline_stacks():
+    index = StackIndex.build([_trace(1000, stack=[{'class': 'a.B'}])])
+    assert [entry['stack'] for entry in index.entries.values()] == [['a.B']]
+
+
+def test_resolve_stack_of_socket_traces_and_dynamic_hooks():
+    stacks = {'s1': [{'class': 'a.B'}], 's2': ['c.D.e(D.java:1)']}
+    assert resolve_stack({'stack_id': 's1'}, stacks) == [{'class': 'a.B'}]
+    assert resolve_stack({'stack': [{'class': 'f.G'}], 'stack_id': 's1'}, stacks) == [{'class': 'f.G'}]
+    assert resolve_stack({'stacktrace_id': 's2'}, stacks) == ['c.D.e(D.java:1)']
+    assert resolve_stack({'stacktrace': ['h.I']}) == ['h.I']
+    assert resolve_stack({'stacktrace_id': 'unknown'}, stacks) is None
+
+
+def test_stack_index_sidecar_is_invalidated_when_the_traces_change(tmp_path):
+    traces_path = tmp_path / 'socket_trace.json'
+    traces_path.write_text(json.dumps([_trace(1000)]))
+    index = StackIndex.from_socket_trace_file(traces_path)
+    sidecar = tmp_path / 'socket_trace.json.cid_index.json'
+    assert sidecar.exists()
+    assert len(StackIndex.from_socket_trace_file(traces_path)) == len(index) == 1
+    traces_path.write_text(json.dumps([_trace(1000), _trace(1001)]))
+    assert len(StackIndex.from_socket_trace_file(traces_path)) == 2
+
+
+def test_attach_stacks():
+    index = StackIndex.build([_trace(1000, stack=[{'class': 'a.B'}])])
+    community_id = next(iter(index.entries))
+    records = list(attach_stacks([{'community_id': community_id}, {'community_id': 'other'}], index))
+    assert records[0]['process'] == 'com.example'
+    assert records[0]['stack'] == ['a.B']
+    assert records[1]['stack'] is None
+
+
+def _ek_lines(bodies: list) -> list:
+    lines = []
+    for i, body in enumerate(bodies):
+        lines.append(json.dumps({'index': {'_index': 'packets'}}) + '\n')
+        lines.append(json.dumps({'timestamp': str(i), 'layers': {
+            'frame': {'frame_frame_protocols': 'eth:ethertype:ip:tcp:tls:http2'},
+            'eth': {'eth_eth_src': '00:00:00:00:00:01', 'eth_eth_dst': '00:00:00:00:00:02'},
+            'ip': {'ip_ip_src': '10.0.0.2', 'ip_ip_dst': '1.1.1.1'},
+            'communityid_communityid': f'1:flow{i}',
+            'http2': {'http2_http2_data_data': ':'.join(f'{b:02x}' for b in body)},
+        }}) + '\n')
+    return lines
+
+
+def _comparable(record: dict) -> dict:
+    record = serializable_record(record)
+    if isinstance(record['data'], dict):
+        # Each run writes its blobs to its own folder
+        record['data'] = dict(record['data'], blob=Path(record['data']['blob']).name)
+    return record
+
+
+def test_parallel_dissection_keeps_the_order_and_content(tmp_path):
+    bodies = [f'body {i}'.encode() for i in range(100)]
+    bodies[10] = bytes(range(256)) * (LARGE_BODY_THRESHOLD // 256 + 1)
+    bodies[77] = b'x' * LARGE_BODY_THRESHOLD
+    lines = _ek_lines(bodies)
+    try:
+        sequential = list(dissect_ek_lines(lines, jobs=1, blob_dir=tmp_path / 'sequential'))
+        parallel = list(dissect_ek_lines(iter(lines), jobs=4, chunk_size=3, blob_dir=tmp_path / 'parallel'))
+    finally:
+        set_blob_dir(None)
+    assert len(sequential) == len(parallel) == 100
+    assert [_comparable(r) for r in parallel] == [_comparable(r) for r in sequential]
+    assert [r['community_id'] for r in parallel] == [f'1:flow{i}' for i in range(100)]
+    for i in (10, 77):
+        assert parallel[i]['data'].is_spilled
+        assert Path(parallel[i]['data'].blob_path).parent == tmp_path / 'parallel'
+        assert parallel[i]['data'].read() == sequential[i]['data'].read() == bodies[i]
+    assert parallel[0]['data'].read() == b'body 0'